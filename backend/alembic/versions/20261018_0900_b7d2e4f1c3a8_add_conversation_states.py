@@ -0,0 +1,31 @@
+"""Add conversation_states table for the shared state store
+
+Revision ID: b7d2e4f1c3a8
+Revises: a1124e2adddc
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b7d2e4f1c3a8"
+down_revision = "a1124e2adddc"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversation_states",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("conversation_states")
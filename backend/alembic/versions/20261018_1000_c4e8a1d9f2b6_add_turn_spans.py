@@ -0,0 +1,43 @@
+"""Add turn_spans table for end-to-end turn tracing
+
+Revision ID: c4e8a1d9f2b6
+Revises: b7d2e4f1c3a8
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c4e8a1d9f2b6"
+down_revision = "b7d2e4f1c3a8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "turn_spans",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("turn_id", sa.String(), nullable=False),
+        sa.Column("conversation_id", sa.String(), nullable=True),
+        sa.Column("endpoint", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("duration_ms", sa.Float(), nullable=True),
+        sa.Column("ttfb_ms", sa.Float(), nullable=True),
+        sa.Column("attributes", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_turn_spans_turn_id", "turn_spans", ["turn_id"])
+    op.create_index("ix_turn_spans_conversation_id", "turn_spans", ["conversation_id"])
+    op.create_index("ix_turn_spans_started_at", "turn_spans", ["started_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_turn_spans_started_at", table_name="turn_spans")
+    op.drop_index("ix_turn_spans_conversation_id", table_name="turn_spans")
+    op.drop_index("ix_turn_spans_turn_id", table_name="turn_spans")
+    op.drop_table("turn_spans")
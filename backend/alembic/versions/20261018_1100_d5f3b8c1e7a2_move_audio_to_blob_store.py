@@ -0,0 +1,134 @@
+"""Move message audio out of the messages table into the blob store
+
+Adds messages.audio_blob_key and messages.audio_size_bytes, then copies every
+inline audio_data value to the blob store configured by the AUDIO_BLOB_*
+environment variables (see blob_store.py) and nulls it, in batches of
+AUDIO_BLOB_MIGRATION_BATCH_SIZE rows. The copy runs outside the migration
+transaction and each row is committed as it is moved, so an interrupted
+upgrade can simply be run again. The legacy audio_data column is kept.
+
+Revision ID: d5f3b8c1e7a2
+Revises: c4e8a1d9f2b6
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+import os
+
+import sqlalchemy as sa
+
+from alembic import context, op
+from blob_store import blob_store_from_env
+
+# revision identifiers, used by Alembic.
+revision = "d5f3b8c1e7a2"
+down_revision = "c4e8a1d9f2b6"
+branch_labels = None
+depends_on = None
+
+messages = sa.table(
+    "messages",
+    sa.column("id", sa.String),
+    sa.column("audio_data", sa.LargeBinary),
+    sa.column("audio_blob_key", sa.String),
+    sa.column("audio_size_bytes", sa.Integer),
+)
+
+
+def batch_size():
+    return int(os.getenv("AUDIO_BLOB_MIGRATION_BATCH_SIZE", "100"))
+
+
+def existing_columns():
+    return {
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("messages")
+    }
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        op.add_column(
+            "messages", sa.Column("audio_blob_key", sa.String(), nullable=True)
+        )
+        op.add_column(
+            "messages", sa.Column("audio_size_bytes", sa.Integer(), nullable=True)
+        )
+        print("Offline mode: run this upgrade online to move existing audio")
+        return
+
+    # A previous, interrupted run may already have added the columns
+    columns = existing_columns()
+    if "audio_blob_key" not in columns:
+        op.add_column(
+            "messages", sa.Column("audio_blob_key", sa.String(), nullable=True)
+        )
+    if "audio_size_bytes" not in columns:
+        op.add_column(
+            "messages", sa.Column("audio_size_bytes", sa.Integer(), nullable=True)
+        )
+
+    store = blob_store_from_env()
+    moved = 0
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        while True:
+            rows = connection.execute(
+                sa.select(messages.c.id, messages.c.audio_data)
+                .where(messages.c.audio_data.isnot(None))
+                .order_by(messages.c.id)
+                .limit(batch_size())
+            ).fetchall()
+            if not rows:
+                break
+            for message_id, audio_data in rows:
+                # The blob is written before the row points at it
+                key = store.put(bytes(audio_data))
+                connection.execute(
+                    messages.update()
+                    .where(messages.c.id == message_id)
+                    .values(
+                        audio_blob_key=key,
+                        audio_size_bytes=len(audio_data),
+                        audio_data=None,
+                    )
+                )
+            moved += len(rows)
+            print(f"Moved {moved} audio clip(s) to the {store.name} blob store")
+
+
+def downgrade() -> None:
+    if not context.is_offline_mode():
+        # Copy the audio back inline before its key is dropped. Blobs are left
+        # in the store, since identical clips may be shared.
+        store = blob_store_from_env()
+        last_id = ""
+        with op.get_context().autocommit_block():
+            connection = op.get_bind()
+            while True:
+                rows = connection.execute(
+                    sa.select(messages.c.id, messages.c.audio_blob_key)
+                    .where(
+                        messages.c.audio_blob_key.isnot(None),
+                        messages.c.audio_data.is_(None),
+                        messages.c.id > last_id,
+                    )
+                    .order_by(messages.c.id)
+                    .limit(batch_size())
+                ).fetchall()
+                if not rows:
+                    break
+                for message_id, key in rows:
+                    audio_data = store.get(key)
+                    if audio_data is None:
+                        raise RuntimeError(
+                            f"Audio blob {key} of message {message_id} is missing"
+                        )
+                    connection.execute(
+                        messages.update()
+                        .where(messages.c.id == message_id)
+                        .values(audio_data=audio_data)
+                    )
+                last_id = rows[-1][0]
+
+    op.drop_column("messages", "audio_size_bytes")
+    op.drop_column("messages", "audio_blob_key")
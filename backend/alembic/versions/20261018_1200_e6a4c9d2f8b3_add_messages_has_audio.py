@@ -0,0 +1,55 @@
+"""Add messages.has_audio and backfill the stored audio metadata
+
+has_audio and audio_size_bytes are written with each message so that
+listings, exports and statistics never read the audio itself. Rows that
+still hold inline audio_data get their size computed once here.
+
+Revision ID: e6a4c9d2f8b3
+Revises: d5f3b8c1e7a2
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e6a4c9d2f8b3"
+down_revision = "d5f3b8c1e7a2"
+branch_labels = None
+depends_on = None
+
+messages = sa.table(
+    "messages",
+    sa.column("audio_data", sa.LargeBinary),
+    sa.column("audio_blob_key", sa.String),
+    sa.column("audio_size_bytes", sa.Integer),
+    sa.column("has_audio", sa.Boolean),
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages",
+        sa.Column("has_audio", sa.Boolean(), server_default=sa.false(), nullable=False),
+    )
+    op.execute(
+        messages.update()
+        .where(
+            sa.or_(
+                messages.c.audio_blob_key.isnot(None),
+                messages.c.audio_data.isnot(None),
+            )
+        )
+        .values(
+            has_audio=True,
+            audio_size_bytes=sa.func.coalesce(
+                messages.c.audio_size_bytes, sa.func.length(messages.c.audio_data)
+            ),
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("messages", "has_audio")
@@ -0,0 +1,52 @@
+"""Add indexes for the conversation and message queries
+
+messages (conversation_id, created_at) serves every per-conversation read in
+creation order. conversations (created_at), (session_id, created_at) and
+(phenomenon, created_at) serve the newest-first listing and its filters.
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY, outside
+the migration transaction, so writes are not blocked while they are built.
+
+Revision ID: f7b5d0e3a9c4
+Revises: e6a4c9d2f8b3
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f7b5d0e3a9c4"
+down_revision = "e6a4c9d2f8b3"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    (
+        "ix_messages_conversation_id_created_at",
+        "messages",
+        ["conversation_id", "created_at"],
+    ),
+    ("ix_conversations_created_at", "conversations", ["created_at"]),
+    (
+        "ix_conversations_session_id_created_at",
+        "conversations",
+        ["session_id", "created_at"],
+    ),
+    (
+        "ix_conversations_phenomenon_created_at",
+        "conversations",
+        ["phenomenon", "created_at"],
+    ),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,36 @@
+"""Delete turn start rows left in conversation_states
+
+Turn start times used for latency logging are no longer kept in the shared
+state table. Rows written for turns whose speech was never requested were
+never removed, so they are deleted here.
+
+Revision ID: a8c6e1f4b2d7
+Revises: f7b5d0e3a9c4
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a8c6e1f4b2d7"
+down_revision = "f7b5d0e3a9c4"
+branch_labels = None
+depends_on = None
+
+conversation_states = sa.table("conversation_states", sa.column("key", sa.String))
+
+
+def upgrade() -> None:
+    op.execute(
+        conversation_states.delete().where(
+            conversation_states.c.key.like("turn-start:%")
+        )
+    )
+
+
+def downgrade() -> None:
+    # The deleted rows were transient latency timestamps
+    pass
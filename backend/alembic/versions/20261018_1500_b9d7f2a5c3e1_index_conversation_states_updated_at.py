@@ -0,0 +1,39 @@
+"""Index conversation_states.updated_at for the idle row cleanup
+
+DatabaseStateStore deletes rows that have not been updated for
+STATE_IDLE_TTL_SECONDS. On PostgreSQL the index is built with CREATE INDEX
+CONCURRENTLY, outside the migration transaction, so writes are not blocked
+while it is built.
+
+Revision ID: b9d7f2a5c3e1
+Revises: a8c6e1f4b2d7
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b9d7f2a5c3e1"
+down_revision = "a8c6e1f4b2d7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_conversation_states_updated_at",
+            "conversation_states",
+            ["updated_at"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_conversation_states_updated_at",
+            table_name="conversation_states",
+            postgresql_concurrently=True,
+        )
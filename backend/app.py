@@ -2,23 +2,53 @@ import base64
 import io
 import json
 import os
+import signal
+import sys
+import tempfile
 import time
 import uuid
-from collections import defaultdict
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from urllib.parse import quote_plus
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    request,
+    send_file,
+    stream_with_context,
+)
 from flask_cors import CORS
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI, OpenAIError
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import scoped_session, sessionmaker
 
-from models import Conversation, Message
+import deadlines
+import tracing
+from blob_store import blob_store_from_env
+from context_window import SUMMARY_PREFIX, ContextWindow, TokenCounter
+from deadlines import Hedger, TurnDeadlines
+from history_cache import HistoryCache
+from local_classifier import LocalClassifier
+from metrics import MetricsRegistry
+from models import Conversation, Message, TurnSpan
 from prompts.eval import reflection, scaffolding, scienceqa
 from prompts.scienceqa import level_0, level_1, level_2, level_3, level_4, no_question
+from providers import OpenAIProvider, StubProvider
+from registry import PromptRegistry
+from retrieval import parse_concept_list
+from speech_pipeline import pipeline_speech
+from state_store import DatabaseStateStore, InProcessStateStore
+from templates import build_prompt_values, compile_template
+from ttl_cache import TTLCache
+from tts_cache import TTSCache
+from write_behind import WriteBehindWriter
 
 load_dotenv()
 app = Flask(__name__)
@@ -34,18 +64,50 @@ if os.getenv("VUE_APP_URL"):
     allowed_origins.append(os.getenv("VUE_APP_URL"))
 CORS(app, resources={r"/*": {"origins": allowed_origins}})
 
-# Initialize OpenAI client
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-client = OpenAI(api_key=openai_api_key)
-
 # OpenAI Model Configuration
 OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4")
 OPENAI_WHISPER_MODEL = os.getenv("OPENAI_WHISPER_MODEL", "whisper-1")
 OPENAI_TTS_MODEL = os.getenv("OPENAI_TTS_MODEL", "tts-1")
 OPENAI_TTS_VOICE = os.getenv("OPENAI_TTS_VOICE", "alloy")
 OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "500"))
+# Client-wide limits; calls made while preparing a turn are further bounded
+# by the turn deadline (see budgeted_timeout)
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# Every model call goes through a provider. "stub" answers offline with the
+# canned outputs and simulated latencies of STUB_RESPONSES_FILE, for load
+# tests and benchmarks without network access or an API key.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+if LLM_PROVIDER == "stub":
+    provider = StubProvider.from_file(
+        os.getenv(
+            "STUB_RESPONSES_FILE",
+            os.path.join(os.path.dirname(__file__), "stub_responses.json"),
+        ),
+        latency_scale=float(os.getenv("STUB_LATENCY_SCALE", "1.0")),
+        seed=int(os.getenv("STUB_SEED", "0")),
+    )
+else:
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    # The httpx event hooks record each request's time to first byte on the
+    # current turn trace span
+    client = OpenAI(
+        api_key=openai_api_key,
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=DefaultHttpxClient(event_hooks=tracing.httpx_event_hooks()),
+    )
+    provider = OpenAIProvider(
+        client,
+        chat_model=OPENAI_CHAT_MODEL,
+        whisper_model=OPENAI_WHISPER_MODEL,
+        tts_model=OPENAI_TTS_MODEL,
+        tts_voice=OPENAI_TTS_VOICE,
+        max_tokens=OPENAI_MAX_TOKENS,
+    )
 
 # Database setup
 # Prioritize POSTGRES_* environment variables (set by docker-compose) over DATABASE_URL
@@ -86,13 +148,220 @@ else:
     else:
         print("Using DATABASE_URL from environment")
 
-engine = create_engine(database_url, pool_pre_ping=True)
+engine = create_engine(
+    database_url,
+    pool_pre_ping=True,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+)
 SessionLocal = scoped_session(
     sessionmaker(bind=engine, autocommit=False, autoflush=False)
 )
 
-# Global variable to track conversation start times
-conversation_start_times = {}
+# Prompt templates, phenomenon data and the knowledge graph are loaded once and
+# only re-read when a file's mtime changes
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2.0"))
+registry = PromptRegistry(check_interval=PROMPT_RELOAD_INTERVAL)
+
+# Knowledge retrieval: "llm" asks the model to pick concepts, "local" uses the
+# in-process BM25 index, "hybrid" uses the index and falls back to the LLM
+# when nothing scores above KNOWLEDGE_MIN_SCORE. Scores are the share of the
+# question a concept explains (0 to 1); a question half made of words the
+# knowledge graph does not know scores about 0.5.
+KNOWLEDGE_RETRIEVAL_MODE = os.getenv("KNOWLEDGE_RETRIEVAL_MODE", "llm").lower()
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "2"))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", "0.6"))
+print(f"Loaded prompt registry in {registry.stats()['last_load_ms']} ms")
+
+# Content-addressed on-disk cache of synthesized speech
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "curio_tts_cache")
+)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+TTS_CACHE_MAX_AGE = int(os.getenv("TTS_CACHE_MAX_AGE", "86400"))
+tts_cache = TTSCache(
+    TTS_CACHE_DIR,
+    max_bytes=TTS_CACHE_MAX_BYTES,
+    rescan_seconds=float(os.getenv("TTS_CACHE_RESCAN_SECONDS", "60")),
+)
+
+# Recorded user audio is kept out of the messages table in a content-addressed
+# blob store: AUDIO_BLOB_STORE=local (AUDIO_BLOB_DIR) or s3
+audio_store = blob_store_from_env()
+
+# Bounded pool for running the independent OpenAI calls of a turn concurrently
+CHAT_WORKER_THREADS = int(os.getenv("CHAT_WORKER_THREADS", "16"))
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# Tasks run in a copy of the submitting request's context so that their
+# spans are recorded on that request's turn trace
+turn_executor = tracing.ContextExecutor(
+    ThreadPoolExecutor(max_workers=CHAT_WORKER_THREADS, thread_name_prefix="curio-turn")
+)
+
+# Turn deadline: the evaluator, knowledge retrieval and transcription calls of
+# a turn are bounded by what is left of TURN_DEADLINE_SECONDS (0 disables
+# it). The reply itself and its speech only get the client-wide limits.
+turn_deadlines = TurnDeadlines(
+    budget_seconds=float(os.getenv("TURN_DEADLINE_SECONDS", "12")),
+    min_call_seconds=float(os.getenv("OPENAI_MIN_CALL_SECONDS", "3")),
+    max_call_seconds=OPENAI_TIMEOUT_SECONDS,
+)
+DEADLINE_ENDPOINTS = {"chat_completion", "chat_completion_stream", "voice_turn"}
+# Evaluator and knowledge retrieval calls are hedged on their own pool, since
+# knowledge retrieval itself runs on the turn executor
+hedger = Hedger(
+    tracing.ContextExecutor(
+        ThreadPoolExecutor(
+            max_workers=int(
+                os.getenv("HEDGE_WORKER_THREADS", str(CHAT_WORKER_THREADS * 2))
+            ),
+            thread_name_prefix="curio-hedge",
+        )
+    ),
+    enabled=os.getenv("HEDGE_CLASSIFIERS", "true").lower() == "true",
+    default_delay=float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "1.5")),
+    min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+)
+
+
+@app.before_request
+def start_turn_deadline():
+    if request.endpoint in DEADLINE_ENDPOINTS:
+        turn_deadlines.start()
+
+
+@app.teardown_request
+def clear_turn_deadline(_error=None):
+    deadlines.bind(None)
+
+
+def budgeted_timeout(optional=False):
+    """Timeout of a model call: what is left of the current turn's deadline"""
+    return turn_deadlines.call_timeout(optional)
+
+
+def hedged_completion(kind, messages, optional=False):
+    """Text of a short idempotent chat completion, hedged when it is slow"""
+    # The hedge doubles as the retry, so the attempts themselves do not retry
+    max_retries = 0 if hedger.enabled else OPENAI_MAX_RETRIES
+
+    def attempt():
+        return provider.complete(
+            messages, timeout=budgeted_timeout(optional), max_retries=max_retries
+        )
+
+    return hedger.call(kind, attempt)
+
+
+# Latency of each turn stage, exposed by /api/metrics in Prometheus format
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "stage_duration_seconds",
+    "Duration of one stage of a chat turn",
+    ["stage", "state", "phenomenon"],
+)
+
+
+@contextmanager
+def turn_stage(stage, state="", phenomenon=""):
+    """Time a turn stage into the stage histogram and the current turn trace.
+
+    Yields the labels, so that a stage whose labels are only known once it
+    has run (``json_parse``) can fill them in.
+    """
+    labels = {"state": state, "phenomenon": phenomenon}
+    start = time.perf_counter()
+    with tracing.span(stage) as current:
+        try:
+            yield labels
+        finally:
+            if current is not None:
+                current.attributes.update(labels)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, **labels)
+
+
+def request_labels(data):
+    """Stage labels of a request's ``state`` and ``image_path`` fields"""
+    data = data or {}
+    return {
+        "state": (data.get("state") or "greet").strip(),
+        "phenomenon": registry.resolve_phenomenon(data.get("image_path") or ""),
+    }
+
+
+# Turn tracing: spans of the requests that make up one spoken turn are stored
+# in turn_spans under a server-issued turn id echoed back in X-Turn-Id
+TURN_TRACING = os.getenv("TURN_TRACING", "true").lower() == "true"
+TRACED_ENDPOINTS = {
+    "transcribe_audio",
+    "chat_completion",
+    "chat_completion_stream",
+    "voice_turn",
+    "generate_speech",
+}
+
+
+@app.before_request
+def start_turn_trace():
+    if not TURN_TRACING or request.endpoint not in TRACED_ENDPOINTS:
+        return
+    turn_id = request.headers.get(tracing.TURN_ID_HEADER, "").strip()[:64]
+    g.turn_trace = tracing.TurnTrace(request.endpoint, turn_id or None)
+    tracing.bind(g.turn_trace)
+
+
+@app.after_request
+def add_turn_id_header(response):
+    trace = g.get("turn_trace")
+    if trace is not None:
+        response.headers[tracing.TURN_ID_HEADER] = trace.turn_id
+    return response
+
+
+@app.teardown_request
+def finish_turn_trace(_error=None):
+    # Streamed responses keep the request context (and delay this teardown)
+    # until their last event has been sent
+    trace = g.pop("turn_trace", None)
+    tracing.bind(None)
+    if trace is not None:
+        turn_executor.submit(save_trace, trace)
+
+
+def save_trace(trace):
+    spans = trace.finish()
+    db = SessionLocal()
+    try:
+        db.add_all(
+            [
+                TurnSpan(
+                    turn_id=trace.turn_id,
+                    conversation_id=trace.conversation_id,
+                    endpoint=trace.endpoint,
+                    name=span.name,
+                    started_at=span.started_at.replace(tzinfo=None),
+                    duration_ms=span.duration_ms,
+                    ttfb_ms=span.ttfb_ms,
+                    attributes=json.dumps(span.attributes),
+                )
+                for span in spans
+            ]
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error saving trace for turn {trace.turn_id}: {e}")
+    finally:
+        db.close()
+
+
+def latency_key():
+    """Key pairing a turn's start with its speech request for latency logging"""
+    trace = tracing.current_trace()
+    if trace is not None and trace.client_turn_id:
+        return trace.turn_id
+    return request.remote_addr  # Fallback when the client sends no turn id
+
 
 # System prompt for Curio
 CURIO_SYSTEM_PROMPT = """
@@ -101,36 +370,200 @@ You are Curio, a friendly and encouraging science chatbot for children aged 8-10
 </System Introduction>
 """
 
-state_history = defaultdict(list)
-scienceqa_history = defaultdict(list)
+# Evaluator and question-level templates are compiled once at import time
+EVAL_TEMPLATES = {
+    "scaffolding": compile_template(scaffolding),
+    "scienceqa": compile_template(scienceqa),
+    "reflection": compile_template(reflection),
+}
+QUESTION_LEVEL_TEMPLATES = {
+    "no_question": compile_template(no_question),
+    "irrelevant": compile_template(level_0),
+    "factual": compile_template(level_1),
+    "explanatory": compile_template(level_2),
+    "general_causal": compile_template(level_3),
+    "specific_causal": compile_template(level_4),
+}
+
+
+def load_message_states(conversation_id):
+    """Stored (role, state, evaluation_result) rows used to rebuild state"""
+    db = SessionLocal()
+    try:
+        return (
+            db.query(Message.role, Message.state, Message.evaluation_result)
+            .filter(Message.conversation_id == conversation_id)
+            .order_by(Message.created_at.asc(), Message.role.desc())
+            .all()
+        )
+    finally:
+        db.close()
 
 
-def state_classification(state, messages, phenomenon):
-    # Load prompt from the txt file
+# Per-conversation state machine history. "memory" keeps it in this process;
+# "database" shares it through conversation_states so several workers or
+# replicas can serve the same conversation.
+STATE_STORE = os.getenv("STATE_STORE", "memory").lower()
+if STATE_STORE == "database":
+    state_store = DatabaseStateStore(
+        SessionLocal,
+        loader=load_message_states,
+        ttl_seconds=float(os.getenv("STATE_IDLE_TTL_SECONDS", "3600")),
+        cleanup_seconds=float(os.getenv("STATE_CLEANUP_SECONDS", "300")),
+    )
+else:
+    state_store = InProcessStateStore(
+        loader=load_message_states,
+        max_entries=int(os.getenv("STATE_MAX_ENTRIES", "10000")),
+        ttl_seconds=float(os.getenv("STATE_IDLE_TTL_SECONDS", "3600")),
+    )
+
+# Start times of /api/chat turns, popped by the turn's /api/speech request to
+# log its total latency. Kept in this process only: when the speech request
+# lands on another worker the log line is skipped, and the turn's
+# voice-to-voice latency is still recorded by tracing.
+turn_starts = TTLCache(
+    max_entries=int(os.getenv("STATE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("STATE_IDLE_TTL_SECONDS", "3600")),
+)
+
+
+# Local fast path for the state and question-level classifiers. "shadow"
+# only scores local guesses against the LLM; "on" skips the LLM whenever the
+# local confidence clears LOCAL_CLASSIFIER_THRESHOLD.
+LOCAL_CLASSIFIER_MODE = os.getenv("LOCAL_CLASSIFIER_MODE", "shadow").lower()
+local_classifier = LocalClassifier(
+    threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.9")),
+    min_examples=int(os.getenv("LOCAL_CLASSIFIER_MIN_EXAMPLES", "200")),
+    mode=LOCAL_CLASSIFIER_MODE,
+)
+
+
+def load_classifier_examples():
+    """Labelled (decision, text, label) examples from stored user messages"""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Message.state, Message.content, Message.evaluation_result)
+            .filter(Message.role == "user", Message.evaluation_result.isnot(None))
+            .all()
+        )
+    finally:
+        db.close()
+    examples = []
+    for state, content, label in rows:
+        decision = classifier_decision(state)
+        if decision is not None:
+            examples.append((decision, content or "", label))
+    return examples
+
+
+def train_local_classifier():
+    try:
+        start = time.time()
+        examples = load_classifier_examples()
+        local_classifier.train(examples)
+        print(
+            f"Local classifier trained on {len(examples)} labelled messages "
+            f"in {time.time() - start:.2f}s"
+        )
+    except Exception as e:
+        print(f"Error training local classifier: {e}")
+
+
+def classifier_decision(state):
     if state in ["greet", "scaffolding"]:
-        eval_prompt = format_prompt(scaffolding, phenomenon, messages)
-    elif state in ["discover", "scienceqa"]:
-        eval_prompt = format_prompt(scienceqa, phenomenon, messages)
-    elif state in ["reflection"]:
-        eval_prompt = format_prompt(reflection, phenomenon, messages)
+        return "state"
+    if state in ["discover", "scienceqa"]:
+        return "level"
+    return None
+
 
-    messages = [{"role": "system", "content": eval_prompt}]
-    # print(f"messages: {messages}")
+if LOCAL_CLASSIFIER_MODE != "off":
+    turn_executor.submit(train_local_classifier)
+
+
+def load_message_history(conversation_id):
+    """Stored (role, content) rows of a conversation in chronological order"""
+    db = SessionLocal()
+    try:
+        return (
+            db.query(Message.role, Message.content)
+            .filter(Message.conversation_id == conversation_id)
+            .order_by(Message.created_at.asc(), Message.role.desc())
+            .all()
+        )
+    finally:
+        db.close()
 
-    response = client.chat.completions.create(
-        model=OPENAI_CHAT_MODEL, messages=messages, max_tokens=OPENAI_MAX_TOKENS
+
+# Server-side history for clients that send only the new message. With the
+# database state store another worker may have served the previous turn, so
+# the history is always read from the messages table there.
+history_cache = HistoryCache(
+    load_message_history,
+    max_entries=0
+    if STATE_STORE == "database"
+    else int(os.getenv("STATE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("STATE_IDLE_TTL_SECONDS", "3600")),
+)
+
+
+def summarize_history(previous_summary, messages):
+    """Fold ``messages`` into the rolling summary of a conversation"""
+    history = list(messages)
+    if previous_summary:
+        history.insert(
+            0, {"role": "system", "content": SUMMARY_PREFIX + previous_summary}
+        )
+    summary_prompt = registry.template("summarize").render(
+        {"conversation_history": json.dumps(history)}
     )
+    return provider.complete([{"role": "system", "content": summary_prompt}])
+
+
+# Conversation history sent with each turn is capped at CONTEXT_MAX_TOKENS;
+# older messages are replaced by a rolling summary (0 disables the cap)
+context_window = ContextWindow(
+    summarize_history,
+    turn_executor,
+    counter=TokenCounter(OPENAI_CHAT_MODEL),
+    max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "2000")),
+    keep_messages=int(os.getenv("CONTEXT_KEEP_MESSAGES", "8")),
+    max_entries=int(os.getenv("STATE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("STATE_IDLE_TTL_SECONDS", "3600")),
+)
 
-    # response = client.responses.create(
-    #         model="gpt-5",
-    #         input = messages,
-    #         reasoning={ "effort": "low" },
-    #     )
 
-    # content = response.output_text or ""
-    content = response.choices[0].message.content or ""
-    eval_state = content.strip().lower().replace("<", "").replace(">", "")
-    return eval_state
+def state_classification(state, prompt_values):
+    def llm_classification():
+        if state in ["greet", "scaffolding"]:
+            eval_prompt = EVAL_TEMPLATES["scaffolding"].render(prompt_values)
+        elif state in ["discover", "scienceqa"]:
+            eval_prompt = EVAL_TEMPLATES["scienceqa"].render(prompt_values)
+        elif state in ["reflection"]:
+            eval_prompt = EVAL_TEMPLATES["reflection"].render(prompt_values)
+
+        messages = [{"role": "system", "content": eval_prompt}]
+        # print(f"messages: {messages}")
+
+        content = hedged_completion("evaluator", messages)
+
+        # response = client.responses.create(
+        #         model="gpt-5",
+        #         input = messages,
+        #         reasoning={ "effort": "low" },
+        #     )
+
+        # content = response.output_text or ""
+        return content.strip().lower().replace("<", "").replace(">", "")
+
+    return local_classifier.classify(
+        classifier_decision(state),
+        prompt_values["child_question"],
+        llm_classification,
+        llm_errors=(OpenAIError,),
+    )
 
 
 def state_update(current_state, eval_state, state_history_list):
@@ -175,84 +608,45 @@ def state_update(current_state, eval_state, state_history_list):
 
 
 def state_prompt_classification(state, child_question_level=None):
-    if state == "greet":
-        return open("prompts/greet.txt", "r").read()
-    elif state == "scaffolding":
-        return open("prompts/scaffolding.txt", "r").read()
-    elif state == "discover":
-        return open("prompts/discover.txt", "r").read()
-    elif state == "scienceqa":
-        if child_question_level == "no_question":
-            return no_question
-        elif child_question_level == "irrelevant":
-            return level_0
-        elif child_question_level == "factual":
-            return level_1
-        elif child_question_level == "explanatory":
-            return level_2
-        elif child_question_level == "general_causal":
-            return level_3
-        elif child_question_level == "specific_causal":
-            return level_4
-    elif state == "reflection":
-        return open("prompts/reflection.txt", "r").read()
-    elif state == "close":
-        return open("prompts/close.txt", "r").read()
-    else:
-        return open("prompts/scienceqa.txt", "r").read()
+    if state == "scienceqa":
+        return QUESTION_LEVEL_TEMPLATES.get(child_question_level)
+    if state in ["greet", "scaffolding", "discover", "reflection", "close"]:
+        return registry.template(state)
+    return registry.template("scienceqa")
 
 
-def format_prompt(
-    state_prompt, phenomenon="balloon", messages=None, child_question_level=None
-):
-    if messages is None:
-        messages = []
+def build_turn_prompt_values(phenomenon, messages):
+    """Slot values shared by every prompt rendered during one turn"""
+    return build_prompt_values(registry.phenomenon(phenomenon), messages)
 
-    phenomenon_json = json.load(open("prompts/phenomenon.json", "r"))
-    phenomenon_data = phenomenon_json.get(phenomenon, {})
 
-    if "<Image Content>" in state_prompt:
-        state_prompt = state_prompt.replace(
-            "<Image Content>",
-            "<Image Content>\n" + phenomenon_data.get("image_content", ""),
-        )
-    if "<Scientific Phenomenon>" in state_prompt:
-        state_prompt = state_prompt.replace(
-            "<Scientific Phenomenon>",
-            "<Scientific Phenomenon>\n" + phenomenon_data.get("phenomenon", ""),
-        )
-    if "<Scientific Knowledge>" in state_prompt:
-        state_prompt = state_prompt.replace(
-            "<Scientific Knowledge>",
-            "<Scientific Knowledge>\n" + phenomenon_data.get("knowledge", ""),
-        )
+def knowledge_retrieval(prompt_values, phenomenon="balloon", state=""):
+    """Names of the knowledge graph concepts matching the child's latest message"""
+    phenomenon_key = registry.phenomenon_entry(phenomenon).knowledge
 
-    if "<Child's Question>" in state_prompt:
-        state_prompt = state_prompt.replace(
-            "<Child's Question>",
-            "<Child's Question>\n" + messages[-1]["content"].strip(),
-        )
-    if "<Conversation History>" in state_prompt:
-        state_prompt = state_prompt.replace(
-            "<Conversation History>", "<Conversation History>\n" + json.dumps(messages)
-        )
-    return state_prompt
+    with turn_stage("knowledge_retrieval", state=state, phenomenon=phenomenon):
+        if KNOWLEDGE_RETRIEVAL_MODE in ["local", "hybrid"]:
+            concepts = local_knowledge_retrieval(prompt_values, phenomenon_key)
+            if concepts or KNOWLEDGE_RETRIEVAL_MODE == "local":
+                return concepts
+        return llm_knowledge_retrieval(prompt_values, phenomenon_key)
 
 
-def knowledge_retrieval(messages, phenomenon="balloon"):
-    # Load prompt from the txt file
-    retrieval_prompt = open("prompts/knowledge_matching.txt", "r").read()
-    retrieval_prompt = format_prompt(retrieval_prompt, phenomenon, messages)
-    knowledge_base = open("knowledge/kg.json", "r").read()
-    knowledge_base = json.loads(knowledge_base)
+def local_knowledge_retrieval(prompt_values, phenomenon_key):
+    start = time.perf_counter()
+    results = registry.knowledge_index(phenomenon_key).search(
+        prompt_values["child_question"],
+        k=KNOWLEDGE_TOP_K,
+        min_score=KNOWLEDGE_MIN_SCORE,
+    )
+    elapsed_us = (time.perf_counter() - start) * 1e6
+    print(f"local retrieval ({elapsed_us:.0f} us): {results}")
+    return [name for name, _ in results]
 
-    # Map phenomenon to knowledge base key
-    phenomenon_map = {
-        "balloon": "Hair stands up near a balloon",
-        "bend": "Bending Water Stream with a Comb",
-        "pepper": "Pepper Leaping up to Spoon",
-    }
-    phenomenon_key = phenomenon_map.get(phenomenon, "Hair stands up near a balloon")
+
+def llm_knowledge_retrieval(prompt_values, phenomenon_key):
+    retrieval_prompt = registry.template("knowledge_matching").render(prompt_values)
+    knowledge_base = registry.knowledge()
 
     knowledge_concepts = list(knowledge_base[phenomenon_key]["concepts"].keys())
 
@@ -264,10 +658,16 @@ def knowledge_retrieval(messages, phenomenon="balloon"):
     )
 
     print(f"retrieval_prompt: {retrieval_prompt}")
+    if not turn_deadlines.has_budget():
+        turn_deadlines.skip("knowledge_retrieval")
+        return []
     messages = [{"role": "system", "content": retrieval_prompt}]
-    response = client.chat.completions.create(
-        model=OPENAI_CHAT_MODEL, messages=messages, max_tokens=OPENAI_MAX_TOKENS
-    )
+    try:
+        content = hedged_completion("knowledge_retrieval", messages, optional=True)
+    except OpenAIError as e:
+        # Knowledge components are optional; reply without them
+        print(f"Knowledge retrieval failed: {e}")
+        return []
 
     # response = client.responses.create(
     #         model="gpt-5",
@@ -276,58 +676,34 @@ def knowledge_retrieval(messages, phenomenon="balloon"):
     #     )
 
     # content = response.output_text or ""
-    content = response.choices[0].message.content or ""
-    kg_raw = content.strip().lower()
-    # print(f"kg_raw: {kg_raw}")
-    return kg_raw
+    return parse_concept_list(content.strip(), knowledge_concepts)
 
 
-def format_kg(mode="definition", kg_raw="", phenomenon="balloon"):
-    knowledge_base = open("knowledge/kg.json", "r").read()
-    knowledge_base = json.loads(knowledge_base)
+def collect_knowledge(kg_future, prompt_values, phenomenon, state):
+    """Use the speculative retrieval result if one was started, else retrieve now"""
+    if kg_future is not None:
+        # The retrieval is timed where it runs; this is how long the turn
+        # still had to wait for it
+        with turn_stage("knowledge_wait", state=state, phenomenon=phenomenon):
+            try:
+                return kg_future.result(
+                    timeout=turn_deadlines.call_timeout(optional=True)
+                )
+            except FutureTimeoutError:
+                kg_future.cancel()
+                turn_deadlines.skip("knowledge_retrieval")
+                return []
+    return knowledge_retrieval(prompt_values, phenomenon, state)
 
-    # Map phenomenon to knowledge base key
-    phenomenon_map = {
-        "balloon": "Hair stands up near a balloon",
-        "bend": "Bending Water Stream with a Comb",
-        "pepper": "Pepper Leaping up to Spoon",
-    }
-    phenomenon_key = phenomenon_map.get(phenomenon, "Hair stands up near a balloon")
 
-    try:
-        kg_list = json.loads(kg_raw)
-        kg_content = ""
-        for component in kg_list:
-            definition = knowledge_base[phenomenon_key]["concepts"][component][
-                "definition"
-            ]
-            explanation = knowledge_base[phenomenon_key]["concepts"][component][
-                "explanation"
-            ]
-            if mode == "definition":
-                kg_content += (
-                    "'" + component + "':\n\nDefinition: " + definition + "\n\n"
-                )
-            elif mode == "explanation":
-                kg_content += (
-                    "'" + component + "':\n\nExplanation: " + explanation + "\n\n"
-                )
-            elif mode == "definition_and_explanation":
-                kg_content += (
-                    "'"
-                    + component
-                    + "':\n\nDefinition: "
-                    + definition
-                    + "\n\nExplanation: "
-                    + explanation
-                    + "\n\n"
-                )
-        kg_content = kg_content.strip()
-        print(f"kg_content: {kg_content}")
-        return kg_content
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"Error processing knowledge graph: {e}")
-        return ""
+def format_kg(mode="definition", concepts=(), phenomenon="balloon"):
+    phenomenon_key = registry.phenomenon_entry(phenomenon).knowledge
+
+    kg_content = "\n\n".join(
+        registry.knowledge_snippets(phenomenon_key, concepts, mode)
+    )
+    print(f"kg_content: {kg_content}")
+    return kg_content
 
 
 def encode_image(image_path):
@@ -343,6 +719,7 @@ def health():
             {
                 "status": "healthy",
                 "service": "curio2-backend",
+                "provider": provider.name,
                 "timestamp": datetime.now(timezone.utc).isoformat(),
             }
         ),
@@ -350,6 +727,64 @@ def health():
     )
 
 
+@app.route("/api/registry", methods=["GET"])
+def registry_stats():
+    """Report prompt registry load and reload timings"""
+    return jsonify(registry.stats()), 200
+
+
+def transcribe(filename, audio_bytes, labels):
+    """Transcribe recorded audio bytes with OpenAI Whisper"""
+    with turn_stage("transcription", **labels):
+        return provider.transcribe(filename, audio_bytes, timeout=budgeted_timeout())
+
+
+@app.route("/api/classifier", methods=["GET"])
+def classifier_stats():
+    """Report local classifier hits, LLM fallbacks and agreement with the LLM"""
+    return jsonify(local_classifier.stats()), 200
+
+
+@app.route("/api/context", methods=["GET"])
+def context_window_stats():
+    """Report context compression: summaries, refreshes and tokens saved"""
+    return jsonify(context_window.stats()), 200
+
+
+@app.route("/api/deadlines", methods=["GET"])
+def deadline_stats():
+    """Report turn deadline skips and evaluator hedging"""
+    return jsonify(
+        {"deadlines": turn_deadlines.stats(), "hedging": hedger.stats()}
+    ), 200
+
+
+@app.route("/api/write-behind", methods=["GET"])
+def write_behind_stats():
+    """Report write-behind queue depth, batches and flush latency"""
+    if write_behind is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **write_behind.stats()}), 200
+
+
+@app.route("/api/history-cache", methods=["GET"])
+def history_cache_stats():
+    """Report server-side history cache size, hit rate and database loads"""
+    return jsonify(history_cache.stats()), 200
+
+
+@app.route("/api/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Stage latency histograms and component stats in Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/state-store", methods=["GET"])
+def state_store_stats():
+    """Report conversation state store size, hit rate and evictions"""
+    return jsonify(state_store.stats()), 200
+
+
 @app.route("/api/transcribe", methods=["POST"])
 def transcribe_audio():
     """Transcribe audio using OpenAI Whisper API"""
@@ -362,236 +797,652 @@ def transcribe_audio():
         # Read the file content as bytes
         audio_bytes = audio_file_storage.read()
 
-        # Create a BytesIO object from the bytes
-        audio_file = io.BytesIO(audio_bytes)
-
         # Get filename or use default
         filename = audio_file_storage.filename or "audio.webm"
 
-        # Call OpenAI Whisper API from backend
-        # OpenAI API expects (filename, file-like object) tuple
-        transcript = client.audio.transcriptions.create(
-            model=OPENAI_WHISPER_MODEL,
-            file=(filename, audio_file),
-            response_format="json",
-        )
-
-        return jsonify({"text": transcript.text}), 200
+        return jsonify(
+            {
+                "text": transcribe(filename, audio_bytes, request_labels(request.form)),
+                "turn_id": tracing.current_turn_id(),
+            }
+        ), 200
 
     except Exception as e:
         app.logger.error(f"Transcription error: {str(e)}")
         return jsonify({"error": "Transcription failed"}), 500
 
 
-@app.route("/api/chat", methods=["POST"])
-def chat_completion():
-    """Generate chat response and a next_state using OpenAI"""
-    db = SessionLocal()
-    try:
-        # Record start time for latency tracking
-        start_time = time.time()
-        request_session_id = request.remote_addr  # Fallback session identifier
-        conversation_start_times[request_session_id] = start_time
+def prepare_turn(data, request_session_id, user_audio_bytes=None):
+    """Run the state machine for one turn and build the generation messages.
+
+    Does not touch the database, so no connection is held while waiting on
+    OpenAI; ``finish_turn`` persists the conversation, the user message and
+    the assistant reply in one short transaction. The user's recording is
+    taken from ``user_audio_bytes`` when given, otherwise from the base64
+    ``user_audio`` field of ``data``.
+    """
+    received_at = datetime.utcnow()
+    labels = request_labels(data)
+    state = labels["state"]
+    image_path = data.get("image_path", "")  # Get the selected image path
+    session_identifier = (data.get("session_id") or request_session_id or "").strip()
+    conversation_id = (data.get("conversation_id") or str(uuid.uuid4())).strip()
+    tracing.set_conversation(conversation_id)
+
+    if "messages" in data:
+        messages = data.get("messages") or []
+    else:
+        # Delta protocol: only the new message is sent and the history is
+        # rebuilt on the server
+        messages = history_cache.get(conversation_id)
+        new_message = data.get("message")
+        if isinstance(new_message, str):
+            new_message = {"role": "user", "content": new_message}
+        if new_message:
+            messages.append(new_message)
+    history = messages
+    # Messages the client sent before this turn's (its greeting). They are
+    # stored with the conversation's first turn, so that a history rebuilt
+    # from the database has the same messages as the cached one.
+    earlier_messages = []
+    if "messages" in data:
+        earlier_messages = list(messages)
+        if earlier_messages and earlier_messages[-1].get("role") == "user":
+            earlier_messages.pop()
+    user_audio_b64 = data.get("user_audio")
+    user_audio_mime_type = data.get("user_audio_mime_type")
+
+    if user_audio_bytes is None and user_audio_b64:
+        try:
+            user_audio_bytes = base64.b64decode(user_audio_b64)
+        except (ValueError, TypeError) as audio_error:
+            print(
+                f"Failed to decode user audio for conversation {conversation_id}: {audio_error}"
+            )
 
-        data = request.get_json()
-        messages = data.get("messages", [])
-        state = (data.get("state") or "greet").strip()
-        image_path = data.get("image_path", "")  # Get the selected image path
-        session_identifier = (
-            data.get("session_id") or request_session_id or ""
-        ).strip()
-        conversation_id = (data.get("conversation_id") or str(uuid.uuid4())).strip()
-        user_audio_b64 = data.get("user_audio")
-        user_audio_mime_type = data.get("user_audio_mime_type")
-
-        user_audio_bytes = None
-        if user_audio_b64:
-            try:
-                user_audio_bytes = base64.b64decode(user_audio_b64)
-            except (ValueError, TypeError) as audio_error:
-                print(
-                    f"Failed to decode user audio for conversation {conversation_id}: {audio_error}"
-                )
+    latest_user_message = ""
+    if messages:
+        last_message = messages[-1]
+        if last_message.get("role") == "user":
+            latest_user_message = last_message.get("content", "")
 
-        latest_user_message = ""
-        if messages:
-            last_message = messages[-1]
-            if last_message.get("role") == "user":
-                latest_user_message = last_message.get("content", "")
-
-        # Determine the phenomenon based on image path
-        if "balloon.jpg" in image_path:
-            phenomenon = "balloon"
-        elif "bend.jpg" in image_path:
-            phenomenon = "bend"
-        elif "pepper.jpg" in image_path:
-            phenomenon = "pepper"
-        else:
-            phenomenon = "balloon"  # default fallback
-
-        conversation = db.get(Conversation, conversation_id)
-        if not conversation:
-            conversation = Conversation(
-                id=conversation_id,
-                session_id=session_identifier or str(uuid.uuid4()),
-                image_path=image_path,
-                phenomenon=phenomenon,
-                started_at=datetime.utcnow(),
-            )
-            db.add(conversation)
-
-        conv_state_history = state_history[conversation_id]
-        conv_scienceqa_history = scienceqa_history[conversation_id]
-
-        eval_state = None
-        if state != "scienceqa":
-            print(f"state: {state}")
-            eval_state = state_classification(state, messages, phenomenon)
-            print(f"eval_state: {eval_state}")
-            current_state = state_update(state, eval_state, conv_state_history)
-            print(f"current_state: {current_state}")
-
-            # If transitioning to scienceqa, classify the question level immediately
-            if current_state == "scienceqa":
-                child_question_level = state_classification(state, messages, phenomenon)
-                conv_scienceqa_history.append(child_question_level)
-                print(f"child_question_level: {child_question_level}")
-                print(f"scienceqa_history: {conv_scienceqa_history}")
-                state_prompt = state_prompt_classification(
-                    current_state, child_question_level
-                )
+    # Determine the phenomenon based on image path
+    phenomenon = labels["phenomenon"]
+
+    def stage_labels(stage):
+        return {"stage": stage, "state": state, "phenomenon": phenomenon}
+
+    # Older turns are folded into a rolling summary once the history exceeds
+    # the token budget; the compressed history feeds every prompt this turn
+    messages = context_window.window(conversation_id, messages)
+
+    # Serialize the history once and share it across every prompt this turn
+    prompt_values = build_turn_prompt_values(phenomenon, messages)
+
+    conversation_state = state_store.get(conversation_id)
+    conv_state_history = conversation_state.state_history
+    conv_scienceqa_history = conversation_state.scienceqa_history
+
+    # Knowledge retrieval only depends on the history, so start it
+    # speculatively while the state and question level are classified. The
+    # result is discarded if the turn turns out not to need it.
+    kg_future = None
+    if SPECULATIVE_RETRIEVAL and state in ["discover", "scienceqa", "reflection"]:
+        kg_future = turn_executor.submit(
+            knowledge_retrieval, prompt_values, phenomenon, state
+        )
+
+    eval_state = None
+    if state != "scienceqa":
+        print(f"state: {state}")
+        with turn_stage(**stage_labels("state_classification")):
+            eval_state = state_classification(state, prompt_values)
+        print(f"eval_state: {eval_state}")
+        current_state = state_update(state, eval_state, conv_state_history)
+        print(f"current_state: {current_state}")
+
+        # If transitioning to scienceqa, classify the question level immediately
+        if current_state == "scienceqa":
+            if state == "discover":
+                # The discover evaluator already is the question-level
+                # classifier, so reuse its label instead of asking again
+                child_question_level = eval_state
             else:
-                child_question_level = None
-                state_prompt = state_prompt_classification(current_state)
+                with turn_stage(**stage_labels("question_classification")):
+                    child_question_level = state_classification(
+                        "scienceqa", prompt_values
+                    )
+            conv_scienceqa_history.append(child_question_level)
+            print(f"child_question_level: {child_question_level}")
+            print(f"scienceqa_history: {conv_scienceqa_history}")
+            state_prompt = state_prompt_classification(
+                current_state, child_question_level
+            )
         else:
-            # Check if we should move to reflection based on qualified questions
-            qualified_question_num = sum(
-                1
-                for question in conv_scienceqa_history
-                if question in ["explanatory", "general_causal", "specific_causal"]
+            child_question_level = None
+            state_prompt = state_prompt_classification(current_state)
+    else:
+        # Check if we should move to reflection based on qualified questions
+        qualified_question_num = sum(
+            1
+            for question in conv_scienceqa_history
+            if question in ["explanatory", "general_causal", "specific_causal"]
+        )
+
+        if qualified_question_num > 2:
+            current_state = "reflection"
+            state_prompt = state_prompt_classification(current_state)
+            child_question_level = None
+        else:
+            # Classify the child's question level
+            with turn_stage(**stage_labels("question_classification")):
+                child_question_level = state_classification(state, prompt_values)
+            conv_scienceqa_history.append(child_question_level)
+            print(f"child_question_level: {child_question_level}")
+            print(f"scienceqa_history: {conv_scienceqa_history}")
+            current_state = "scienceqa"  # Stay in scienceqa state
+            state_prompt = state_prompt_classification(
+                current_state, child_question_level
             )
+        if not conv_state_history or conv_state_history[-1] != current_state:
+            conv_state_history.append(current_state)
+        eval_state = current_state
 
-            if qualified_question_num > 2:
-                current_state = "reflection"
-                state_prompt = state_prompt_classification(current_state)
-                child_question_level = None
-            else:
-                # Classify the child's question level
-                child_question_level = state_classification(state, messages, phenomenon)
-                conv_scienceqa_history.append(child_question_level)
-                print(f"child_question_level: {child_question_level}")
-                print(f"scienceqa_history: {conv_scienceqa_history}")
-                current_state = "scienceqa"  # Stay in scienceqa state
-                state_prompt = state_prompt_classification(
-                    current_state, child_question_level
-                )
-            if not conv_state_history or conv_state_history[-1] != current_state:
-                conv_state_history.append(current_state)
-            eval_state = current_state
-
-        if current_state in ["scienceqa", "reflection"]:
-            if current_state == "scienceqa" and child_question_level in [
-                "factual",
-                "explanatory",
-                "general_causal",
-                "specific_causal",
-            ]:
-                kg = knowledge_retrieval(messages, phenomenon)
-                print(f"kg: {kg}")
-                if kg != "":
-                    if child_question_level in [
-                        "explanatory",
-                        "general_causal",
-                        "specific_causal",
-                    ]:
-                        state_prompt = (
-                            state_prompt
-                            + "\n\n<Relevant Knowledge Components>\n"
-                            + format_kg("definition_and_explanation", kg, phenomenon)
-                            + "\n</Relevant Knowledge Components>"
-                        )
-                    elif child_question_level == "factual":
-                        state_prompt = (
-                            state_prompt
-                            + "\n\n<Relevant Knowledge Components>\n"
-                            + format_kg("definition", kg, phenomenon)
-                            + "\n</Relevant Knowledge Components>"
-                        )
-            elif current_state == "reflection":
-                kg = knowledge_retrieval(messages, phenomenon)
-                print(f"kg: {kg}")
-                if kg != "":
+    state_prompt = state_prompt.render(prompt_values)
+
+    needs_kg = current_state == "reflection" or (
+        current_state == "scienceqa"
+        and child_question_level
+        in ["factual", "explanatory", "general_causal", "specific_causal"]
+    )
+    if not needs_kg and kg_future is not None:
+        kg_future.cancel()
+
+    if current_state in ["scienceqa", "reflection"]:
+        if current_state == "scienceqa" and needs_kg:
+            kg = collect_knowledge(kg_future, prompt_values, phenomenon, state)
+            print(f"kg: {kg}")
+            if kg:
+                if child_question_level in [
+                    "explanatory",
+                    "general_causal",
+                    "specific_causal",
+                ]:
                     state_prompt = (
                         state_prompt
                         + "\n\n<Relevant Knowledge Components>\n"
                         + format_kg("definition_and_explanation", kg, phenomenon)
                         + "\n</Relevant Knowledge Components>"
                     )
+                elif child_question_level == "factual":
+                    state_prompt = (
+                        state_prompt
+                        + "\n\n<Relevant Knowledge Components>\n"
+                        + format_kg("definition", kg, phenomenon)
+                        + "\n</Relevant Knowledge Components>"
+                    )
+        elif current_state == "reflection":
+            kg = collect_knowledge(kg_future, prompt_values, phenomenon, state)
+            print(f"kg: {kg}")
+            if kg:
+                state_prompt = (
+                    state_prompt
+                    + "\n\n<Relevant Knowledge Components>\n"
+                    + format_kg("definition_and_explanation", kg, phenomenon)
+                    + "\n</Relevant Knowledge Components>"
+                )
 
-        if current_state == "scienceqa" and child_question_level is not None:
-            state_prompt = format_prompt(
-                state_prompt, phenomenon, messages, child_question_level
-            )
-        else:
-            state_prompt = format_prompt(state_prompt, phenomenon, messages)
-
-        user_evaluation_result = child_question_level or eval_state or current_state
-
-        if latest_user_message:
-            user_message_record = Message(
-                conversation_id=conversation.id,
-                role="user",
-                content=latest_user_message,
-                state=state,
-                evaluation_result=user_evaluation_result,
-                audio_data=user_audio_bytes,
-                audio_mime_type=user_audio_mime_type,
+    user_evaluation_result = child_question_level or eval_state or current_state
+
+    if current_state == "close":
+        state_store.delete(conversation_id)
+        context_window.forget(conversation_id)
+        history_cache.forget(conversation_id)
+    else:
+        state_store.save(conversation_id, conversation_state)
+
+    system_message = {"role": "system", "content": CURIO_SYSTEM_PROMPT}
+
+    all_messages = (
+        [system_message] + messages + [{"role": "user", "content": state_prompt}]
+    )
+
+    return {
+        "conversation_id": conversation_id,
+        "session_id": session_identifier,
+        "image_path": image_path,
+        "phenomenon": phenomenon,
+        "state": state,
+        "current_state": current_state,
+        "user_message": latest_user_message,
+        "user_evaluation_result": user_evaluation_result,
+        "user_audio": user_audio_bytes,
+        "user_audio_mime_type": user_audio_mime_type,
+        "messages": all_messages,
+        "history": history,
+        "earlier_messages": earlier_messages,
+        "received_at": received_at,
+    }
+
+
+def store_turn(db, record):
+    """Add a finished turn's conversation update and messages to ``db``"""
+    conversation = db.get(Conversation, record["conversation_id"])
+    if not conversation:
+        conversation = Conversation(
+            id=record["conversation_id"],
+            session_id=record["session_id"] or str(uuid.uuid4()),
+            image_path=record["image_path"],
+            phenomenon=record["phenomenon"],
+            started_at=record["received_at"],
+        )
+        db.add(conversation)
+        earlier_messages = record["earlier_messages"]
+        for position, message in enumerate(earlier_messages):
+            db.add(
+                Message(
+                    conversation_id=conversation.id,
+                    role=message.get("role"),
+                    content=message.get("content") or "",
+                    has_audio=False,
+                    # Just before the turn's user message, in client order
+                    created_at=record["received_at"]
+                    - timedelta(milliseconds=len(earlier_messages) - position),
+                )
             )
-            db.add(user_message_record)
-
-        conversation.image_path = image_path
-        conversation.phenomenon = phenomenon
-        conversation.updated_at = datetime.utcnow()
-        if user_evaluation_result:
-            conversation.evaluation_result = user_evaluation_result
-        if current_state == "close" and not conversation.finished_at:
-            conversation.finished_at = datetime.utcnow()
-        if current_state == "close":
-            state_history.pop(conversation_id, None)
-            scienceqa_history.pop(conversation_id, None)
-
-        system_message = {"role": "system", "content": CURIO_SYSTEM_PROMPT}
-
-        all_messages = (
-            [system_message] + messages + [{"role": "user", "content": state_prompt}]
+
+    if record["user_message"]:
+        audio_blob_key = record["user_audio_blob_key"]
+        user_message_record = Message(
+            conversation_id=conversation.id,
+            role="user",
+            content=record["user_message"],
+            state=record["state"],
+            evaluation_result=record["user_evaluation_result"],
+            audio_blob_key=audio_blob_key,
+            has_audio=audio_blob_key is not None,
+            audio_size_bytes=record["user_audio_size_bytes"],
+            audio_mime_type=record["user_audio_mime_type"],
+            created_at=record["received_at"],
         )
+        db.add(user_message_record)
+
+    conversation.image_path = record["image_path"]
+    conversation.phenomenon = record["phenomenon"]
+    conversation.updated_at = record["stored_at"]
+    if record["user_evaluation_result"]:
+        conversation.evaluation_result = record["user_evaluation_result"]
+    if record["current_state"] == "close" and not conversation.finished_at:
+        conversation.finished_at = record["stored_at"]
+
+    assistant_message_record = Message(
+        conversation_id=conversation.id,
+        role="assistant",
+        content=record["content"],
+        state=record["current_state"],
+        # Set like the user message's, so both go in one INSERT
+        has_audio=False,
+        created_at=record["stored_at"],
+    )
+    db.add(assistant_message_record)
+
+
+# With WRITE_BEHIND=true finished turns are queued and stored in batches by a
+# background writer instead of being committed before the response is sent.
+# Queued turns are not yet visible to other workers, so this requires the
+# in-process state store.
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+if WRITE_BEHIND and STATE_STORE == "database":
+    raise ValueError("WRITE_BEHIND requires STATE_STORE=memory")
+write_behind = None
+if WRITE_BEHIND:
+    write_behind = WriteBehindWriter(
+        SessionLocal,
+        store_turn,
+        max_queue=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "1000")),
+        batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50")),
+        block_seconds=float(os.getenv("WRITE_BEHIND_BLOCK_SECONDS", "1.0")),
+        retries=int(os.getenv("WRITE_BEHIND_RETRIES", "3")),
+        retry_seconds=float(os.getenv("WRITE_BEHIND_RETRY_SECONDS", "0.5")),
+        dead_letter_path=os.getenv(
+            "WRITE_BEHIND_DEAD_LETTER_PATH",
+            os.path.join(os.path.dirname(__file__), "write_behind_dead_letters.jsonl"),
+        ),
+        flush_seconds=metrics.histogram(
+            "write_behind_flush_seconds",
+            "Duration of one write-behind batch commit",
+        ),
+    )
 
-        response = client.chat.completions.create(
-            model=OPENAI_CHAT_MODEL, messages=all_messages, max_tokens=OPENAI_MAX_TOKENS
+
+def finish_turn(db, turn, content):
+    """Store the conversation, user message and assistant reply.
+
+    Commits on ``db`` unless the write-behind writer accepts the turn.
+    """
+    record = {
+        key: turn[key]
+        for key in [
+            "conversation_id",
+            "session_id",
+            "image_path",
+            "phenomenon",
+            "state",
+            "current_state",
+            "user_message",
+            "user_evaluation_result",
+            "user_audio_mime_type",
+            "earlier_messages",
+            "received_at",
+        ]
+    }
+    record["turn_id"] = tracing.current_turn_id()
+    record["content"] = content
+    record["stored_at"] = datetime.utcnow()
+    # Written before the record is stored or queued, so a stored key always
+    # has its blob and a queued record holds only the key
+    user_audio = turn["user_audio"] if turn["user_message"] else None
+    record["user_audio_blob_key"] = None
+    record["user_audio_size_bytes"] = None
+    if user_audio:
+        with turn_stage("audio_store", **turn_labels(turn)):
+            record["user_audio_blob_key"] = audio_store.put(user_audio)
+        record["user_audio_size_bytes"] = len(user_audio)
+
+    stage = "db_enqueue" if write_behind is not None else "db_commit"
+    with turn_stage(stage, **turn_labels(turn)):
+        if write_behind is None or not write_behind.submit(record):
+            store_turn(db, record)
+            db.commit()
+
+    if turn["current_state"] != "close":
+        history_cache.set(
+            turn["conversation_id"],
+            turn["history"] + [{"role": "assistant", "content": content}],
         )
 
-        content = response.choices[0].message.content or ""
 
-        assistant_message_record = Message(
-            conversation_id=conversation.id,
-            role="assistant",
-            content=content,
-            state=current_state,
+def turn_labels(turn):
+    return {"state": turn["state"], "phenomenon": turn["phenomenon"]}
+
+
+def generate_reply(turn):
+    with turn_stage("generation", **turn_labels(turn)):
+        return provider.complete(turn["messages"])
+
+
+def stream_reply(turn):
+    """Yield the reply text as it is generated"""
+    start = time.perf_counter()
+    span = tracing.start_span("generation", **turn_labels(turn))
+    deltas = provider.stream(turn["messages"])
+    while True:
+        # The request is sent on the first next(), so it counts as this span's
+        with tracing.use_span(span):
+            delta = next(deltas, None)
+        if delta is None:
+            break
+        yield delta
+    tracing.end_span(span)
+    STAGE_SECONDS.observe(
+        time.perf_counter() - start, stage="generation", **turn_labels(turn)
+    )
+
+
+def speech_audio(text, labels):
+    """Return ``(cache_key, audio_file)`` for ``text``, synthesizing on a miss.
+
+    ``audio_file`` is the cached mp3 opened for reading on a hit, or the
+    newly synthesized bytes (also added to the cache) in a ``BytesIO``.
+    """
+    key = tts_cache.key(provider.tts_model, provider.tts_voice, "mp3", text)
+    audio_file = tts_cache.open(key)
+    if audio_file is not None:
+        return key, audio_file
+
+    with turn_stage("tts", **labels):
+        audio = provider.speech(text)
+    tts_cache.put(key, audio)
+    return key, io.BytesIO(audio)
+
+
+def synthesize_speech(text, labels):
+    """Synthesize ``text`` to mp3 bytes with OpenAI TTS (through the cache)"""
+    _, audio_file = speech_audio(text, labels)
+    with audio_file:
+        return audio_file.read()
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_turn(db, turn, with_speech=False, trace=None):
+    """Yield the server-sent events for generating and storing a prepared turn.
+
+    Closes ``db`` when the stream ends. ``trace`` is the request's turn trace,
+    made current again because the body is generated after the view returns.
+    """
+    parts = []
+    tracing.bind(trace)
+    try:
+        deltas = stream_reply(turn)
+        if with_speech:
+            labels = turn_labels(turn)
+            events = pipeline_speech(
+                deltas, lambda text: synthesize_speech(text, labels), turn_executor
+            )
+        else:
+            events = (("token", delta) for delta in deltas)
+
+        for event in events:
+            if event[0] == "token":
+                parts.append(event[1])
+                yield sse_event("token", {"text": event[1]})
+            else:
+                _, index, sentence, audio = event
+                yield sse_event(
+                    "audio",
+                    {
+                        "index": index,
+                        "text": sentence,
+                        "mime_type": "audio/mpeg",
+                        "audio": base64.b64encode(audio).decode("utf-8"),
+                    },
+                )
+
+        content = "".join(parts)
+        finish_turn(db, turn, content)
+        yield sse_event(
+            "done",
+            {
+                "response": content,
+                "next_state": turn["current_state"],
+                "turn_id": trace.turn_id if trace else None,
+            },
+        )
+    except SQLAlchemyError as db_error:
+        db.rollback()
+        print(f"Database error during chat streaming: {db_error}")
+        yield sse_event("error", {"error": "Chat completion failed"})
+    except Exception as e:
+        db.rollback()
+        print(f"Chat streaming error: {e}")
+        yield sse_event("error", {"error": "Chat completion failed"})
+    finally:
+        db.close()
+
+
+@app.route("/api/chat", methods=["POST"])
+def chat_completion():
+    """Generate chat response and a next_state using OpenAI"""
+    db = SessionLocal()
+    try:
+        # Record start time for latency tracking
+        start_time = time.time()
+        request_session_id = request.remote_addr  # Fallback session identifier
+        turn_starts.set(latency_key(), start_time)
+
+        with turn_stage("json_parse") as labels:
+            data = request.get_json()
+            labels.update(request_labels(data))
+        turn = prepare_turn(data, request_session_id)
+        content = generate_reply(turn)
+        finish_turn(db, turn, content)
+
+        return jsonify(
+            {
+                "response": content,
+                "next_state": turn["current_state"],
+                "turn_id": tracing.current_turn_id(),
+            }
         )
-        db.add(assistant_message_record)
 
-        db.commit()
+    except SQLAlchemyError as db_error:
+        db.rollback()
+        print(f"Database error during chat completion: {db_error}")
+        return jsonify({"error": "Chat completion failed"}), 500
+    except Exception as e:
+        db.rollback()
+        print(f"Chat completion error: {e}")
+        return jsonify({"error": "Chat completion failed"}), 500
+    finally:
+        db.close()
+
 
-        return jsonify({"response": content, "next_state": current_state})
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_completion_stream():
+    """Stream the chat response as server-sent events.
 
+    Emits ``token`` events with text deltas while generating, then a closing
+    ``done`` event with the full response and ``next_state`` once the
+    assistant message has been stored. With ``?speech=1`` every completed
+    sentence is also synthesized while the rest is generated and sent, in
+    order, as base64 mp3 ``audio`` events.
+    """
+    with_speech = request.args.get("speech", "").lower() in ["1", "true"]
+    db = SessionLocal()
+    try:
+        request_session_id = request.remote_addr  # Fallback session identifier
+
+        with turn_stage("json_parse") as labels:
+            data = request.get_json()
+            labels.update(request_labels(data))
+        turn = prepare_turn(data, request_session_id)
     except SQLAlchemyError as db_error:
         db.rollback()
+        db.close()
         print(f"Database error during chat completion: {db_error}")
         return jsonify({"error": "Chat completion failed"}), 500
     except Exception as e:
         db.rollback()
+        db.close()
         print(f"Chat completion error: {e}")
         return jsonify({"error": "Chat completion failed"}), 500
+
+    return Response(
+        stream_with_context(
+            stream_turn(db, turn, with_speech, trace=tracing.current_trace())
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/turn", methods=["POST"])
+def voice_turn():
+    """Run a whole spoken turn in a single request.
+
+    Accepts multipart form data with the recorded ``audio`` file and the
+    ``state``, ``image_path``, ``session_id``, ``conversation_id`` and
+    optional ``messages`` (JSON-encoded history without the new message;
+    when omitted the stored history of the conversation is used) fields. The
+    audio is transcribed, run through the state machine and stored once, and
+    the reply is returned with its synthesized speech as ``transcript``,
+    ``response``, ``next_state`` and base64 mp3 ``audio``. With ``?stream=1``
+    the turn is sent as server-sent events instead: a ``transcript`` event,
+    then the same events as ``/api/chat/stream?speech=1``.
+    """
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+
+    audio_file_storage = request.files["audio"]
+    audio_bytes = audio_file_storage.read()
+    filename = audio_file_storage.filename or "audio.webm"
+    messages = None
+    if "messages" in request.form:
+        try:
+            messages = json.loads(request.form.get("messages") or "[]")
+        except ValueError:
+            messages = None
+        if not isinstance(messages, list):
+            return jsonify({"error": "messages must be a JSON array"}), 400
+    stream = request.args.get("stream", "").lower() in ["1", "true"]
+
+    db = SessionLocal()
+    try:
+        request_session_id = request.remote_addr  # Fallback session identifier
+
+        transcript = transcribe(filename, audio_bytes, request_labels(request.form))
+        data = {
+            "message": {"role": "user", "content": transcript},
+            "state": request.form.get("state"),
+            "image_path": request.form.get("image_path", ""),
+            "session_id": request.form.get("session_id"),
+            "conversation_id": request.form.get("conversation_id"),
+            "user_audio_mime_type": audio_file_storage.mimetype or None,
+        }
+        if messages is not None:
+            data["messages"] = messages + [data["message"]]
+        turn = prepare_turn(data, request_session_id, user_audio_bytes=audio_bytes)
+    except SQLAlchemyError as db_error:
+        db.rollback()
+        db.close()
+        print(f"Database error during voice turn: {db_error}")
+        return jsonify({"error": "Voice turn failed"}), 500
+    except Exception as e:
+        db.rollback()
+        db.close()
+        print(f"Voice turn error: {e}")
+        return jsonify({"error": "Voice turn failed"}), 500
+
+    if stream:
+        trace = tracing.current_trace()
+
+        def generate():
+            yield sse_event("transcript", {"text": transcript})
+            yield from stream_turn(db, turn, with_speech=True, trace=trace)
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        content = generate_reply(turn)
+        finish_turn(db, turn, content)
+        audio = synthesize_speech(content, turn_labels(turn))
+
+        return jsonify(
+            {
+                "transcript": transcript,
+                "response": content,
+                "next_state": turn["current_state"],
+                "audio": base64.b64encode(audio).decode("utf-8"),
+                "audio_mime_type": "audio/mpeg",
+                "turn_id": tracing.current_turn_id(),
+            }
+        )
+    except SQLAlchemyError as db_error:
+        db.rollback()
+        print(f"Database error during voice turn: {db_error}")
+        return jsonify({"error": "Voice turn failed"}), 500
+    except Exception as e:
+        db.rollback()
+        print(f"Voice turn error: {e}")
+        return jsonify({"error": "Voice turn failed"}), 500
     finally:
         db.close()
 
@@ -601,16 +1452,14 @@ def generate_speech():
     """Generate speech audio using OpenAI TTS"""
     try:
         # Calculate latency from conversation start to audio generation
-        session_id = request.remote_addr
         end_time = time.time()
 
-        if session_id in conversation_start_times:
-            total_latency = end_time - conversation_start_times[session_id]
+        start_time = turn_starts.pop(latency_key())
+        if start_time is not None:
+            total_latency = end_time - start_time
             print(
                 f"🎯 Total latency (user message → audio response): {total_latency:.2f} seconds"
             )
-            # Clean up the stored start time
-            del conversation_start_times[session_id]
         else:
             print("⚠️  No start time found for session, cannot calculate latency")
 
@@ -620,36 +1469,71 @@ def generate_speech():
         if not text:
             return jsonify({"error": "No text provided"}), 400
 
-        # Generate speech using OpenAI TTS
-        response = client.audio.speech.create(
-            model=OPENAI_TTS_MODEL,
-            voice=OPENAI_TTS_VOICE,
-            input=text,
-            response_format="mp3",
-        )
-
-        # Return the audio data
-        return (
-            response.content,
-            200,
-            {
-                "Content-Type": "audio/mpeg",
-                "Content-Disposition": "attachment; filename=speech.mp3",
-            },
-        )
+        # Generate speech using OpenAI TTS, or reuse a cached clip
+        key, audio_file = speech_audio(text, request_labels(data))
+        return send_speech_file(key, audio_file)
 
     except Exception as e:
         print(f"Speech generation error: {e}")
         return jsonify({"error": "Speech generation failed"}), 500
 
 
+@app.route("/api/speech/<audio_key>", methods=["GET"])
+def replay_speech(audio_key):
+    """Serve a previously synthesized clip by its cache key (the ETag)"""
+    audio_file = (
+        tts_cache.open(audio_key) if tts_cache.is_valid_key(audio_key) else None
+    )
+    if audio_file is None:
+        return jsonify({"error": "Audio not found"}), 404
+    return send_speech_file(audio_key, audio_file)
+
+
+@app.route("/api/tts-cache", methods=["GET"])
+def tts_cache_stats():
+    """Report TTS cache size, hits, misses and evictions"""
+    return jsonify(tts_cache.stats()), 200
+
+
+def send_speech_file(key, audio_file):
+    # Cached clips are streamed from their open file (the server's file
+    # wrapper, e.g. sendfile, where supported); the content hash is a strong
+    # ETag, so replays can be answered with 304
+    response = send_file(
+        audio_file,
+        mimetype="audio/mpeg",
+        as_attachment=True,
+        download_name="speech.mp3",
+        etag=key,
+        conditional=request.method == "GET",
+        max_age=TTS_CACHE_MAX_AGE,
+    )
+    response.headers["X-Audio-Key"] = key
+    return response
+
+
 # Register database viewer blueprint
 from database_viewer import db_viewer, init_db_viewer  # noqa: E402
 
-init_db_viewer(SessionLocal, Conversation, Message)
+metrics.register_stats("tts_cache", tts_cache.stats)
+metrics.register_stats("audio_store", audio_store.stats)
+metrics.register_stats("state_store", state_store.stats)
+metrics.register_stats("deadlines", turn_deadlines.stats)
+metrics.register_stats("hedging", hedger.stats)
+metrics.register_stats("history_cache", history_cache.stats)
+metrics.register_stats("context", context_window.stats)
+metrics.register_stats("classifier", local_classifier.stats)
+metrics.register_stats("registry", registry.stats)
+if write_behind is not None:
+    metrics.register_stats("write_behind", write_behind.stats)
+
+init_db_viewer(SessionLocal, Conversation, Message, TurnSpan, audio_store)
 app.register_blueprint(db_viewer)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5001))  # Default 5001 for local dev
     debug = os.getenv("FLASK_ENV", "development") == "development"
+    # The default SIGTERM action kills the process without running atexit
+    # handlers; exit normally instead so the write-behind queue is drained
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
     app.run(debug=debug, host="0.0.0.0", port=port)
@@ -0,0 +1,20 @@
+"""ASGI entrypoint for serving the backend with uvicorn.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5001
+
+This is a thread-pool adapter, not an async backend. The Flask routes and
+the database viewer blueprint run unchanged through a2wsgi, which hands each
+request to one of ``ASGI_WORKER_THREADS`` worker threads. The request holds
+that thread while it blocks on OpenAI and the database, so the thread count
+caps the turns in flight exactly as it would under a threaded WSGI server.
+"""
+
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+ASGI_WORKER_THREADS = int(os.getenv("ASGI_WORKER_THREADS", "256"))
+
+application = WSGIMiddleware(app, workers=ASGI_WORKER_THREADS)
@@ -0,0 +1,402 @@
+"""Load-generation benchmark for the chat state machine.
+
+    python benchmark.py --conversations 60 --concurrency 8 --output run.json
+    python benchmark.py --compare run.json
+
+Runs scripted multi-turn conversations through the Flask app in process,
+against the stub provider (``LLM_PROVIDER=stub``) and a throwaway SQLite
+database unless ``--database-url`` is given. Each turn makes the three
+requests of the split API: ``/api/transcribe``, ``/api/chat`` (full history
+on the first turn, then the delta protocol) and ``/api/speech``, linked by
+the ``X-Turn-Id`` header. Conversations cycle through the phenomena. They
+start in ``greet`` and send the ``next_state`` of each reply as the state of
+the next turn, so they follow the server's own transitions until it closes
+the conversation, or for at most ``--max-turns`` turns.
+
+The load pass reports throughput and p50/p95/p99 latency per endpoint and
+per turn, and database round trips per turn (statements executed on the
+request thread, counted with a SQLAlchemy cursor event). A sequential
+profile pass then measures memory allocated per turn with ``tracemalloc``.
+``--compare`` runs the benchmark again and exits with status 1 if a metric
+regressed by more than ``--threshold`` against a saved run.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event
+
+from models import Base
+from tracing import percentile
+
+# (metric, direction) pairs checked by --compare; +1 means higher is worse.
+# p99 is reported but not compared, it is too noisy at these sample sizes.
+COMPARED_METRICS = [
+    ("throughput_turns_per_second", -1),
+    ("turn_ms.p50", 1),
+    ("turn_ms.p95", 1),
+    ("db_round_trips_per_turn.mean", 1),
+    ("allocated_kib_per_turn.mean", 1),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--max-turns",
+        type=int,
+        default=20,
+        help="turns after which a conversation that has not closed is dropped",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=0.0,
+        help="STUB_LATENCY_SCALE; 0 measures the backend alone",
+    )
+    parser.add_argument("--profile-conversations", type=int, default=3)
+    parser.add_argument("--audio-bytes", type=int, default=16000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a baseline run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="relative change counted as a regression by --compare",
+    )
+    return parser.parse_args()
+
+
+def configure(args):
+    """Point the app at the stub provider and a fresh database before import"""
+    workdir = tempfile.mkdtemp(prefix="curio-bench-")
+    database_url = args.database_url or f"sqlite:///{workdir}/bench.db"
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["STUB_LATENCY_SCALE"] = str(args.latency_scale)
+    os.environ["STUB_SEED"] = str(args.seed)
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    os.environ["AUDIO_BLOB_STORE"] = "local"
+    os.environ["AUDIO_BLOB_DIR"] = os.path.join(workdir, "audio")
+    for name in ["POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST", "POSTGRES_DB"]:
+        os.environ.pop(name, None)
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+    }
+
+
+class RoundTripCounter:
+    """Counts statements executed on each thread of the app's engine"""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.other_threads = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_args):
+        if getattr(self._local, "counting", False):
+            self._local.count += 1
+        else:
+            with self._lock:
+                self.other_threads += 1
+
+    def start(self):
+        self._local.counting = True
+        self._local.count = 0
+
+    def stop(self):
+        self._local.counting = False
+        return self._local.count
+
+
+class Conversation:
+    """One scripted conversation, driven through a Flask test client"""
+
+    def __init__(self, app_client, index, phenomenon, image, audio_bytes, seed):
+        self.client = app_client
+        self.conversation_id = f"bench-{seed}-{index}"
+        self.session_id = f"bench-session-{index % 7}"
+        self.phenomenon = phenomenon
+        self.image = image
+        self.rng = random.Random(seed * 100003 + index)
+        self.audio_bytes = audio_bytes
+        self.messages = [
+            {"role": "assistant", "content": "Hi! What do you see in the picture?"}
+        ]
+        self.stored = False
+
+    def turn(self, state, timings):
+        """Run one turn; return the server's next state"""
+        audio = self.rng.randbytes(self.audio_bytes)
+
+        start = time.perf_counter()
+        response = self.client.post(
+            "/api/transcribe",
+            data={"audio": (io.BytesIO(audio), "turn.webm", "audio/webm")},
+            content_type="multipart/form-data",
+        )
+        transcribed = _check(response, "transcribe")
+        response.close()
+        timings["transcribe"] = time.perf_counter() - start
+        turn_id = transcribed["turn_id"]
+        message = {"role": "user", "content": transcribed["text"]}
+
+        body = {
+            "state": state,
+            "image_path": self.image,
+            "conversation_id": self.conversation_id,
+            "session_id": self.session_id,
+            "user_audio": base64.b64encode(audio).decode("ascii"),
+            "user_audio_mime_type": "audio/webm",
+        }
+        if self.stored:
+            body["message"] = message
+        else:
+            body["messages"] = self.messages + [message]
+        chat_start = time.perf_counter()
+        response = self.client.post(
+            "/api/chat", json=body, headers={"X-Turn-Id": turn_id}
+        )
+        chat = _check(response, "chat")
+        response.close()
+        timings["chat"] = time.perf_counter() - chat_start
+        self.stored = True
+
+        speech_start = time.perf_counter()
+        response = self.client.post(
+            "/api/speech",
+            json={"text": chat["response"]},
+            headers={"X-Turn-Id": turn_id},
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"speech failed with {response.status_code}")
+        response.get_data()
+        response.close()
+        timings["speech"] = time.perf_counter() - speech_start
+        timings["turn"] = time.perf_counter() - start
+        return chat["next_state"]
+
+
+def _check(response, name):
+    if response.status_code != 200:
+        raise RuntimeError(f"{name} failed with {response.status_code}")
+    return response.get_json()
+
+
+def run_conversation(app_module, counter, args, index, targets, results, profile):
+    phenomenon, image = targets[index % len(targets)]
+    conversation = Conversation(
+        app_module.app.test_client(),
+        index,
+        phenomenon,
+        image,
+        args.audio_bytes,
+        args.seed,
+    )
+    turns = 0
+    state = "greet"
+    while turns < args.max_turns:
+        timings = {}
+        if profile:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        counter.start()
+        try:
+            next_state = conversation.turn(state, timings)
+        finally:
+            round_trips = counter.stop()
+        turns += 1
+        with results["lock"]:
+            if profile:
+                _, peak = tracemalloc.get_traced_memory()
+                results["allocated_kib"].append((peak - baseline) / 1024)
+            else:
+                for name, seconds in timings.items():
+                    results["latency_ms"][name].append(seconds * 1000)
+                results["db_round_trips"].append(round_trips)
+                results["states"][state] = results["states"].get(state, 0) + 1
+        if next_state == "close":
+            # Only the timed pass is reported as closed conversations
+            if not profile:
+                with results["lock"]:
+                    results["closed"] += 1
+            break
+        state = next_state
+    return turns
+
+
+def new_results():
+    return {
+        "lock": threading.Lock(),
+        "latency_ms": {"transcribe": [], "chat": [], "speech": [], "turn": []},
+        "db_round_trips": [],
+        "allocated_kib": [],
+        "states": {},
+        "closed": 0,
+    }
+
+
+def run(args):
+    configure(args)
+    import app as app_module
+
+    snapshot = app_module.registry.snapshot()
+    targets = [
+        (slug, f"/imgs/{entry.images[0]}")
+        for slug, entry in sorted(snapshot.phenomenon_entries.items())
+        if entry.images
+    ]
+    counter = RoundTripCounter(app_module.engine)
+
+    # Load pass: concurrent conversations, timed
+    results = new_results()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(
+                run_conversation, app_module, counter, args, i, targets, results, False
+            )
+            for i in range(args.conversations)
+        ]
+        turns = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+
+    # Profile pass: sequential, under tracemalloc
+    tracemalloc.start()
+    try:
+        for i in range(args.profile_conversations):
+            run_conversation(
+                app_module,
+                counter,
+                args,
+                args.conversations + i,
+                targets,
+                results,
+                True,
+            )
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "config": {
+            "conversations": args.conversations,
+            "concurrency": args.concurrency,
+            "max_turns": args.max_turns,
+            "latency_scale": args.latency_scale,
+            "audio_bytes": args.audio_bytes,
+            "seed": args.seed,
+            "phenomena": [slug for slug, _ in targets],
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        },
+        "turns": turns,
+        "closed_conversations": results["closed"],
+        "request_states": results["states"],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_turns_per_second": round(turns / elapsed, 3),
+        "throughput_requests_per_second": round(3 * turns / elapsed, 3),
+        "turn_ms": percentiles(results["latency_ms"]["turn"]),
+        "endpoint_ms": {
+            name: percentiles(values)
+            for name, values in results["latency_ms"].items()
+            if name != "turn"
+        },
+        "db_round_trips_per_turn": percentiles(results["db_round_trips"]),
+        "db_round_trips_background": counter.other_threads,
+        "allocated_kib_per_turn": percentiles(results["allocated_kib"]),
+    }
+
+
+def metric(results, path):
+    value = results
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(baseline, current, threshold):
+    """Print the compared metrics side by side; return the regressed ones"""
+    regressions = []
+    print(f"{'metric':36} {'baseline':>12} {'current':>12} {'change':>8}")
+    for path, direction in COMPARED_METRICS:
+        before, after = metric(baseline, path), metric(current, path)
+        if before is None or after is None:
+            print(f"{path:36} {before!s:>12} {after!s:>12}")
+            continue
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change * direction > threshold:
+            flag = "  REGRESSION"
+            regressions.append(path)
+        print(f"{path:36} {before:>12.3f} {after:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def report(results):
+    print(
+        f"{results['turns']} turns in {results['elapsed_seconds']} s "
+        f"({results['throughput_turns_per_second']} turns/s, "
+        f"{results['closed_conversations']} conversations closed)"
+    )
+    rows = [("turn", results["turn_ms"])] + list(results["endpoint_ms"].items())
+    print(f"{'latency (ms)':16} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for name, stats in rows:
+        print(f"{name:16} {stats['p50']:>10} {stats['p95']:>10} {stats['p99']:>10}")
+    round_trips = results["db_round_trips_per_turn"]
+    print(
+        f"db round trips per turn: mean {round_trips['mean']}, "
+        f"p95 {round_trips['p95']} "
+        f"(+{results['db_round_trips_background']} on background threads)"
+    )
+    allocated = results["allocated_kib_per_turn"]
+    print(f"allocated per turn (KiB): mean {allocated['mean']}, p95 {allocated['p95']}")
+
+
+def main():
+    args = parse_args()
+    # Results go to stdout; keep the app's request logging out of the way
+    with open(os.devnull, "w") as app_output, contextlib.redirect_stdout(app_output):
+        results = run(args)
+
+    report(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        print()
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
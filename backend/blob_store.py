@@ -0,0 +1,230 @@
+"""Content-addressed storage for recorded user audio.
+
+Audio clips are kept out of the ``messages`` table. Each clip is stored under
+the SHA-256 of its bytes and a message only records that key, the size and
+the mime type. Identical clips are stored once and a key never changes
+meaning, so writes are idempotent and a clip that was written but whose
+message was never committed is harmless.
+
+``LocalBlobStore`` keeps clips on the local filesystem. ``S3BlobStore`` uses
+any S3-compatible service; with ``endpoint_url`` it talks to a local stand-in
+such as MinIO. ``blob_store_from_env`` builds the configured store and is
+shared by the app and the Alembic migration that moves existing audio out.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # in requirements.txt; only needed for AUDIO_BLOB_STORE=s3
+    boto3 = None
+    ClientError = None
+
+
+def blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_valid_key(key):
+    return len(key) == 64 and all(char in "0123456789abcdef" for char in key)
+
+
+class LocalBlobStore:
+    """Blobs in a directory tree sharded by the first bytes of their key"""
+
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.puts = 0
+        self.dedup_hits = 0
+        self.gets = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:4], key)
+
+    def put(self, data):
+        """Store ``data`` and return its key"""
+        key = blob_key(data)
+        path = self.path(key)
+        if os.path.exists(path):
+            with self._lock:
+                self.dedup_hits += 1
+            return key
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Do not leave a partial file behind (disk full, interrupted)
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            self.puts += 1
+        return key
+
+    def get(self, key):
+        """Bytes stored under ``key``, or ``None`` if there are none"""
+        if not is_valid_key(key):
+            return None
+        try:
+            with open(self.path(key), "rb") as blob_file:
+                data = blob_file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.gets += 1
+        return data
+
+    def exists(self, key):
+        return is_valid_key(key) and os.path.exists(self.path(key))
+
+    def delete(self, key):
+        if not is_valid_key(key):
+            return
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "directory": self.directory,
+                "puts": self.puts,
+                "dedup_hits": self.dedup_hits,
+                "gets": self.gets,
+                "misses": self.misses,
+            }
+
+
+class S3BlobStore:
+    """Blobs in an S3 bucket under ``prefix``.
+
+    ``endpoint_url`` points the client at an S3-compatible server (MinIO,
+    localstack). Credentials and region come from the usual AWS environment
+    variables and config files.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket, prefix="audio/", endpoint_url=None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise ImportError("AUDIO_BLOB_STORE=s3 requires boto3")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._lock = threading.Lock()
+        self.puts = 0
+        self.dedup_hits = 0
+        self.gets = 0
+        self.misses = 0
+
+    def object_key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def put(self, data):
+        key = blob_key(data)
+        if self.exists(key):
+            with self._lock:
+                self.dedup_hits += 1
+            return key
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+        with self._lock:
+            self.puts += 1
+        return key
+
+    def get(self, key):
+        if not is_valid_key(key):
+            return None
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except ClientError as e:
+            if _is_missing(e):
+                with self._lock:
+                    self.misses += 1
+                return None
+            raise
+        data = response["Body"].read()
+        with self._lock:
+            self.gets += 1
+        return data
+
+    def exists(self, key):
+        if not is_valid_key(key):
+            return False
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if _is_missing(e):
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        if is_valid_key(key):
+            self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "bucket": self.bucket,
+                "prefix": self.prefix,
+                "endpoint_url": self.endpoint_url,
+                "puts": self.puts,
+                "dedup_hits": self.dedup_hits,
+                "gets": self.gets,
+                "misses": self.misses,
+            }
+
+
+def _is_missing(error):
+    return error.response.get("Error", {}).get("Code") in (
+        "404",
+        "NoSuchKey",
+        "NotFound",
+    )
+
+
+def blob_store_from_env():
+    """Blob store configured by the ``AUDIO_BLOB_*`` environment variables"""
+    backend = os.getenv("AUDIO_BLOB_STORE", "local").lower()
+    if backend == "local":
+        return LocalBlobStore(
+            os.getenv(
+                "AUDIO_BLOB_DIR",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_blobs"),
+            )
+        )
+    if backend == "s3":
+        bucket = os.getenv("AUDIO_BLOB_S3_BUCKET")
+        if not bucket:
+            raise ValueError("AUDIO_BLOB_STORE=s3 requires AUDIO_BLOB_S3_BUCKET")
+        return S3BlobStore(
+            bucket,
+            prefix=os.getenv("AUDIO_BLOB_S3_PREFIX", "audio/"),
+            endpoint_url=os.getenv("AUDIO_BLOB_S3_ENDPOINT_URL") or None,
+        )
+    raise ValueError(f"Unknown AUDIO_BLOB_STORE: {backend}")
@@ -0,0 +1,196 @@
+"""Token-budgeted conversation context with rolling summaries.
+
+Every prompt of a turn embeds the conversation history, so without a bound
+prompt tokens grow with the square of the session length. ``ContextWindow``
+keeps the most recent messages verbatim and folds older ones into a summary
+that is cached per conversation and extended incrementally: each refresh
+only summarizes the messages that scrolled out of the window since the last
+one, on top of the previous summary. Refreshes run in the background, so no
+turn waits on the summarizer; until one finishes, the oldest messages that
+do not fit are left out. Leading system messages (a prompt sent by the
+client) are never summarized or left out, and the latest message is always
+kept, so the window is only over budget when those alone are.
+"""
+
+import threading
+
+from ttl_cache import TTLCache
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; fall back to an estimate
+    tiktoken = None
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, else estimates ~4 characters per token.
+
+    The encoding is loaded when the counter is created, at startup. tiktoken
+    downloads its BPE file on first use (cached in ``TIKTOKEN_CACHE_DIR``;
+    the Docker image ships it), so without network access or the package
+    the counter falls back to the estimate and says so.
+    """
+
+    def __init__(self, model="gpt-4"):
+        self.encoding = None
+        if tiktoken is None:
+            print("tiktoken is not installed, estimating context tokens")
+            return
+        try:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(
+                f"Could not load the tiktoken encoding, estimating context tokens: {e}"
+            )
+            return
+        print(f"Counting context tokens with tiktoken ({self.encoding.name})")
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return (len(text) + 3) // 4
+
+    def count_messages(self, messages):
+        return sum(
+            self.count(message.get("content") or "") + MESSAGE_OVERHEAD
+            for message in messages
+        )
+
+
+class ContextWindow:
+    """Compresses a conversation to at most ``max_tokens`` of history.
+
+    ``summarize(previous_summary, messages)`` returns the new summary text;
+    ``executor`` runs it off the request path. The last ``keep_messages``
+    messages are never summarized, but they are dropped, oldest first, if
+    they do not fit on their own.
+    """
+
+    def __init__(
+        self,
+        summarize,
+        executor,
+        counter=None,
+        max_tokens=2000,
+        keep_messages=8,
+        max_entries=10000,
+        ttl_seconds=3600.0,
+    ):
+        self.summarize = summarize
+        self.executor = executor
+        self.counter = counter or TokenCounter()
+        self.max_tokens = max_tokens
+        self.keep_messages = keep_messages
+        # conversation id -> (number of messages summarized, summary)
+        self._summaries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.compressed_turns = 0
+        self.truncated_turns = 0
+        self.tokens_saved = 0
+
+    @property
+    def enabled(self):
+        return self.max_tokens > 0
+
+    def window(self, conversation_id, messages):
+        """Messages to send for this turn: a summary message plus the recent tail"""
+        if not self.enabled or not messages:
+            return messages
+        pinned = 0
+        while pinned < len(messages) - 1 and messages[pinned].get("role") == "system":
+            pinned += 1
+        head, history = messages[:pinned], messages[pinned:]
+        budget = self.max_tokens - self.counter.count_messages(head)
+
+        covered, summary = self._summaries.get(conversation_id, (0, ""))
+        if covered > len(history) - 1:
+            # The client restarted or trimmed the conversation
+            covered, summary = 0, ""
+
+        tokens = [self.counter.count_messages([message]) for message in history]
+        if sum(tokens[covered:]) > budget:
+            self._schedule_refresh(conversation_id, history, covered, summary)
+
+        summary_messages = []
+        if covered:
+            summary_messages = [{"role": "system", "content": SUMMARY_PREFIX + summary}]
+        used = self.counter.count_messages(summary_messages) + sum(tokens[covered:])
+        # Until a refresh catches up, leave out the oldest messages that do
+        # not fit, then the summary, but never the latest message
+        start = covered
+        while used > budget and start < len(history) - 1:
+            used -= tokens[start]
+            start += 1
+        if used > budget and summary_messages:
+            used -= self.counter.count_messages(summary_messages)
+            summary_messages = []
+
+        if start == 0 and not summary_messages:
+            return messages
+        with self._lock:
+            self.compressed_turns += 1
+            if start > covered or (covered and not summary_messages):
+                self.truncated_turns += 1
+            self.tokens_saved += sum(tokens) - used
+        return head + summary_messages + history[start:]
+
+    def _schedule_refresh(self, conversation_id, messages, covered, summary):
+        target = len(messages) - self.keep_messages
+        if target <= covered:
+            return
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        self.executor.submit(
+            self._refresh,
+            conversation_id,
+            list(messages[covered:target]),
+            target,
+            summary,
+        )
+
+    def _refresh(self, conversation_id, new_messages, target, summary):
+        try:
+            updated = self.summarize(summary, new_messages)
+            self._summaries.set(conversation_id, (target, updated.strip()))
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"Error summarizing conversation {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def forget(self, conversation_id):
+        self._summaries.pop(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "tokenizer": self.counter.encoding.name
+                if self.counter.encoding
+                else "estimate",
+                "max_tokens": self.max_tokens,
+                "keep_messages": self.keep_messages,
+                "summary_refreshes": self.refreshes,
+                "summary_errors": self.refresh_errors,
+                "compressed_turns": self.compressed_turns,
+                "truncated_turns": self.truncated_turns,
+                "tokens_saved": self.tokens_saved,
+                "summaries": self._summaries.stats(),
+            }
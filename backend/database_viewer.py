@@ -3,9 +3,13 @@ Database Viewer API endpoints for viewing and downloading conversation data
 """
 
 import io
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 
 from flask import Blueprint, jsonify, request, send_file
+from sqlalchemy import func
+
+from tracing import percentile
 
 # Import will be done after app initialization to avoid circular import
 
@@ -15,14 +19,107 @@ db_viewer = Blueprint("db_viewer", __name__)
 SessionLocal = None
 Conversation = None
 Message = None
-
-
-def init_db_viewer(session_local, conversation_model, message_model):
+TurnSpan = None
+AudioStore = None
+
+# Root spans of the requests that make up a turn
+REQUEST_SPAN_PREFIX = "request "
+# Endpoints whose request ends with the reply audio reaching the client
+SPEECH_ENDPOINTS = {"generate_speech", "voice_turn"}
+# Recent turns are picked from the last ``limit * SPANS_PER_TURN`` spans, so
+# that the latency summary reads an index range instead of every span
+SPANS_PER_TURN = 50
+
+
+def init_db_viewer(
+    session_local,
+    conversation_model,
+    message_model,
+    turn_span_model=None,
+    audio_store=None,
+):
     """Initialize the database viewer with database models"""
-    global SessionLocal, Conversation, Message
+    global SessionLocal, Conversation, Message, TurnSpan, AudioStore
     SessionLocal = session_local
     Conversation = conversation_model
     Message = message_model
+    TurnSpan = turn_span_model
+    AudioStore = audio_store
+
+
+def load_message_audio(msg):
+    if msg.audio_blob_key is not None:
+        return AudioStore.get(msg.audio_blob_key) if AudioStore else None
+    # Rows not yet moved by the blob store migration still hold inline audio;
+    # audio_data is deferred, so this is the only place it is read
+    return msg.audio_data
+
+
+def summarize_turn(turn_id, spans):
+    """Requests, spans and voice-to-voice latency of one traced turn.
+
+    Voice-to-voice latency runs from the start of the first request of the
+    turn to the end of the request that returned the reply audio, and is only
+    reported for turns that were spoken (transcribed) and answered with speech.
+    """
+    requests = [span for span in spans if span.name.startswith(REQUEST_SPAN_PREFIX)]
+    start = min((span.started_at for span in requests), default=None)
+    end = None
+    for span in requests:
+        finished = span.started_at + timedelta(milliseconds=span.duration_ms or 0)
+        end = finished if end is None or finished > end else end
+
+    spoken = any(span.name == "transcription" for span in spans)
+    answered = any(span.endpoint in SPEECH_ENDPOINTS for span in requests)
+    voice_to_voice_ms = None
+    if spoken and answered and start is not None:
+        voice_to_voice_ms = round((end - start).total_seconds() * 1000, 3)
+
+    return {
+        "turn_id": turn_id,
+        "conversation_id": next(
+            (span.conversation_id for span in spans if span.conversation_id), None
+        ),
+        "started_at": start.isoformat() if start else None,
+        "voice_to_voice_ms": voice_to_voice_ms,
+        "spans": [
+            {
+                "name": span.name,
+                "endpoint": span.endpoint,
+                "started_at": span.started_at.isoformat(),
+                "duration_ms": span.duration_ms,
+                "ttfb_ms": span.ttfb_ms,
+                "attributes": json.loads(span.attributes or "{}"),
+            }
+            for span in spans
+        ],
+    }
+
+
+def load_turns(db, turn_ids):
+    spans = (
+        db.query(TurnSpan)
+        .filter(TurnSpan.turn_id.in_(turn_ids))
+        .order_by(TurnSpan.started_at.asc(), TurnSpan.id.asc())
+        .all()
+    )
+    grouped = {turn_id: [] for turn_id in turn_ids}
+    for span in spans:
+        grouped[span.turn_id].append(span)
+    return [
+        summarize_turn(turn_id, turn_spans)
+        for turn_id, turn_spans in grouped.items()
+        if turn_spans
+    ]
+
+
+def percentiles(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
 
 
 @db_viewer.route("/api/conversations", methods=["GET"])
@@ -125,7 +222,7 @@ def get_conversation(conversation_id):
                 "content": msg.content,
                 "state": msg.state,
                 "evaluation_result": msg.evaluation_result,
-                "has_audio": msg.audio_data is not None,
+                "has_audio": msg.has_audio,
                 "audio_mime_type": msg.audio_mime_type,
                 "created_at": msg.created_at.isoformat() if msg.created_at else None,
             }
@@ -179,7 +276,8 @@ def download_audio(conversation_id, message_id):
         if not message:
             return jsonify({"error": "Message not found"}), 404
 
-        if not message.audio_data:
+        audio_data = load_message_audio(message)
+        if not audio_data:
             return jsonify({"error": "No audio data available for this message"}), 404
 
         # Determine file extension from mime type
@@ -194,7 +292,7 @@ def download_audio(conversation_id, message_id):
         extension = extension_map.get(mime_type, "webm")
 
         # Create a file-like object from the binary data
-        audio_file = io.BytesIO(message.audio_data)
+        audio_file = io.BytesIO(audio_data)
 
         filename = f"audio_{message_id}.{extension}"
 
@@ -242,9 +340,9 @@ def export_all_data():
                     "content": msg.content,
                     "state": msg.state,
                     "evaluation_result": msg.evaluation_result,
-                    "has_audio": msg.audio_data is not None,
+                    "has_audio": msg.has_audio,
                     "audio_mime_type": msg.audio_mime_type,
-                    "audio_size_bytes": len(msg.audio_data) if msg.audio_data else 0,
+                    "audio_size_bytes": msg.audio_size_bytes or 0,
                     "created_at": msg.created_at.isoformat()
                     if msg.created_at
                     else None,
@@ -329,22 +427,21 @@ def get_statistics():
         # Count distinct conversations that have at least one message with audio
         conversations_with_audio = (
             db.query(Message.conversation_id)
-            .filter(Message.audio_data.isnot(None))
+            .filter(Message.has_audio.is_(True))
             .distinct()
             .count()
         )
         total_audio_messages = (
-            db.query(Message).filter(Message.audio_data.isnot(None)).count()
+            db.query(Message).filter(Message.has_audio.is_(True)).count()
         )
 
         # Group by phenomenon
         phenomenon_stats = {}
-        conversations = db.query(Conversation).all()
-        for conv in conversations:
-            phenomenon = conv.phenomenon or "unknown"
-            if phenomenon not in phenomenon_stats:
-                phenomenon_stats[phenomenon] = 0
-            phenomenon_stats[phenomenon] += 1
+        for phenomenon, count in db.query(
+            Conversation.phenomenon, func.count(Conversation.id)
+        ).group_by(Conversation.phenomenon):
+            phenomenon = phenomenon or "unknown"
+            phenomenon_stats[phenomenon] = phenomenon_stats.get(phenomenon, 0) + count
 
         # Average messages per conversation
         avg_messages = (
@@ -365,3 +462,97 @@ def get_statistics():
         return jsonify({"error": str(e)}), 500
     finally:
         db.close()
+
+
+@db_viewer.route("/api/conversations/<conversation_id>/traces", methods=["GET"])
+def get_conversation_traces(conversation_id):
+    """Get the traced turns of a conversation with their spans"""
+    if SessionLocal is None or TurnSpan is None:
+        return jsonify({"error": "Database viewer not initialized"}), 500
+    db = SessionLocal()
+    try:
+        turn_ids = [
+            row.turn_id
+            for row in db.query(TurnSpan.turn_id)
+            .filter(TurnSpan.conversation_id == conversation_id)
+            .distinct()
+            .all()
+        ]
+        turns = sorted(
+            load_turns(db, turn_ids), key=lambda turn: turn["started_at"] or ""
+        )
+        return jsonify(
+            {"conversation_id": conversation_id, "turns": turns, "total": len(turns)}
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
+
+
+@db_viewer.route("/api/traces/latency", methods=["GET"])
+def get_trace_latency():
+    """Get p50/p95/p99 voice-to-voice and per-stage latency of recent turns"""
+    if SessionLocal is None or TurnSpan is None:
+        return jsonify({"error": "Database viewer not initialized"}), 500
+    db = SessionLocal()
+    try:
+        limit = request.args.get("limit", type=int, default=1000)
+        phenomenon = request.args.get("phenomenon")
+
+        query = db.query(TurnSpan.turn_id, TurnSpan.started_at)
+        if phenomenon:
+            query = query.filter(
+                TurnSpan.conversation_id.in_(
+                    db.query(Conversation.id).filter(
+                        Conversation.phenomenon == phenomenon
+                    )
+                )
+            )
+        # Turns whose latest span is among the most recent spans, newest first
+        recent = (
+            query.order_by(TurnSpan.started_at.desc())
+            .limit(limit * SPANS_PER_TURN)
+            .subquery()
+        )
+        turn_ids = [
+            row.turn_id
+            for row in db.query(recent.c.turn_id)
+            .group_by(recent.c.turn_id)
+            .order_by(func.max(recent.c.started_at).desc())
+            .limit(limit)
+            .all()
+        ]
+        turns = load_turns(db, turn_ids)
+
+        voice_to_voice = [
+            turn["voice_to_voice_ms"]
+            for turn in turns
+            if turn["voice_to_voice_ms"] is not None
+        ]
+        durations = {}
+        first_bytes = {}
+        for turn in turns:
+            for span in turn["spans"]:
+                if span["duration_ms"] is not None:
+                    durations.setdefault(span["name"], []).append(span["duration_ms"])
+                if span["ttfb_ms"] is not None:
+                    first_bytes.setdefault(span["name"], []).append(span["ttfb_ms"])
+
+        return jsonify(
+            {
+                "turns": len(turns),
+                "voice_to_voice_ms": percentiles(voice_to_voice),
+                "stages": {
+                    name: {
+                        "duration_ms": percentiles(values),
+                        "ttfb_ms": percentiles(first_bytes.get(name, [])),
+                    }
+                    for name, values in sorted(durations.items())
+                },
+            }
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.close()
@@ -0,0 +1,228 @@
+"""Per-turn deadline budgets and hedged OpenAI calls.
+
+A turn's requests share one latency budget. The active ``Deadline`` lives in
+a context variable, so it follows the turn into the turn executor (through
+``tracing.ContextExecutor``) and bounds the timeout of every OpenAI sub-call
+made on its behalf. Optional stages such as knowledge retrieval are skipped
+once the budget is spent; required ones still get a minimum timeout, and the
+main reply is never bounded by the turn budget.
+
+Short idempotent calls (the evaluators) are hedged: if a call has not
+answered after the recent p95 latency of its kind, a duplicate request is
+sent and whichever answers first is used.
+"""
+
+import collections
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from tracing import percentile
+
+_current_deadline = contextvars.ContextVar("curio_deadline", default=None)
+
+
+class Deadline:
+    """Point in time by which a turn should have its reply under way"""
+
+    def __init__(self, budget_seconds):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def current():
+    return _current_deadline.get()
+
+
+def bind(deadline):
+    """Make ``deadline`` current until ``bind(None)`` (for request hooks)"""
+    _current_deadline.set(deadline)
+
+
+class TurnDeadlines:
+    """Starts turn deadlines and derives sub-call timeouts from them.
+
+    Every call is capped at ``max_call_seconds``. Required calls get at least
+    ``min_call_seconds`` even once the budget is spent, since the turn cannot
+    continue without them; optional calls get whatever is left, and
+    ``skip(stage)`` records the ones dropped for lack of budget.
+    """
+
+    def __init__(
+        self, budget_seconds=12.0, min_call_seconds=3.0, max_call_seconds=30.0
+    ):
+        self.budget_seconds = budget_seconds
+        self.min_call_seconds = min_call_seconds
+        self.max_call_seconds = max_call_seconds
+        self._lock = threading.Lock()
+        self.started = 0
+        self.skipped = collections.Counter()
+
+    @property
+    def enabled(self):
+        return self.budget_seconds > 0
+
+    def start(self):
+        if not self.enabled:
+            return None
+        deadline = Deadline(self.budget_seconds)
+        bind(deadline)
+        with self._lock:
+            self.started += 1
+        return deadline
+
+    def has_budget(self):
+        deadline = current()
+        return deadline is None or not deadline.expired()
+
+    def call_timeout(self, optional=False):
+        deadline = current()
+        if deadline is None:
+            return self.max_call_seconds
+        remaining = deadline.remaining()
+        if not optional:
+            remaining = max(self.min_call_seconds, remaining)
+        return min(self.max_call_seconds, remaining)
+
+    def skip(self, stage):
+        with self._lock:
+            self.skipped[stage] += 1
+        print(f"Turn budget spent, skipping {stage}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "budget_seconds": self.budget_seconds,
+                "min_call_seconds": self.min_call_seconds,
+                "max_call_seconds": self.max_call_seconds,
+                "turns": self.started,
+                "skipped": dict(self.skipped),
+            }
+
+
+class Hedger:
+    """Runs idempotent calls with a duplicate request after a p95 delay.
+
+    The hedge delay of each call kind is the p95 of its last ``window``
+    successful attempts, or ``default_delay`` until ``min_samples`` have been
+    seen. Every attempt that succeeds is sampled, including one that loses
+    the race and finishes later; sampling only winners would leave out the
+    slow attempts that were hedged and bias the p95 low. A call that fails before the delay is retried right away instead.
+    Attempts run on ``executor``, which must not be the pool the caller
+    itself runs on.
+    """
+
+    def __init__(
+        self,
+        executor,
+        enabled=True,
+        default_delay=1.0,
+        min_samples=20,
+        window=200,
+        quantile=0.95,
+    ):
+        self.executor = executor
+        self.enabled = enabled
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=window)
+        )
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.failures = 0
+
+    def delay(self, kind):
+        with self._lock:
+            samples = list(self._latencies[kind])
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return percentile(samples, self.quantile)
+
+    def call(self, kind, fn):
+        """Return ``fn()``, hedging it with a second attempt when it is slow"""
+        with self._lock:
+            self.calls += 1
+        if not self.enabled:
+            start = time.perf_counter()
+            result = fn()
+            self._record(kind, time.perf_counter() - start)
+            return result
+
+        first = self._submit(kind, fn)
+        done, _ = wait([first], timeout=self.delay(kind))
+        hedge = None
+        if not done:
+            hedge = self._submit(kind, fn)
+            with self._lock:
+                self.hedges += 1
+        elif first.exception() is not None:
+            first = self._submit(kind, fn)
+            with self._lock:
+                self.retries += 1
+
+        pending = [future for future in (first, hedge) if future is not None]
+        error = None
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pending.remove(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return future.result()
+        with self._lock:
+            self.failures += 1
+        raise error
+
+    def _submit(self, kind, fn):
+        started = time.perf_counter()
+        future = self.executor.submit(fn)
+        future.add_done_callback(lambda done: self._sample(kind, started, done))
+        return future
+
+    def _sample(self, kind, started, future):
+        if not future.cancelled() and future.exception() is None:
+            self._record(kind, time.perf_counter() - started)
+
+    def _record(self, kind, seconds):
+        with self._lock:
+            self._latencies[kind].append(seconds)
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: list(samples) for kind, samples in self._latencies.items()}
+            stats = {
+                "enabled": self.enabled,
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+        stats["kinds"] = {
+            kind: {
+                "samples": len(samples),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 3)
+                if samples
+                else None,
+                "hedge_delay_ms": round(self.delay(kind) * 1000, 3),
+            }
+            for kind, samples in kinds.items()
+        }
+        return stats
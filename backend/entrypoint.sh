@@ -4,5 +4,10 @@ set -e
 echo "Running database migrations..."
 alembic upgrade head
 
+if [ "${SERVER_MODE:-flask}" = "asgi" ]; then
+    echo "Starting ASGI server..."
+    exec uvicorn asgi:application --host 0.0.0.0 --port "${PORT:-5001}"
+fi
+
 echo "Starting Flask application..."
 exec python app.py
@@ -0,0 +1,54 @@
+"""Server-side conversation history for the delta chat protocol.
+
+Clients may send only the new user message and the ``conversation_id``
+instead of the whole ``messages`` array. ``HistoryCache`` keeps each
+conversation's ``{"role", "content"}`` history in a bounded in-memory cache,
+updated after every stored turn, and rebuilds it from the ``messages`` table
+on a miss.
+"""
+
+from ttl_cache import TTLCache
+
+
+class HistoryCache:
+    """Per-conversation message history backed by stored ``Message`` rows.
+
+    ``loader`` is called with a conversation id on a miss and returns that
+    conversation's ``(role, content)`` rows in chronological order. A
+    ``max_entries`` of ``0`` disables caching, so every lookup reads the
+    database (needed when several workers serve the same conversation).
+    """
+
+    def __init__(self, loader, max_entries=10000, ttl_seconds=3600.0):
+        self.loader = loader
+        self._histories = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.loads = 0
+
+    def get(self, conversation_id):
+        """Return a copy of the conversation's history"""
+        history = self._histories.get(conversation_id)
+        if history is None:
+            self.loads += 1
+            history = tuple(
+                {"role": role, "content": content or ""}
+                for role, content in self.loader(conversation_id)
+            )
+            self._histories.set(conversation_id, history)
+        return list(history)
+
+    def set(self, conversation_id, messages):
+        self._histories.set(
+            conversation_id,
+            tuple(
+                {"role": message.get("role"), "content": message.get("content") or ""}
+                for message in messages
+            ),
+        )
+
+    def forget(self, conversation_id):
+        self._histories.pop(conversation_id)
+
+    def stats(self):
+        stats = self._histories.stats()
+        stats["database_loads"] = self.loads
+        return stats
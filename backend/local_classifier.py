@@ -0,0 +1,262 @@
+"""Local fast-path classifier for the chat state machine.
+
+Many child answers are trivially classifiable ("I don't know", an empty
+answer, "why does ...?"), yet every turn pays for an LLM round trip to
+label them. ``LocalClassifier`` combines hand-written rules with a small
+multinomial naive Bayes model trained from the labels already stored in
+``messages.evaluation_result``. When its confidence clears the configured
+threshold the label is used without a network call; otherwise the caller
+falls back to the LLM and the local guess is scored against the LLM's label
+so agreement can be monitored before raising the threshold.
+
+Two decisions are supported:
+
+- ``"state"``: has the child noticed the phenomenon (``discover``) or not
+  (``scaffolding``), as asked by the scaffolding evaluator
+- ``"level"``: the question level labels used by ``prompts.scienceqa``
+"""
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from itertools import pairwise
+
+STATE_LABELS = ["discover", "scaffolding"]
+LEVEL_LABELS = [
+    "no_question",
+    "irrelevant",
+    "factual",
+    "explanatory",
+    "general_causal",
+    "specific_causal",
+]
+DECISION_LABELS = {"state": STATE_LABELS, "level": LEVEL_LABELS}
+
+_TOKEN = re.compile(r"[a-z']+")
+
+_UNSURE = re.compile(
+    r"^(i\s+(don'?t|do not|dunno)\s+know|i\s+dunno|idk|dunno|not\s+sure|"
+    r"i'?m\s+not\s+sure|no\s+idea|nothing|i\s+don'?t\s+see\s+anything|hmm+|um+)\b"
+)
+_ACKNOWLEDGEMENT = re.compile(
+    r"^(ok(ay)?|yes|yeah|yep|no|nope|sure|cool|wow|thanks?( you)?|i see|got it)[.! ]*$"
+)
+_INTERROGATIVE = re.compile(
+    r"^(why|how|what|when|where|which|who|is|are|can|could|does|do|did|will|would|"
+    r"should|if)\b"
+)
+_SPECIFIC_CAUSAL = re.compile(
+    r"\b(how\s+(far|close|long|many|much|high|fast)|distance|degree|angle|"
+    r"number\s+of|times|seconds|minutes|inches|centimet(er|re)s?)\b"
+)
+_GENERAL_CAUSAL = re.compile(
+    r"^(what\s+(happens|would\s+happen|will\s+happen)\s+(if|when)|what\s+if|"
+    r"would\s+it|will\s+it|if\s+i)\b"
+)
+_EXPLANATORY = re.compile(r"^(why|how)\s+(does|do|did|is|are|can|come)\b")
+
+
+@dataclass(frozen=True)
+class Prediction:
+    label: str
+    confidence: float
+    source: str  # "rule" or "model"
+
+
+def tokenize(text):
+    tokens = _TOKEN.findall(text.lower())
+    return tokens + [f"{a} {b}" for a, b in pairwise(tokens)]
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes over unigrams and bigrams with add-one smoothing"""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.label_counts = Counter()
+        self.token_counts = defaultdict(Counter)
+        self.token_totals = Counter()
+        self.vocabulary = set()
+
+    @property
+    def examples(self):
+        return sum(self.label_counts.values())
+
+    def add(self, text, label):
+        if label not in self.labels:
+            return
+        tokens = tokenize(text)
+        self.label_counts[label] += 1
+        self.token_counts[label].update(tokens)
+        self.token_totals[label] += len(tokens)
+        self.vocabulary.update(tokens)
+
+    def predict(self, text):
+        """Return ``(label, posterior probability)`` or ``None`` if untrained"""
+        seen = [label for label in self.labels if self.label_counts[label]]
+        if not seen:
+            return None
+        tokens = tokenize(text)
+        vocabulary_size = len(self.vocabulary) + 1
+        total = self.examples
+        scores = {}
+        for label in seen:
+            score = math.log(self.label_counts[label] / total)
+            denominator = self.token_totals[label] + vocabulary_size
+            counts = self.token_counts[label]
+            for token in tokens:
+                score += math.log((counts[token] + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+
+class LocalClassifier:
+    """Rules plus per-decision naive Bayes models with agreement tracking.
+
+    ``mode`` is ``"off"`` (always ask the LLM), ``"shadow"`` (ask the LLM and
+    score the local guess against it) or ``"on"`` (skip the LLM when the
+    local guess is confident). ``threshold`` is the minimum confidence for a
+    local label to be used without asking the LLM; ``min_examples`` is how
+    many stored labels a decision's model needs before its predictions are
+    trusted at all.
+    """
+
+    def __init__(self, threshold=0.9, min_examples=200, mode="shadow"):
+        self.mode = mode
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self._lock = threading.Lock()
+        self.models = {
+            decision: NaiveBayesModel(labels)
+            for decision, labels in DECISION_LABELS.items()
+        }
+        self.local_hits = Counter()
+        self.fallbacks = Counter()
+        self.agreements = Counter()
+        self.disagreements = Counter()
+
+    def train(self, examples):
+        """Rebuild the models from ``(decision, text, label)`` examples"""
+        models = {
+            decision: NaiveBayesModel(labels)
+            for decision, labels in DECISION_LABELS.items()
+        }
+        for decision, text, label in examples:
+            if decision in models:
+                models[decision].add(text, label)
+        with self._lock:
+            self.models = models
+
+    def predict(self, decision, text):
+        """Best local guess for ``decision`` or ``None`` if there is none"""
+        if decision not in DECISION_LABELS:
+            return None
+        prediction = _rule_prediction(decision, (text or "").strip().lower())
+        if prediction is not None:
+            return prediction
+        model = self.models[decision]
+        if model.examples < self.min_examples:
+            return None
+        result = model.predict(text or "")
+        if result is None:
+            return None
+        return Prediction(label=result[0], confidence=result[1], source="model")
+
+    def classify(self, decision, text, ask_llm, llm_errors=()):
+        """Label ``text`` for ``decision``, locally or with ``ask_llm()``.
+
+        In ``on`` mode a confident local label is returned without calling
+        ``ask_llm``. Otherwise the LLM's label is returned and the local
+        guess is scored against it; if the call fails with one of
+        ``llm_errors``, the local guess is used when there is one.
+        """
+        if self.mode == "off" or decision not in DECISION_LABELS:
+            return ask_llm()
+        prediction = self.predict(decision, text)
+        if self.mode == "on" and self.accept(decision, prediction):
+            print(f"local {decision} label: {prediction.label} ({prediction.source})")
+            return prediction.label
+        try:
+            label = ask_llm()
+        except llm_errors as e:
+            if prediction is None:
+                raise
+            # Better a local label than failing the whole turn
+            print(f"Evaluator call failed ({e}), using local {decision} label")
+            return prediction.label
+        self.record_agreement(decision, prediction, label)
+        return label
+
+    def accept(self, decision, prediction):
+        """Whether ``prediction`` is confident enough to skip the LLM"""
+        if prediction is None or prediction.confidence < self.threshold:
+            with self._lock:
+                self.fallbacks[decision] += 1
+            return False
+        with self._lock:
+            self.local_hits[(decision, prediction.source)] += 1
+        return True
+
+    def record_agreement(self, decision, prediction, llm_label):
+        """Score a local guess that was not used against the LLM's label"""
+        if prediction is None:
+            return
+        with self._lock:
+            if prediction.label == llm_label:
+                self.agreements[(decision, prediction.source)] += 1
+            else:
+                self.disagreements[(decision, prediction.source)] += 1
+
+    def stats(self):
+        with self._lock:
+            decisions = {}
+            for decision in DECISION_LABELS:
+                per_source = {}
+                for source in ["rule", "model"]:
+                    agreed = self.agreements[(decision, source)]
+                    compared = agreed + self.disagreements[(decision, source)]
+                    per_source[source] = {
+                        "local_hits": self.local_hits[(decision, source)],
+                        "compared_with_llm": compared,
+                        "agreement_rate": round(agreed / compared, 4)
+                        if compared
+                        else None,
+                    }
+                decisions[decision] = {
+                    "training_examples": self.models[decision].examples,
+                    "llm_fallbacks": self.fallbacks[decision],
+                    **per_source,
+                }
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "min_examples": self.min_examples,
+                "decisions": decisions,
+            }
+
+
+def _rule_prediction(decision, text):
+    if not text or _UNSURE.match(text):
+        label = "scaffolding" if decision == "state" else "no_question"
+        return Prediction(label=label, confidence=0.97, source="rule")
+    if decision == "state":
+        return None
+
+    if _ACKNOWLEDGEMENT.match(text):
+        return Prediction(label="no_question", confidence=0.95, source="rule")
+    if "?" not in text and not _INTERROGATIVE.match(text):
+        # "Tell me why it moves" is a question without a question mark
+        return Prediction(label="no_question", confidence=0.85, source="rule")
+    if _SPECIFIC_CAUSAL.search(text):
+        return Prediction(label="specific_causal", confidence=0.8, source="rule")
+    if _GENERAL_CAUSAL.match(text):
+        return Prediction(label="general_causal", confidence=0.85, source="rule")
+    if _EXPLANATORY.match(text):
+        # "why does"/"how does" questions are explanatory when on-topic, but an
+        # off-topic "why is her shirt red?" is irrelevant, so stay cautious
+        return Prediction(label="explanatory", confidence=0.8, source="rule")
+    return None
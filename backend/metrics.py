@@ -0,0 +1,201 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Histograms are cumulative per label combination and guarded by a lock, so
+they can be observed from request threads and the turn executor alike.
+Stats that other components already keep (caches, state store, classifier)
+are exported through collector callbacks at scrape time: running totals as
+``_total`` counters and sizes, depths and settings as gauges.
+"""
+
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+# Stats keys that only ever grow; a leaf under any of them is a counter
+CUMULATIVE_STATS = {
+    "batches",
+    "calls",
+    "cleanups",
+    "compared_with_llm",
+    "compressed_turns",
+    "database_loads",
+    "dedup_hits",
+    "evictions",
+    "expirations",
+    "failed",
+    "failures",
+    "gets",
+    "hedge_wins",
+    "hedges",
+    "hits",
+    "llm_fallbacks",
+    "load_count",
+    "local_hits",
+    "misses",
+    "puts",
+    "queued",
+    "reload_count",
+    "rescans",
+    "retried",
+    "retries",
+    "skipped",
+    "summary_errors",
+    "summary_refreshes",
+    "sync_fallbacks",
+    "tokens_saved",
+    "total_load_ms",
+    "truncated_turns",
+    "turns",
+    "written",
+}
+
+
+def metric_name(*parts):
+    return _INVALID_NAME_CHARS.sub("_", "_".join(part for part in parts if part))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative histogram with one series per label combination"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for key, values in series:
+                labels = list(zip(self.label_names, key))
+                for bound, count in zip(self.buckets, values):
+                    bucket_labels = format_labels(
+                        labels + [("le", format_value(bound))]
+                    )
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                inf_labels = format_labels(labels + [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{inf_labels} {values[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {values[-2]!r}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms plus counters and gauges read from ``stats()`` dicts"""
+
+    def __init__(self, prefix="curio"):
+        self.prefix = prefix
+        self._histograms = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(
+            metric_name(self.prefix, name), documentation, label_names, buckets
+        )
+        self._histograms.append(histogram)
+        return histogram
+
+    def register_stats(self, name, stats):
+        """Export the numeric leaves of ``stats()`` as ``<prefix>_<name>_*``
+
+        Leaves under a ``CUMULATIVE_STATS`` key become ``_total`` counters and
+        the rest gauges.
+        """
+        self._collectors.append((name, stats))
+
+    def render(self):
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for name, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+                continue
+            for path, value in _numeric_leaves(values):
+                if CUMULATIVE_STATS.intersection(path):
+                    metric = metric_name(self.prefix, name, *path, "total")
+                    kind = "counter"
+                else:
+                    metric = metric_name(self.prefix, name, *path)
+                    kind = "gauge"
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _numeric_leaves(values, path=()):
+    """Yield (key path, value) of each number in nested ``values``"""
+    for key, value in values.items():
+        key_path = (*path, str(key))
+        if isinstance(value, dict):
+            yield from _numeric_leaves(value, key_path)
+        elif isinstance(value, bool):
+            yield key_path, int(value)
+        elif isinstance(value, (int, float)):
+            yield key_path, value
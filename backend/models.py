@@ -7,8 +7,20 @@ Separated from app.py to avoid circular imports during Alembic migrations.
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, LargeBinary, String, Text
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    false,
+)
+from sqlalchemy.orm import declarative_base, deferred, relationship
 
 Base = declarative_base()
 
@@ -34,6 +46,14 @@ class Conversation(Base):
         "Message", back_populates="conversation", cascade="all, delete-orphan"
     )
 
+    # The viewer lists conversations newest first, optionally filtered by
+    # session or phenomenon
+    __table_args__ = (
+        Index("ix_conversations_created_at", "created_at"),
+        Index("ix_conversations_session_id_created_at", "session_id", "created_at"),
+        Index("ix_conversations_phenomenon_created_at", "phenomenon", "created_at"),
+    )
+
 
 class Message(Base):
     """Message model representing individual messages in a conversation."""
@@ -46,8 +66,61 @@ class Message(Base):
     content = Column(Text, nullable=False)
     state = Column(String)
     evaluation_result = Column(String)
-    audio_data = Column(LargeBinary)
+    # Recorded audio lives in the blob store under this content hash
+    audio_blob_key = Column(String)
+    # Written with the message so listings never need to touch the audio
+    has_audio = Column(Boolean, default=False, server_default=false(), nullable=False)
+    audio_size_bytes = Column(Integer)
     audio_mime_type = Column(String)
+    # Legacy inline audio; moved to the blob store by migration d5f3b8c1e7a2.
+    # Deferred, so only loaded when accessed.
+    audio_data = deferred(Column(LargeBinary))
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     conversation = relationship("Conversation", back_populates="messages")
+
+    # Messages are always read per conversation in creation order
+    __table_args__ = (
+        Index(
+            "ix_messages_conversation_id_created_at", "conversation_id", "created_at"
+        ),
+    )
+
+
+class ConversationStateRecord(Base):
+    """Shared key-value row for conversation state machine data.
+
+    Used by ``DatabaseStateStore`` so that any worker process can serve any
+    turn of a conversation.
+    """
+
+    __tablename__ = "conversation_states"
+
+    key = Column(String, primary_key=True)
+    data = Column(Text, nullable=False)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False
+    )
+
+    # Idle rows are deleted by updated_at
+    __table_args__ = (Index("ix_conversation_states_updated_at", "updated_at"),)
+
+
+class TurnSpan(Base):
+    """One timed span of a request that served part of a turn.
+
+    Spans of the requests that make up one spoken turn share a ``turn_id``.
+    The root span of each request is named ``request <endpoint>``.
+    """
+
+    __tablename__ = "turn_spans"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    turn_id = Column(String, nullable=False, index=True)
+    conversation_id = Column(String, index=True)
+    endpoint = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_ms = Column(Float)
+    ttfb_ms = Column(Float)
+    attributes = Column(Text)
@@ -0,0 +1,221 @@
+"""Language model providers behind the chat pipeline.
+
+Every model call of a turn goes through a provider: ``complete`` for the
+evaluators, knowledge retrieval and summaries, ``stream`` for the reply,
+``transcribe`` for Whisper and ``speech`` for TTS. ``OpenAIProvider`` calls
+the OpenAI API. ``StubProvider`` answers offline with deterministic canned
+outputs after simulated latencies, so the whole request path can be load
+tested without network access or an API key.
+"""
+
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+
+import httpx
+from openai import APITimeoutError
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz, ~26 ms)
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+_LABEL_TAG = re.compile(r"<([a-z_]+)>")
+
+
+class OpenAIProvider:
+    """Chat, transcription and speech through an ``OpenAI``-shaped client"""
+
+    name = "openai"
+
+    def __init__(
+        self,
+        client,
+        chat_model="gpt-4",
+        whisper_model="whisper-1",
+        tts_model="tts-1",
+        tts_voice="alloy",
+        max_tokens=500,
+    ):
+        self.client = client
+        self.chat_model = chat_model
+        self.whisper_model = whisper_model
+        self.tts_model = tts_model
+        self.tts_voice = tts_voice
+        self.max_tokens = max_tokens
+
+    def _client(self, timeout=None, max_retries=None):
+        options = {}
+        if timeout is not None:
+            options["timeout"] = timeout
+        if max_retries is not None:
+            options["max_retries"] = max_retries
+        return self.client.with_options(**options) if options else self.client
+
+    def complete(self, messages, timeout=None, max_retries=None):
+        """Text of a chat completion of ``messages``"""
+        response = self._client(timeout, max_retries).chat.completions.create(
+            model=self.chat_model, messages=messages, max_tokens=self.max_tokens
+        )
+        return response.choices[0].message.content or ""
+
+    def stream(self, messages):
+        """Yield the text deltas of a streamed chat completion"""
+        stream = self.client.chat.completions.create(
+            model=self.chat_model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    def transcribe(self, filename, audio_bytes, timeout=None):
+        # OpenAI API expects (filename, file-like object) tuple
+        transcript = self._client(timeout).audio.transcriptions.create(
+            model=self.whisper_model,
+            file=(filename, io.BytesIO(audio_bytes)),
+            response_format="json",
+        )
+        return transcript.text
+
+    def speech(self, text):
+        """mp3 bytes of ``text`` spoken with the configured voice"""
+        response = self.client.audio.speech.create(
+            model=self.tts_model,
+            voice=self.tts_voice,
+            input=text,
+            response_format="mp3",
+        )
+        return response.content
+
+
+class Latency:
+    """Log-normal latency given by its median and p95, in milliseconds"""
+
+    def __init__(self, median_ms=0.0, p95_ms=None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms if p95_ms is not None else median_ms
+
+    def sample(self, rng):
+        if self.median_ms <= 0:
+            return 0.0
+        sigma = math.log(max(self.p95_ms, self.median_ms) / self.median_ms) / 1.645
+        return rng.lognormvariate(math.log(self.median_ms), sigma) / 1000
+
+
+class StubProvider:
+    """Deterministic offline provider with canned outputs.
+
+    ``responses`` has the shape of ``stub_responses.json``. Its ``rules`` are
+    tried in order against the first message; the first whose ``match``
+    substring occurs answers with one of its canned ``replies``, or computes
+    the reply: ``"reply": "label"`` picks one of the ``<label>`` tags listed
+    in the prompt and ``"reply": "knowledge"`` one of the names in its
+    ``<Knowledge Components>`` list. ``default`` replies, ``transcripts`` and
+    per-operation ``latency`` (``median_ms`` and ``p95_ms``) complete it.
+
+    Which canned output is used depends only on the input, so runs are
+    reproducible. Latencies are drawn from a generator seeded with ``seed``
+    and multiplied by ``latency_scale`` (``0`` answers immediately).
+    """
+
+    name = "stub"
+    chat_model = "stub"
+    tts_model = "stub"
+    tts_voice = "stub"
+
+    def __init__(self, responses, latency_scale=1.0, seed=0):
+        self.rules = responses.get("rules", [])
+        self.default = responses.get("default", ["Hello!"])
+        self.transcripts = responses.get("transcripts", ["Why does that happen?"])
+        self.latency = {
+            operation: Latency(**spec)
+            for operation, spec in responses.get("latency", {}).items()
+        }
+        self.latency_scale = latency_scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, "r") as responses_file:
+            return cls(json.load(responses_file), **kwargs)
+
+    def _wait(self, operation, timeout=None):
+        latency = self.latency.get(operation)
+        with self._lock:
+            self.calls += 1
+            seconds = latency.sample(self._rng) if latency else 0.0
+        seconds *= self.latency_scale
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise APITimeoutError(
+                request=httpx.Request("POST", f"http://stub.invalid/{operation}")
+            )
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def reply(self, messages):
+        """Canned reply to ``messages``"""
+        prompt = (messages[0].get("content") or "") if messages else ""
+        key = zlib.crc32((messages[-1].get("content") or "").encode("utf-8"))
+        for rule in self.rules:
+            if rule.get("match", "") not in prompt:
+                continue
+            if rule.get("reply") == "label":
+                labels = sorted(set(_lowercase_tags(prompt)))
+                return f"<{labels[key % len(labels)]}>" if labels else ""
+            if rule.get("reply") == "knowledge":
+                names = _knowledge_components(prompt)
+                return json.dumps([names[key % len(names)]]) if names else "[]"
+            return _pick(rule.get("replies") or self.default, key)
+        return _pick(self.default, key)
+
+    def complete(self, messages, timeout=None, max_retries=None):
+        self._wait("complete", timeout)
+        return self.reply(messages)
+
+    def stream(self, messages):
+        self._wait("first_token")
+        words = self.reply(messages).split(" ")
+        for index, word in enumerate(words):
+            if index:
+                self._wait("token")
+            yield word if index == len(words) - 1 else word + " "
+
+    def transcribe(self, filename, audio_bytes, timeout=None):
+        self._wait("transcribe", timeout)
+        return _pick(self.transcripts, zlib.crc32(audio_bytes))
+
+    def speech(self, text):
+        self._wait("speech")
+        # Roughly the length of the spoken text
+        return SILENT_MP3_FRAME * max(1, len(text) // 2)
+
+    def stats(self):
+        return {"provider": self.name, "calls": self.calls}
+
+
+def _pick(options, key):
+    return options[key % len(options)]
+
+
+def _lowercase_tags(prompt):
+    return _LABEL_TAG.findall(prompt)
+
+
+def _knowledge_components(prompt):
+    _, _, rest = prompt.partition("<Knowledge Components>")
+    try:
+        return json.loads(rest.partition("</Knowledge Components>")[0])
+    except ValueError:
+        return []
@@ -0,0 +1,301 @@
+"""Preloaded registry of prompt templates, phenomenon data and the knowledge graph.
+
+Every data file the chat pipeline needs is read once into an immutable
+snapshot. Lookups go through the snapshot in memory; the files on disk are
+only stat'ed (at most once per check interval) so that edits to a prompt can
+be picked up without restarting the server.
+
+``knowledge/phenomena.json`` ties the data files together: it maps each
+phenomenon slug to its image file names, its entry in
+``prompts/phenomenon.json`` and its section of ``knowledge/kg.json``. The
+mapping is validated on every load.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from retrieval import build_knowledge_indexes
+from templates import CompiledTemplate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROMPTS_DIR = os.path.join(BASE_DIR, "prompts")
+KNOWLEDGE_DIR = os.path.join(BASE_DIR, "knowledge")
+
+KNOWLEDGE_MODES = ["definition", "explanation", "definition_and_explanation"]
+
+
+def freeze(value):
+    """Recursively convert dicts and lists into read-only equivalents"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class Phenomenon:
+    """One phenomenon and where its data lives in the other files"""
+
+    slug: str
+    images: tuple
+    content: str
+    knowledge: str
+
+
+def image_id(image_path):
+    """Lowercased file name of an image path or URL, without any query string"""
+    path = image_path.split("?", 1)[0].split("#", 1)[0]
+    return path.replace("\\", "/").rsplit("/", 1)[-1].strip().lower()
+
+
+def build_phenomena(catalog, phenomena, knowledge):
+    """Validate ``phenomena.json`` and index it by slug and by image id.
+
+    Raises ``ValueError`` naming every problem, so a bad catalog fails at
+    startup (or keeps the previous snapshot on reload) instead of mid-turn.
+    """
+    entries = {}
+    images = {}
+    errors = []
+    for slug, data in catalog.get("phenomena", {}).items():
+        entry = Phenomenon(
+            slug=slug,
+            images=tuple(image_id(image) for image in data.get("images", [])),
+            content=data.get("content", slug),
+            knowledge=data.get("knowledge", ""),
+        )
+        if entry.content not in phenomena:
+            errors.append(f"{slug}: no '{entry.content}' in phenomenon.json")
+        if entry.knowledge not in knowledge:
+            errors.append(f"{slug}: no '{entry.knowledge}' section in kg.json")
+        for image in entry.images:
+            if image in images:
+                errors.append(f"{slug}: image {image} already used by {images[image]}")
+            images[image] = slug
+        entries[slug] = entry
+
+    default = catalog.get("default")
+    if default not in entries:
+        errors.append(f"default phenomenon '{default}' is not defined")
+    if errors:
+        raise ValueError("Invalid phenomena.json: " + "; ".join(errors))
+    return entries, images, default
+
+
+def render_knowledge_snippet(name, concept, mode):
+    """Text of one concept in the ``<Relevant Knowledge Components>`` block"""
+    if mode == "definition":
+        return f"'{name}':\n\nDefinition: {concept['definition']}"
+    if mode == "explanation":
+        return f"'{name}':\n\nExplanation: {concept['explanation']}"
+    return (
+        f"'{name}':\n\nDefinition: {concept['definition']}"
+        f"\n\nExplanation: {concept['explanation']}"
+    )
+
+
+def build_knowledge_snippets(knowledge):
+    """Every ``(section, concept, mode)`` snippet, rendered once per load"""
+    return {
+        (section, name, mode): render_knowledge_snippet(name, concept, mode)
+        for section, data in knowledge.items()
+        for name, concept in data.get("concepts", {}).items()
+        for mode in KNOWLEDGE_MODES
+    }
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    """Immutable view of all prompt and knowledge data at one point in time"""
+
+    prompts: MappingProxyType
+    templates: MappingProxyType
+    phenomena: MappingProxyType
+    phenomenon_entries: MappingProxyType
+    phenomenon_images: MappingProxyType
+    default_phenomenon: str
+    knowledge: MappingProxyType
+    knowledge_indexes: MappingProxyType
+    knowledge_snippets: MappingProxyType
+    mtimes: MappingProxyType
+    loaded_at: float
+    load_seconds: float
+
+
+class PromptRegistry:
+    """Loads prompt templates and data files once and reloads them on change.
+
+    ``snapshot()`` returns the current ``RegistrySnapshot``. The files are
+    re-stat'ed at most every ``check_interval`` seconds and the snapshot is
+    rebuilt only when one of the mtimes differs from the loaded ones. A
+    ``check_interval`` of ``0`` or less disables hot reloading.
+    """
+
+    def __init__(
+        self, prompts_dir=PROMPTS_DIR, knowledge_dir=KNOWLEDGE_DIR, check_interval=2.0
+    ):
+        self.prompts_dir = prompts_dir
+        self.phenomenon_file = os.path.join(prompts_dir, "phenomenon.json")
+        self.knowledge_file = os.path.join(knowledge_dir, "kg.json")
+        self.catalog_file = os.path.join(knowledge_dir, "phenomena.json")
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._load_count = 0
+        self._reload_count = 0
+        self._total_load_seconds = 0.0
+        self._snapshot = self._load()
+
+    def _watched_files(self):
+        files = [
+            os.path.join(self.prompts_dir, name)
+            for name in sorted(os.listdir(self.prompts_dir))
+            if name.endswith(".txt")
+        ]
+        files.append(self.phenomenon_file)
+        files.append(self.knowledge_file)
+        files.append(self.catalog_file)
+        return files
+
+    def _current_mtimes(self):
+        mtimes = {}
+        for path in self._watched_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return mtimes
+
+    def _load(self):
+        start = time.perf_counter()
+        mtimes = self._current_mtimes()
+
+        prompts = {}
+        for path in mtimes:
+            if not path.endswith(".txt"):
+                continue
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path, "r") as prompt_file:
+                prompts[name] = prompt_file.read()
+
+        with open(self.phenomenon_file, "r") as phenomenon_file:
+            phenomena = json.load(phenomenon_file)
+        with open(self.knowledge_file, "r") as knowledge_file:
+            knowledge = json.load(knowledge_file)
+        with open(self.catalog_file, "r") as catalog_file:
+            catalog = json.load(catalog_file)
+        entries, images, default = build_phenomena(catalog, phenomena, knowledge)
+        knowledge_indexes = build_knowledge_indexes(knowledge)
+        knowledge_snippets = build_knowledge_snippets(knowledge)
+
+        load_seconds = time.perf_counter() - start
+        self._load_count += 1
+        self._total_load_seconds += load_seconds
+        self._last_check = time.monotonic()
+        return RegistrySnapshot(
+            prompts=freeze(prompts),
+            templates=MappingProxyType(
+                {name: CompiledTemplate(text) for name, text in prompts.items()}
+            ),
+            phenomena=freeze(phenomena),
+            phenomenon_entries=MappingProxyType(entries),
+            phenomenon_images=MappingProxyType(images),
+            default_phenomenon=default,
+            knowledge=freeze(knowledge),
+            knowledge_indexes=MappingProxyType(knowledge_indexes),
+            knowledge_snippets=MappingProxyType(knowledge_snippets),
+            mtimes=MappingProxyType(mtimes),
+            loaded_at=time.time(),
+            load_seconds=load_seconds,
+        )
+
+    def snapshot(self):
+        """Return the current snapshot, reloading it if a file changed on disk"""
+        if self.check_interval <= 0:
+            return self._snapshot
+        if time.monotonic() - self._last_check < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return self._snapshot
+            self._last_check = time.monotonic()
+            if self._current_mtimes() != self._snapshot.mtimes:
+                self.reload()
+        return self._snapshot
+
+    def reload(self):
+        """Unconditionally rebuild the snapshot from disk"""
+        try:
+            snapshot = self._load()
+        except (OSError, ValueError) as e:
+            # Keep serving the previous snapshot if a file is mid-edit or invalid
+            print(f"Failed to reload prompt registry: {e}")
+            return self._snapshot
+        self._snapshot = snapshot
+        self._reload_count += 1
+        print(f"Reloaded prompt registry in {snapshot.load_seconds * 1000:.2f} ms")
+        return snapshot
+
+    def prompt(self, name):
+        return self.snapshot().prompts[name]
+
+    def template(self, name):
+        return self.snapshot().templates[name]
+
+    def resolve_phenomenon(self, image_path):
+        """Slug of the phenomenon shown in ``image_path``, or the default one"""
+        snapshot = self.snapshot()
+        image = image_id(image_path or "")
+        slug = snapshot.phenomenon_images.get(image)
+        if slug is None:
+            # Accept a bare slug as well as an image path
+            slug = image if image in snapshot.phenomenon_entries else None
+        if slug is None:
+            if image:
+                print(f"Unknown image {image!r}, using {snapshot.default_phenomenon}")
+            return snapshot.default_phenomenon
+        return slug
+
+    def phenomenon_entry(self, slug):
+        snapshot = self.snapshot()
+        return snapshot.phenomenon_entries.get(
+            slug, snapshot.phenomenon_entries[snapshot.default_phenomenon]
+        )
+
+    def phenomenon(self, slug):
+        """Content of ``slug`` from ``phenomenon.json``"""
+        entry = self.phenomenon_entry(slug)
+        return self.snapshot().phenomena.get(entry.content, MappingProxyType({}))
+
+    def knowledge(self):
+        return self.snapshot().knowledge
+
+    def knowledge_index(self, section):
+        return self.snapshot().knowledge_indexes[section]
+
+    def knowledge_snippets(self, section, concepts, mode):
+        """Precomputed snippets of ``concepts`` in order, skipping unknown ones"""
+        snippets = self.snapshot().knowledge_snippets
+        keys = [(section, concept, mode) for concept in concepts]
+        return [snippets[key] for key in keys if key in snippets]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "files": len(snapshot.mtimes),
+            "phenomena": len(snapshot.phenomenon_entries),
+            "images": len(snapshot.phenomenon_images),
+            "knowledge_snippets": len(snapshot.knowledge_snippets),
+            "prompts": sorted(snapshot.prompts.keys()),
+            "loaded_at": snapshot.loaded_at,
+            "last_load_ms": round(snapshot.load_seconds * 1000, 3),
+            "load_count": self._load_count,
+            "reload_count": self._reload_count,
+            "total_load_ms": round(self._total_load_seconds * 1000, 3),
+            "check_interval_seconds": self.check_interval,
+        }
@@ -0,0 +1,161 @@
+"""In-process BM25 retrieval over the knowledge graph.
+
+Choosing which ``kg.json`` concepts match the child's latest message used to
+take a full LLM round trip. ``BM25Index`` is an inverted index over one
+phenomenon's concept names, definitions and explanations; it is built once
+when the knowledge graph is loaded and answers a top-k query with a handful
+of dictionary lookups.
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+_STOPWORD_TEXT = (
+    "a an and are as at be but by can could did do does doing for from had "
+    "has have her his how i if in into is it its itself me my of off on or "
+    "our she so than that the their them then there these they this those "
+    "to too up was we were what when where which while who why will with "
+    "would you your"
+)
+STOPWORDS = frozenset(_STOPWORD_TEXT.split())
+
+# Concept names are short and decisive, so their terms count several times
+NAME_WEIGHT = 3
+
+
+def stem(word):
+    """Strip common English suffixes so "rubbing", "rubbed" and "rubs" match.
+
+    A final silent "e" is dropped as well, so "charge", "charges" and
+    "charging" all stem to "charg". A doubled consonant left by "-ing" or
+    "-ed" is undoubled ("rubbing" to "rub") except for l, s and z, which are
+    doubled in the base word too ("falling" to "fall").
+    """
+    for suffix in ("ing", "ed", "es", "s"):
+        # "glass" and "focus" are not plurals
+        if suffix == "s" and word.endswith(("ss", "us")):
+            break
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            if (
+                suffix in ("ing", "ed")
+                and word[-1] == word[-2]
+                and word[-1] not in "lsz"
+            ):
+                word = word[:-1]
+            break
+    if word.endswith("e") and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def analyze(text):
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over ``(name, text)`` documents.
+
+    Scores are normalised by what the query could score at best: the sum,
+    over its terms, of the highest weight the term has in any document, with
+    terms found in no document counted at the weight of a term found in only
+    one. A score is the share of the query a document explains, between 0 and
+    1, so one threshold works for sections with few or many concepts.
+    """
+
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.names = [name for name, _ in documents]
+        self.k1 = k1
+        self.b = b
+        lengths = []
+        term_frequencies = []
+        for name, text in documents:
+            terms = analyze(text)
+            lengths.append(len(terms))
+            term_frequencies.append(Counter(terms))
+        average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+        # term -> [(document id, precomputed BM25 weight)]
+        self.postings = defaultdict(list)
+        document_count = len(documents)
+        # Weight of a term that occurs once in one document of average length
+        self.unseen_weight = (
+            math.log(1 + (document_count - 0.5) / 1.5) if document_count else 0.0
+        )
+        document_frequency = Counter(
+            term for frequencies in term_frequencies for term in frequencies
+        )
+        for doc_id, frequencies in enumerate(term_frequencies):
+            norm = k1 * (1 - b + b * lengths[doc_id] / (average_length or 1.0))
+            for term, frequency in frequencies.items():
+                count = document_frequency[term]
+                idf = math.log(1 + (document_count - count + 0.5) / (count + 0.5))
+                weight = idf * frequency * (k1 + 1) / (frequency + norm)
+                self.postings[term].append((doc_id, weight))
+        self.postings = dict(self.postings)
+        self.max_weights = {
+            term: max(weight for _, weight in postings)
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k=3, min_score=0.0):
+        """Return up to ``k`` ``(name, normalised score)`` pairs, best first"""
+        terms = set(analyze(query))
+        attainable = sum(
+            self.max_weights.get(term, self.unseen_weight) for term in terms
+        )
+        if not attainable:
+            return []
+        scores = defaultdict(float)
+        for term in terms:
+            for doc_id, weight in self.postings.get(term, ()):
+                scores[doc_id] += weight
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            (self.names[doc_id], score / attainable)
+            for doc_id, score in ranked[:k]
+            if score / attainable > min_score
+        ]
+
+
+def concept_document(name, concept):
+    """Searchable text of one knowledge graph concept"""
+    return " ".join(
+        [name] * NAME_WEIGHT
+        + [concept.get("definition", ""), concept.get("explanation", "")]
+    )
+
+
+def build_knowledge_indexes(knowledge):
+    """One ``BM25Index`` per knowledge graph section"""
+    return {
+        section: BM25Index(
+            [
+                (name, concept_document(name, concept))
+                for name, concept in data.get("concepts", {}).items()
+            ]
+        )
+        for section, data in knowledge.items()
+    }
+
+
+def parse_concept_list(raw, concepts):
+    """Concept names mentioned in an LLM reply, in the order they appear.
+
+    The retrieval prompt asks for a list of names, but replies come back as
+    JSON, Python-style lists with single or curly quotes, or an empty string.
+    Matching the known names directly accepts all of them.
+    """
+    text = raw.lower()
+    found = []
+    for name in concepts:
+        pattern = (
+            r"(?:^|[\[(,'\"“‘]\s*)" + re.escape(name.lower()) + r"(?=$|[\]),'\"”’\s])"
+        )
+        match = re.search(pattern, text)
+        if match:
+            found.append((match.start(), name))
+    return [name for _, name in sorted(found)]
@@ -0,0 +1,83 @@
+"""Sentence-pipelined text-to-speech for streamed chat replies.
+
+While the reply is still being generated, every completed sentence is handed
+to TTS on a worker thread. Audio segments are yielded strictly in sentence
+order as soon as the head of the queue is ready, so the first audio arrives
+after the first sentence instead of after the whole reply.
+"""
+
+import re
+from collections import deque
+
+# A sentence ends with terminal punctuation, optionally followed by closing
+# quotes or brackets, and then whitespace
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+")
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and cuts it into complete sentences.
+
+    Fragments shorter than ``min_chars`` are held back and merged with the
+    following sentence so TTS is not called for a lone "Oh!".
+    """
+
+    def __init__(self, min_chars=12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add a text delta and return the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start : match.end()].strip()
+            if len(candidate) < self.min_chars:
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended"""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+
+def _drain(pending, block):
+    while pending and (block or pending[0][2].done()):
+        index, sentence, future = pending.popleft()
+        yield ("audio", index, sentence, future.result())
+
+
+def pipeline_speech(deltas, synthesize, executor, min_chars=12):
+    """Interleave text deltas with in-order synthesized sentence audio.
+
+    Yields ``("token", text)`` for every delta from ``deltas`` and
+    ``("audio", index, sentence, audio_bytes)`` for every sentence, in
+    sentence order. ``synthesize`` is called on ``executor`` threads.
+    """
+    splitter = SentenceSplitter(min_chars=min_chars)
+    pending = deque()
+    next_index = 0
+    try:
+        for delta in deltas:
+            yield ("token", delta)
+            for sentence in splitter.feed(delta):
+                future = executor.submit(synthesize, sentence)
+                pending.append((next_index, sentence, future))
+                next_index += 1
+            yield from _drain(pending, block=False)
+
+        for sentence in splitter.flush():
+            pending.append(
+                (next_index, sentence, executor.submit(synthesize, sentence))
+            )
+            next_index += 1
+        yield from _drain(pending, block=True)
+    finally:
+        # The client went away or generation failed; drop queued synthesis
+        for _, _, future in pending:
+            future.cancel()
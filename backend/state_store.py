@@ -0,0 +1,283 @@
+"""Pluggable storage for per-conversation state machine history.
+
+The chat state machine needs, for every conversation, the list of states it
+has been through and the question levels the child asked in ``scienceqa``.
+``InProcessStateStore`` keeps them in memory for a single worker;
+``DatabaseStateStore`` keeps them in the ``conversation_states`` table so any
+worker process or replica can serve any turn. On a cold miss both stores
+rebuild the state from the stored ``messages.state`` and
+``messages.evaluation_result`` columns.
+"""
+
+import json
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from models import ConversationStateRecord
+from ttl_cache import TTLCache
+
+QUESTION_LEVELS = [
+    "no_question",
+    "irrelevant",
+    "factual",
+    "explanatory",
+    "general_causal",
+    "specific_causal",
+]
+
+
+@dataclass
+class ConversationState:
+    """State machine history of one conversation"""
+
+    state_history: list = field(default_factory=list)
+    scienceqa_history: list = field(default_factory=list)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "state_history": self.state_history,
+                "scienceqa_history": self.scienceqa_history,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(
+            state_history=list(data.get("state_history", [])),
+            scienceqa_history=list(data.get("scienceqa_history", [])),
+        )
+
+
+def rebuild_state(message_rows):
+    """Replay stored messages to reconstruct a conversation's state.
+
+    ``message_rows`` are ``(role, state, evaluation_result)`` tuples in
+    chronological order. User rows carry the state the turn started in and the
+    classifier label; assistant rows carry the state the turn moved to.
+    """
+    conversation_state = ConversationState()
+    state_history = conversation_state.state_history
+    scienceqa_history = conversation_state.scienceqa_history
+    previous_state = "greet"
+    user_row = None
+
+    for role, state, evaluation_result in message_rows:
+        if role == "user":
+            user_row = (state, evaluation_result)
+            continue
+        # Assistant rows without a state were sent by the client before the
+        # first turn (its greeting) and did not move the state machine
+        if role != "assistant" or state is None:
+            continue
+
+        input_state = user_row[0] if user_row else previous_state
+        label = user_row[1] if user_row else None
+        user_row = None
+
+        if state == "scienceqa" and label in QUESTION_LEVELS:
+            scienceqa_history.append(label)
+        if (
+            input_state != "scienceqa"
+            or not state_history
+            or state_history[-1] != state
+        ):
+            state_history.append(state)
+
+        if state == "close":
+            state_history.clear()
+            scienceqa_history.clear()
+        previous_state = state or previous_state
+
+    return conversation_state
+
+
+class StateStore:
+    """Interface for conversation state storage.
+
+    ``loader`` is called with a conversation id on a cold miss and returns
+    that conversation's ``(role, state, evaluation_result)`` message rows.
+    """
+
+    def __init__(self, loader=None):
+        self.loader = loader
+
+    def get(self, conversation_id):
+        """Return the conversation's state, rebuilding it on a cold miss"""
+        state = self._get(conversation_id)
+        if state is None:
+            rows = self.loader(conversation_id) if self.loader else []
+            state = rebuild_state(rows)
+        return state
+
+    def save(self, conversation_id, state):
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": type(self).__name__}
+
+    def _get(self, conversation_id):
+        raise NotImplementedError
+
+
+class InProcessStateStore(StateStore):
+    """State kept in this process only; suitable for a single worker.
+
+    The map is bounded: entries idle for longer than ``ttl_seconds`` are
+    dropped and the least recently used entry is evicted past
+    ``max_entries``, so abandoned sessions do not grow memory. An evicted
+    conversation that comes back is rebuilt from its stored messages.
+    """
+
+    def __init__(self, loader=None, max_entries=10000, ttl_seconds=3600.0):
+        super().__init__(loader)
+        self._states = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    def _get(self, conversation_id):
+        return self._states.get(conversation_id)
+
+    def save(self, conversation_id, state):
+        self._states.set(conversation_id, state)
+
+    def delete(self, conversation_id):
+        self._states.pop(conversation_id)
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "conversations": self._states.stats(),
+        }
+
+
+class DatabaseStateStore(StateStore):
+    """State shared through the ``conversation_states`` table.
+
+    Works against Postgres in production and against a local SQLite file as a
+    stand-in, as long as every worker points at the same database.
+
+    Like the in-process store's entries, a row that has not been updated for
+    ``ttl_seconds`` (0 keeps rows forever) counts as missing and the state is
+    rebuilt from the messages. ``save`` deletes such rows at most every
+    ``cleanup_seconds``, so abandoned conversations do not grow the table.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        loader=None,
+        ttl_seconds=3600.0,
+        cleanup_seconds=300.0,
+        clock=datetime.utcnow,
+    ):
+        super().__init__(loader)
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_seconds = cleanup_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_cleanup = None
+        self.cleanups = 0
+        self.expirations = 0
+
+    def _read(self, key):
+        db = self.session_factory()
+        try:
+            record = db.get(ConversationStateRecord, key)
+            return (record.data, record.updated_at) if record else None
+        finally:
+            db.close()
+
+    def _write(self, key, data):
+        db = self.session_factory()
+        try:
+            # updated_at is set even when the data is unchanged, which
+            # would not issue an UPDATE and so not trigger onupdate
+            db.merge(
+                ConversationStateRecord(key=key, data=data, updated_at=self._clock())
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _remove(self, key):
+        db = self.session_factory()
+        try:
+            db.query(ConversationStateRecord).filter(
+                ConversationStateRecord.key == key
+            ).delete()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _cutoff(self):
+        return self._clock() - timedelta(seconds=self.ttl_seconds)
+
+    def _get(self, conversation_id):
+        record = self._read(conversation_id)
+        if record is None:
+            return None
+        raw, updated_at = record
+        if self.ttl_seconds > 0 and updated_at < self._cutoff():
+            return None
+        return ConversationState.from_json(raw)
+
+    def save(self, conversation_id, state):
+        self._write(conversation_id, state.to_json())
+        if self.ttl_seconds > 0 and self._cleanup_due():
+            try:
+                self.cleanup()
+            except Exception as e:
+                # The turn is stored; the rows are deleted on a later try
+                print(f"Error deleting idle conversation states: {e}")
+
+    def delete(self, conversation_id):
+        self._remove(conversation_id)
+
+    def _cleanup_due(self):
+        now = self._clock()
+        with self._lock:
+            if self._next_cleanup is not None and now < self._next_cleanup:
+                return False
+            self._next_cleanup = now + timedelta(seconds=self.cleanup_seconds)
+            return True
+
+    def cleanup(self):
+        """Delete rows idle for longer than ``ttl_seconds``; return how many"""
+        db = self.session_factory()
+        try:
+            deleted = (
+                db.query(ConversationStateRecord)
+                .filter(ConversationStateRecord.updated_at < self._cutoff())
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        with self._lock:
+            self.cleanups += 1
+            self.expirations += deleted
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self).__name__,
+                "ttl_seconds": self.ttl_seconds,
+                "cleanup_seconds": self.cleanup_seconds,
+                "cleanups": self.cleanups,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,99 @@
+"""OpenAI-compatible HTTP stand-in backed by the stub provider.
+
+    python stub_server.py
+
+Serves ``/v1/chat/completions`` (including streaming), ``/v1/audio/
+transcriptions`` and ``/v1/audio/speech`` with the canned outputs and
+simulated latencies of ``stub_responses.json``. Pointing the backend at it
+with ``OPENAI_BASE_URL=http://localhost:5002/v1`` (and any
+``OPENAI_API_KEY``) exercises the real OpenAI client path, including its
+connection pool, timeouts and retries, without network access.
+"""
+
+import json
+import os
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from providers import StubProvider
+
+app = Flask(__name__)
+
+stub = StubProvider.from_file(
+    os.getenv(
+        "STUB_RESPONSES_FILE",
+        os.path.join(os.path.dirname(__file__), "stub_responses.json"),
+    ),
+    latency_scale=float(os.getenv("STUB_LATENCY_SCALE", "1.0")),
+    seed=int(os.getenv("STUB_SEED", "0")),
+)
+
+
+def completion_chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    data = request.get_json()
+    messages = data.get("messages") or []
+    model = data.get("model", stub.chat_model)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if data.get("stream"):
+
+        def generate():
+            for delta in stub.stream(messages):
+                chunk = completion_chunk(completion_id, model, {"content": delta})
+                yield f"data: {json.dumps(chunk)}\n\n"
+            chunk = completion_chunk(completion_id, model, {}, "stop")
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+    content = stub.complete(messages)
+    return jsonify(
+        {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+@app.route("/v1/audio/transcriptions", methods=["POST"])
+def transcriptions():
+    audio = request.files.get("file")
+    audio_bytes = audio.read() if audio else b""
+    return jsonify(
+        {"text": stub.transcribe(audio.filename if audio else "", audio_bytes)}
+    )
+
+
+@app.route("/v1/audio/speech", methods=["POST"])
+def speech():
+    data = request.get_json()
+    return Response(stub.speech(data.get("input", "")), mimetype="audio/mpeg")
+
+
+if __name__ == "__main__":
+    app.run(
+        host="0.0.0.0", port=int(os.getenv("STUB_SERVER_PORT", "5002")), threaded=True
+    )
@@ -0,0 +1,81 @@
+"""Compiled prompt templates.
+
+Prompt templates mark where turn data goes with section tags such as
+``<Scientific Phenomenon>``. Instead of scanning and rewriting the template
+string with ``str.replace`` for every prompt, each template is split once into
+literal segments and named slots. Rendering is then a single ``join``.
+"""
+
+import json
+import re
+
+# Section tag -> slot name. The slot value is inserted on the line after the tag.
+SLOT_TAGS = {
+    "<Image Content>": "image_content",
+    "<Scientific Phenomenon>": "phenomenon",
+    "<Scientific Knowledge>": "knowledge",
+    "<Child's Question>": "child_question",
+    "<Conversation History>": "conversation_history",
+}
+
+_SLOT_PATTERN = re.compile("|".join(re.escape(tag) for tag in SLOT_TAGS))
+
+
+class CompiledTemplate:
+    """A prompt template split into literal segments and slot names.
+
+    ``segments`` always has one more entry than ``slots``; rendering interleaves
+    them as ``segments[0] + value(slots[0]) + segments[1] + ...``.
+    """
+
+    __slots__ = ("segments", "slots", "source")
+
+    def __init__(self, source):
+        self.source = source
+        segments = []
+        slots = []
+        position = 0
+        for match in _SLOT_PATTERN.finditer(source):
+            segments.append(source[position : match.end()] + "\n")
+            slots.append(SLOT_TAGS[match.group(0)])
+            position = match.end()
+        segments.append(source[position:])
+        self.segments = tuple(segments)
+        self.slots = tuple(slots)
+
+    def render(self, values):
+        """Fill every slot from ``values`` (a mapping of slot name -> str)"""
+        if not self.slots:
+            return self.source
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            parts.append(values.get(slot, ""))
+            parts.append(segment)
+        return "".join(parts)
+
+
+_compiled_cache = {}
+
+
+def compile_template(source):
+    """Compile ``source`` once and return the shared ``CompiledTemplate``"""
+    template = _compiled_cache.get(source)
+    if template is None:
+        template = CompiledTemplate(source)
+        _compiled_cache[source] = template
+    return template
+
+
+def build_prompt_values(phenomenon_data, messages):
+    """Compute the slot values for one chat turn.
+
+    The conversation history is serialized here once per turn and shared by
+    the classifier, retrieval and generation prompts.
+    """
+    return {
+        "image_content": phenomenon_data.get("image_content", ""),
+        "phenomenon": phenomenon_data.get("phenomenon", ""),
+        "knowledge": phenomenon_data.get("knowledge", ""),
+        "child_question": messages[-1]["content"].strip() if messages else "",
+        "conversation_history": json.dumps(messages),
+    }
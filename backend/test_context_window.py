@@ -0,0 +1,268 @@
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import context_window
+from context_window import (
+    MESSAGE_OVERHEAD,
+    SUMMARY_PREFIX,
+    ContextWindow,
+    TokenCounter,
+)
+
+
+class WordCounter(TokenCounter):
+    """One token per word, so that budgets are easy to reason about"""
+
+    def __init__(self):
+        self.encoding = None
+
+    def count(self, text):
+        return len(text.split())
+
+
+class ManualExecutor:
+    """Runs submitted refreshes only when asked to"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks:
+            fn(*args)
+
+
+def conversation(turns, words=10):
+    """Alternating user and assistant messages of ``words`` words each"""
+    return [
+        {
+            "role": "user" if number % 2 == 0 else "assistant",
+            "content": " ".join([f"m{number}"] * words),
+        }
+        for number in range(turns)
+    ]
+
+
+def tokens(messages):
+    return WordCounter().count_messages(messages)
+
+
+def summarize(previous_summary, messages):
+    covered = [message["content"].split()[0] for message in messages]
+    return " ".join(filter(None, [previous_summary, *covered]))
+
+
+def make_window(executor=None, **kwargs):
+    kwargs.setdefault("max_tokens", 100)
+    kwargs.setdefault("keep_messages", 4)
+    return ContextWindow(
+        kwargs.pop("summarize", summarize),
+        executor if executor is not None else ManualExecutor(),
+        counter=WordCounter(),
+        **kwargs,
+    )
+
+
+def test_estimate_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(context_window, "tiktoken", None)
+    counter = TokenCounter()
+    assert counter.encoding is None
+    assert counter.count("abcd") == 1
+    assert counter.count("abcde") == 2
+    assert counter.count_messages([{"role": "user", "content": "abcd"}, {}]) == (
+        1 + 2 * MESSAGE_OVERHEAD
+    )
+
+
+def test_tiktoken_encoding_for_an_unknown_model(monkeypatch):
+    encoding = types.SimpleNamespace(name="cl100k_base", encode=str.split)
+
+    def encoding_for_model(model):
+        raise KeyError(model)
+
+    fake = types.SimpleNamespace(
+        encoding_for_model=encoding_for_model, get_encoding=lambda name: encoding
+    )
+    monkeypatch.setattr(context_window, "tiktoken", fake)
+    counter = TokenCounter("some-new-model")
+    assert counter.encoding is encoding
+    assert counter.count("three word text") == 3
+
+
+def test_estimate_when_the_encoding_cannot_be_loaded(monkeypatch):
+    def fail(name):
+        raise OSError("no network")
+
+    fake = types.SimpleNamespace(encoding_for_model=fail, get_encoding=fail)
+    monkeypatch.setattr(context_window, "tiktoken", fake)
+    assert TokenCounter().encoding is None
+
+
+def test_short_history_is_unchanged():
+    window = make_window()
+    messages = conversation(4)
+    assert window.window("c", messages) is messages
+    assert window.executor.tasks == []
+
+
+def test_disabled_window_is_unchanged():
+    window = make_window(max_tokens=0)
+    messages = conversation(40)
+    assert window.window("c", messages) is messages
+
+
+def test_long_history_stays_under_budget_before_the_summary():
+    window = make_window()
+    messages = conversation(12)
+    result = window.window("c", messages)
+    assert tokens(result) <= 100
+    # The most recent messages are kept, in order
+    assert result == messages[-len(result) :]
+    assert len(window.executor.tasks) == 1
+    assert window.stats()["truncated_turns"] == 1
+
+
+def test_refresh_summarizes_all_but_the_kept_messages():
+    window = make_window()
+    messages = conversation(12)
+    window.window("c", messages)
+    window.executor.run()
+
+    saved = window.stats()["tokens_saved"]
+    result = window.window("c", messages)
+    assert result[0] == {
+        "role": "system",
+        "content": SUMMARY_PREFIX + " ".join(f"m{number}" for number in range(8)),
+    }
+    assert result[1:] == messages[8:]
+    assert tokens(result) <= 100
+    stats = window.stats()
+    assert stats["summary_refreshes"] == 1
+    assert stats["tokens_saved"] - saved == tokens(messages) - tokens(result)
+
+
+def test_summary_is_extended_incrementally():
+    calls = []
+
+    def recording_summarize(previous_summary, messages):
+        calls.append((previous_summary, len(messages)))
+        return summarize(previous_summary, messages)
+
+    window = make_window(summarize=recording_summarize)
+    messages = conversation(12)
+    window.window("c", messages)
+    window.executor.run()
+    messages = messages + conversation(20)[12:]
+    window.window("c", messages)
+    window.executor.run()
+    assert calls == [("", 8), ("m0 m1 m2 m3 m4 m5 m6 m7", 8)]
+
+
+def test_system_prompt_is_kept():
+    window = make_window()
+    system = {"role": "system", "content": "You are Curio."}
+    messages = [system] + conversation(12)
+    result = window.window("c", messages)
+    assert result[0] == system
+    assert result[-1] == messages[-1]
+    assert tokens(result) <= 100
+
+    window.executor.run()
+    result = window.window("c", messages)
+    assert result[0] == system
+    assert result[1]["content"].startswith(SUMMARY_PREFIX)
+    assert result[2:] == messages[-4:]
+
+
+def test_latest_message_is_kept_even_over_budget():
+    window = make_window(max_tokens=20)
+    messages = conversation(3, words=30)
+    assert window.window("c", messages) == messages[-1:]
+
+
+def test_long_kept_messages_are_trimmed_after_the_summary():
+    window = make_window(keep_messages=8)
+    messages = conversation(12, words=20)
+    window.window("c", messages)
+    window.executor.run()
+    result = window.window("c", messages)
+    assert tokens(result) <= 100
+    assert result[0]["content"].startswith(SUMMARY_PREFIX)
+    assert result[-1] == messages[-1]
+
+
+def test_one_refresh_at_a_time_per_conversation():
+    window = make_window()
+    messages = conversation(12)
+    window.window("c", messages)
+    window.window("c", messages + conversation(14)[12:])
+    assert len(window.executor.tasks) == 1
+
+
+def test_failed_refresh_is_counted_and_retried():
+    def failing(previous_summary, messages):
+        raise RuntimeError("timeout")
+
+    window = make_window(summarize=failing)
+    messages = conversation(12)
+    window.window("c", messages)
+    window.executor.run()
+    assert window.stats()["summary_errors"] == 1
+    window.window("c", messages)
+    assert len(window.executor.tasks) == 1
+
+
+def test_restarted_conversation_drops_the_summary():
+    window = make_window()
+    window.window("c", conversation(12))
+    window.executor.run()
+    messages = conversation(3)
+    assert window.window("c", messages) is messages
+
+
+def test_forget_drops_the_summary():
+    window = make_window()
+    messages = conversation(12)
+    window.window("c", messages)
+    window.executor.run()
+    window.forget("c")
+    assert not window.window("c", messages)[0]["content"].startswith(SUMMARY_PREFIX)
+
+
+def test_refresh_runs_in_the_background():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(previous_summary, messages):
+        started.set()
+        release.wait(2)
+        return summarize(previous_summary, messages)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        window = make_window(executor, summarize=slow)
+        messages = conversation(12)
+        # The turn does not wait for the summary
+        first = window.window("c", messages)
+        assert started.wait(2)
+        assert not first[0]["content"].startswith(SUMMARY_PREFIX)
+        release.set()
+
+    result = window.window("c", messages)
+    assert result[0]["content"].startswith(SUMMARY_PREFIX)
+
+
+@pytest.mark.parametrize("turns", range(1, 30))
+def test_window_never_exceeds_the_budget(turns):
+    window = make_window()
+    messages = conversation(turns)
+    for _ in range(2):
+        result = window.window("c", messages)
+        assert tokens(result) <= 100
+        assert result[-1] == messages[-1]
+        window.executor.run()
@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import deadlines
+from deadlines import Hedger, TurnDeadlines
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def samples(hedger, kind):
+    return hedger.stats()["kinds"].get(kind, {}).get("samples", 0)
+
+
+def test_delay_is_the_default_until_enough_samples(executor):
+    hedger = Hedger(executor, default_delay=1.5, min_samples=5)
+    for seconds in [0.1, 0.2, 0.3, 0.4]:
+        hedger._record("eval", seconds)
+    assert hedger.delay("eval") == 1.5
+    hedger._record("eval", 0.5)
+    assert hedger.delay("eval") == pytest.approx(0.5)
+    assert hedger.delay("other") == 1.5
+
+
+def test_fast_call_is_not_hedged(executor):
+    hedger = Hedger(executor, default_delay=1.0)
+    assert hedger.call("eval", lambda: "answer") == "answer"
+    wait_for(lambda: samples(hedger, "eval") == 1)
+    stats = hedger.stats()
+    assert (stats["calls"], stats["hedges"], stats["hedge_wins"]) == (1, 0, 0)
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins(executor):
+    hedger = Hedger(executor, default_delay=0.05)
+    release_first = threading.Event()
+    attempts = []
+
+    def fn():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            release_first.wait(2)
+            return "first"
+        return "hedge"
+
+    start = time.perf_counter()
+    assert hedger.call("eval", fn) == "hedge"
+    # The hedge was only sent once the delay had passed
+    assert time.perf_counter() - start >= 0.05
+    stats = hedger.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+    # The losing attempt is sampled too once it finishes
+    wait_for(lambda: samples(hedger, "eval") == 1)
+    release_first.set()
+    wait_for(lambda: samples(hedger, "eval") == 2)
+    latencies = sorted(hedger._latencies["eval"])
+    assert latencies[1] >= 0.05
+
+
+def test_primary_wins_when_it_answers_first_after_the_delay(executor):
+    hedger = Hedger(executor, default_delay=0.02)
+    hedge_started = threading.Event()
+    release_hedge = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(None)
+        if len(calls) == 1:
+            hedge_started.wait(2)
+            return "first"
+        hedge_started.set()
+        release_hedge.wait(2)
+        return "hedge"
+
+    assert hedger.call("eval", fn) == "first"
+    release_hedge.set()
+    stats = hedger.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 0)
+    wait_for(lambda: samples(hedger, "eval") == 2)
+
+
+def test_quick_failure_is_retried(executor):
+    hedger = Hedger(executor, default_delay=1.0)
+    calls = []
+
+    def fn():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("connection reset")
+        return "answer"
+
+    assert hedger.call("eval", fn) == "answer"
+    stats = hedger.stats()
+    assert (stats["retries"], stats["hedges"], stats["failures"]) == (1, 0, 0)
+    # Only the successful attempt is sampled
+    wait_for(lambda: samples(hedger, "eval") == 1)
+
+
+def test_error_is_raised_when_every_attempt_fails(executor):
+    hedger = Hedger(executor, default_delay=1.0)
+
+    def fn():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError, match="down"):
+        hedger.call("eval", fn)
+    assert hedger.stats()["failures"] == 1
+    assert samples(hedger, "eval") == 0
+
+
+def test_disabled_hedger_calls_once(executor):
+    hedger = Hedger(executor, enabled=False, default_delay=0.0)
+    assert hedger.call("eval", lambda: "answer") == "answer"
+    stats = hedger.stats()
+    assert (stats["hedges"], stats["kinds"]["eval"]["samples"]) == (0, 1)
+
+
+def test_required_calls_get_the_minimum_once_the_budget_is_spent():
+    turn_deadlines = TurnDeadlines(
+        budget_seconds=0.01, min_call_seconds=3.0, max_call_seconds=30.0
+    )
+    turn_deadlines.start()
+    try:
+        time.sleep(0.02)
+        assert not turn_deadlines.has_budget()
+        assert turn_deadlines.call_timeout() == 3.0
+        assert turn_deadlines.call_timeout(optional=True) == 0.0
+    finally:
+        deadlines.bind(None)
+
+
+def test_calls_without_a_deadline_get_the_cap():
+    turn_deadlines = TurnDeadlines(max_call_seconds=30.0)
+    assert turn_deadlines.has_budget()
+    assert turn_deadlines.call_timeout(optional=True) == 30.0
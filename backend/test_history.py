@@ -0,0 +1,82 @@
+import sys
+
+import pytest
+
+GREETING = {"role": "assistant", "content": "Hi detective! What do you notice?"}
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The app on a scratch SQLite database with the stub provider"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'curio.db'}")
+    for name in ["POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST", "POSTGRES_DB"]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("LLM_PROVIDER", "stub")
+    monkeypatch.setenv("STUB_LATENCY_SCALE", "0")
+    monkeypatch.setenv("TURN_TRACING", "false")
+    monkeypatch.setenv("LOCAL_CLASSIFIER_MODE", "off")
+    monkeypatch.setenv("STATE_STORE", "memory")
+    monkeypatch.setenv("WRITE_BEHIND", "false")
+    monkeypatch.setenv("AUDIO_BLOB_STORE", "local")
+    monkeypatch.setenv("AUDIO_BLOB_DIR", str(tmp_path / "audio"))
+    monkeypatch.setenv("TTS_CACHE_DIR", str(tmp_path / "tts"))
+    # Imported after the environment is set, and dropped afterwards so that
+    # other tests import their own configuration
+    sys.modules.pop("app", None)
+    import app
+    from models import Base
+
+    Base.metadata.create_all(app.engine)
+    yield app
+    app.engine.dispose()
+    sys.modules.pop("app", None)
+
+
+def chat(client, payload):
+    response = client.post(
+        "/api/chat",
+        json={"state": "greet", "image_path": "/imgs/balloon.jpg", **payload},
+    )
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_rebuilt_history_matches_the_cached_history(app_module):
+    client = app_module.app.test_client()
+    first = chat(
+        client,
+        {
+            "conversation_id": "c1",
+            "messages": [GREETING, {"role": "user", "content": "the hair moves"}],
+        },
+    )
+    # Delta protocol: the next turn only sends the new message
+    chat(
+        client,
+        {
+            "conversation_id": "c1",
+            "state": first["next_state"],
+            "message": "why does it move?",
+        },
+    )
+
+    cached = app_module.history_cache.get("c1")
+    assert cached[0] == GREETING
+    assert len(cached) == 5
+
+    app_module.history_cache.forget("c1")
+    assert app_module.history_cache.get("c1") == cached
+
+
+def test_rebuilt_state_ignores_the_stored_greeting(app_module):
+    client = app_module.app.test_client()
+    chat(
+        client,
+        {
+            "conversation_id": "c1",
+            "messages": [GREETING, {"role": "user", "content": "the hair moves"}],
+        },
+    )
+    cached = app_module.state_store.get("c1")
+    app_module.state_store.delete("c1")
+    assert app_module.state_store.get("c1") == cached
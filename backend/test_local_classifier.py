@@ -0,0 +1,218 @@
+import pytest
+
+from local_classifier import LocalClassifier, NaiveBayesModel, tokenize
+
+# The labelled examples given to the question-level evaluator in
+# prompts/eval.py
+BUNDLED_EXAMPLES = {
+    "factual": [
+        "What is static electricity?",
+        "What are electrons?",
+        "Are there different kinds of electric charges?",
+        "Is a negative charge made of electrons?",
+        "Can two objects attract without touching?",
+        "Are both children wearing fuzzy sweaters?",
+        "Is the spoon moving the pepper without touching it?",
+        "Is one child holding the spoon closer to the bowl than the other?",
+    ],
+    "irrelevant": ["Is is magnetic?", "Is it chemical?"],
+    "explanatory": [
+        "How does the balloon pull the hair without touching it?",
+        "Does the balloon make the hair move?",
+    ],
+    "general_causal": [
+        "What happens to hair if I rub the balloon on different clothes?",
+        "What happens if I rub the balloon for a longer time?",
+    ],
+    "specific_causal": [
+        "How far can I hold the balloon away and still make the hair move?",
+        (
+            "To what degree does the distance between the balloon and the hair "
+            "change the angle at which the hair stands?"
+        ),
+    ],
+}
+
+
+def bundled_examples():
+    return [
+        ("level", text, label)
+        for label, texts in BUNDLED_EXAMPLES.items()
+        for text in texts
+    ]
+
+
+@pytest.fixture
+def trained():
+    classifier = LocalClassifier(min_examples=len(bundled_examples()))
+    classifier.train(bundled_examples())
+    return classifier
+
+
+def test_tokenize_adds_bigrams():
+    assert tokenize("Why does it MOVE?") == [
+        "why",
+        "does",
+        "it",
+        "move",
+        "why does",
+        "does it",
+        "it move",
+    ]
+
+
+@pytest.mark.parametrize(
+    ("decision", "text", "label"),
+    [
+        ("state", "", "scaffolding"),
+        ("state", "I don't know", "scaffolding"),
+        ("level", "idk", "no_question"),
+        ("level", "Okay!", "no_question"),
+        ("level", "the hair is standing up", "no_question"),
+        ("level", "how far away can the balloon be?", "specific_causal"),
+        ("level", "what if I rub it longer?", "general_causal"),
+        ("level", "why does the hair move?", "explanatory"),
+    ],
+)
+def test_rules(decision, text, label):
+    prediction = LocalClassifier().predict(decision, text)
+    assert prediction.label == label
+    assert prediction.source == "rule"
+
+
+@pytest.mark.parametrize(
+    ("decision", "text"),
+    [("state", "the hair is standing up"), ("level", "what is static?")],
+)
+def test_no_rule_and_no_model_means_no_guess(decision, text):
+    assert LocalClassifier().predict(decision, text) is None
+
+
+def test_unknown_decision_has_no_guess():
+    assert LocalClassifier().predict("reflection", "I don't know") is None
+
+
+def test_model_is_not_trusted_below_min_examples():
+    classifier = LocalClassifier(min_examples=len(bundled_examples()) + 1)
+    classifier.train(bundled_examples())
+    assert classifier.predict("level", "What is static electricity?") is None
+
+
+@pytest.mark.parametrize(
+    ("text", "label"),
+    [(text, label) for label, texts in BUNDLED_EXAMPLES.items() for text in texts],
+)
+def test_bundled_examples_get_their_labels(trained, text, label):
+    assert trained.predict("level", text).label == label
+
+
+@pytest.mark.parametrize(
+    ("text", "label"),
+    [
+        ("What is static?", "factual"),
+        ("what are charges?", "factual"),
+        ("is it magnetic", "irrelevant"),
+        ("Does the balloon make the sweater move?", "explanatory"),
+    ],
+)
+def test_model_generalises_to_unseen_wording(trained, text, label):
+    prediction = trained.predict("level", text)
+    assert prediction.source == "model"
+    assert prediction.label == label
+
+
+def test_naive_bayes_confidence_is_a_probability():
+    model = NaiveBayesModel(["a", "b"])
+    assert model.predict("anything") is None
+    model.add("red apple", "a")
+    model.add("blue sky", "b")
+    model.add("green grass", "unknown label")
+    assert model.examples == 2
+    label, confidence = model.predict("red")
+    assert label == "a"
+    assert 0.5 < confidence < 1.0
+
+
+def answer(label, calls):
+    def ask_llm():
+        calls.append(label)
+        return label
+
+    return ask_llm
+
+
+def fail(calls):
+    def ask_llm():
+        calls.append("failed")
+        raise ConnectionError("timeout")
+
+    return ask_llm
+
+
+def test_off_mode_always_asks_the_llm():
+    classifier = LocalClassifier(mode="off")
+    calls = []
+    assert classifier.classify("state", "", answer("discover", calls)) == "discover"
+    assert calls == ["discover"]
+    assert classifier.stats()["decisions"]["state"]["rule"]["compared_with_llm"] == 0
+
+
+def test_shadow_mode_asks_the_llm_and_scores_the_local_guess():
+    classifier = LocalClassifier(mode="shadow")
+    calls = []
+    assert (
+        classifier.classify("state", "", answer("scaffolding", calls)) == "scaffolding"
+    )
+    assert classifier.classify("state", "idk", answer("discover", calls)) == "discover"
+    assert calls == ["scaffolding", "discover"]
+    rule = classifier.stats()["decisions"]["state"]["rule"]
+    assert rule["compared_with_llm"] == 2
+    assert rule["agreement_rate"] == 0.5
+    assert rule["local_hits"] == 0
+
+
+def test_on_mode_skips_the_llm_when_confident(trained):
+    trained.mode = "on"
+    calls = []
+    label = trained.classify("level", "I don't know", answer("factual", calls))
+    assert label == "no_question"
+    assert calls == []
+    assert trained.stats()["decisions"]["level"]["rule"]["local_hits"] == 1
+
+
+def test_on_mode_falls_back_below_the_threshold(trained):
+    trained.mode = "on"
+    trained.threshold = 0.99
+    calls = []
+    # The explanatory rule's confidence is 0.8
+    label = trained.classify("level", "why does it move?", answer("irrelevant", calls))
+    assert label == "irrelevant"
+    assert calls == ["irrelevant"]
+    stats = trained.stats()["decisions"]["level"]
+    assert stats["llm_fallbacks"] == 1
+    assert stats["rule"]["compared_with_llm"] == 1
+
+
+def test_local_guess_is_used_when_the_llm_fails():
+    classifier = LocalClassifier(mode="shadow")
+    calls = []
+    label = classifier.classify(
+        "level", "what if I rub it?", fail(calls), llm_errors=(ConnectionError,)
+    )
+    assert label == "general_causal"
+    assert calls == ["failed"]
+
+
+def test_llm_failure_is_raised_without_a_local_guess():
+    classifier = LocalClassifier(mode="shadow")
+    with pytest.raises(ConnectionError):
+        classifier.classify(
+            "level", "what is static?", fail([]), llm_errors=(ConnectionError,)
+        )
+
+
+def test_decisions_without_a_model_go_to_the_llm():
+    classifier = LocalClassifier(mode="on")
+    calls = []
+    assert classifier.classify(None, "", answer("reflection", calls)) == "reflection"
+    assert calls == ["reflection"]
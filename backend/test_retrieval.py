@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+from retrieval import BM25Index, analyze, build_knowledge_indexes, stem
+
+KG_PATH = os.path.join(os.path.dirname(__file__), "knowledge", "kg.json")
+HAIR = "Hair stands up near a balloon"
+DEFAULT_MIN_SCORE = 0.6
+
+
+@pytest.fixture(scope="module")
+def indexes():
+    with open(KG_PATH) as kg_file:
+        return build_knowledge_indexes(json.load(kg_file))
+
+
+@pytest.mark.parametrize(
+    "words",
+    [
+        ["charge", "charges", "charged", "charging"],
+        ["move", "moves", "moved", "moving"],
+        ["rub", "rubs", "rubbed", "rubbing"],
+        ["fall", "falls", "falling"],
+        ["glass", "glasses"],
+        ["electron", "electrons"],
+    ],
+)
+def test_inflections_share_a_stem(words):
+    assert len({stem(word) for word in words}) == 1
+
+
+def test_analyze_drops_stopwords_and_punctuation():
+    assert analyze("Why does the balloon STICK?") == ["balloon", "stick"]
+
+
+def test_ranking_prefers_the_document_with_more_matching_terms():
+    index = BM25Index(
+        [
+            ("rubbing", "rub the balloon on hair"),
+            ("charges", "electric charges attract"),
+            ("light", "light bends in water"),
+        ]
+    )
+    results = index.search("why do charges attract", k=3)
+    assert [name for name, _ in results] == ["charges"]
+    assert results[0][1] == pytest.approx(1.0)
+
+    results = index.search("rub it so charges attract", k=3)
+    assert [name for name, _ in results] == ["charges", "rubbing"]
+    assert results[0][1] > results[1][1]
+
+
+def test_scores_are_a_share_of_the_query():
+    index = BM25Index([("a", "balloon hair"), ("b", "water light")])
+    ((name, score),) = index.search("balloon pizza")
+    assert name == "a"
+    # "pizza" is in no document, so the best match explains half the query
+    assert score == pytest.approx(0.5)
+
+
+def test_min_score_cuts_off_weak_matches():
+    index = BM25Index([("a", "balloon hair"), ("b", "water light")])
+    assert index.search("balloon pizza", min_score=0.4) == [("a", pytest.approx(0.5))]
+    assert index.search("balloon pizza", min_score=0.6) == []
+
+
+@pytest.mark.parametrize("query", ["", "   ", "why does the", "?!"])
+def test_empty_query_returns_nothing(query):
+    index = BM25Index([("a", "balloon hair")])
+    assert index.search(query) == []
+
+
+def test_empty_index_returns_nothing():
+    assert BM25Index([]).search("balloon") == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["what are charges?", "what are electrons", "why does the hair move?"],
+)
+def test_knowledge_graph_questions_retrieve_concepts(indexes, query):
+    results = indexes[HAIR].search(query, k=2, min_score=DEFAULT_MIN_SCORE)
+    assert len(results) == 2
+    assert all(score > DEFAULT_MIN_SCORE for _, score in results)
+
+
+@pytest.mark.parametrize("query", ["hello", "i like pizza", "why does light bend"])
+def test_unrelated_questions_retrieve_nothing(indexes, query):
+    assert indexes[HAIR].search(query, k=2, min_score=DEFAULT_MIN_SCORE) == []
+
+
+def test_static_electricity_question_ranks_its_concepts_first(indexes):
+    results = indexes[HAIR].search(
+        "what is static electricity", k=2, min_score=DEFAULT_MIN_SCORE
+    )
+    assert {name for name, _ in results} == {
+        "static electricity",
+        "testing the effect of static electricity",
+    }
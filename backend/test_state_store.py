@@ -0,0 +1,210 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import ConversationStateRecord
+from state_store import (
+    ConversationState,
+    DatabaseStateStore,
+    InProcessStateStore,
+    rebuild_state,
+)
+
+
+def turn(input_state, label, next_state):
+    """Message rows of one stored turn, as the loader returns them"""
+    return [("user", input_state, label), ("assistant", next_state, None)]
+
+
+def test_rebuild_empty_conversation():
+    state = rebuild_state([])
+    assert state.state_history == []
+    assert state.scienceqa_history == []
+
+
+def test_rebuild_follows_the_state_machine():
+    rows = (
+        turn("greet", "scaffolding", "scaffolding")
+        + turn("scaffolding", "discover", "discover")
+        + turn("discover", "factual", "scienceqa")
+        + turn("scienceqa", "explanatory", "scienceqa")
+        + turn("scienceqa", "irrelevant", "scienceqa")
+    )
+    state = rebuild_state(rows)
+    assert state.state_history == ["scaffolding", "discover", "scienceqa"]
+    assert state.scienceqa_history == ["factual", "explanatory", "irrelevant"]
+
+
+def test_rebuild_ignores_labels_that_are_not_question_levels():
+    rows = turn("scaffolding", "discover", "scienceqa") + turn(
+        "scienceqa", "not a label", "scienceqa"
+    )
+    assert rebuild_state(rows).scienceqa_history == []
+
+
+def test_rebuild_records_reflection_after_scienceqa():
+    rows = turn("discover", "general_causal", "scienceqa") + turn(
+        "scienceqa", None, "reflection"
+    )
+    state = rebuild_state(rows)
+    assert state.state_history == ["scienceqa", "reflection"]
+    assert state.scienceqa_history == ["general_causal"]
+
+
+def test_rebuild_resets_after_close():
+    rows = (
+        turn("discover", "factual", "scienceqa")
+        + turn("reflection", None, "close")
+        + turn("greet", "scaffolding", "scaffolding")
+    )
+    state = rebuild_state(rows)
+    assert state.state_history == ["scaffolding"]
+    assert state.scienceqa_history == []
+
+
+def test_rebuild_handles_an_assistant_message_without_a_user_turn():
+    # The greeting is stored without a user message before it
+    rows = [("assistant", "greet", None)] + turn("greet", "scaffolding", "scaffolding")
+    assert rebuild_state(rows).state_history == ["greet", "scaffolding"]
+
+
+def test_rebuild_skips_the_stored_client_greeting():
+    rows = [("assistant", None, None)] + turn("greet", "scaffolding", "scaffolding")
+    assert rebuild_state(rows).state_history == ["scaffolding"]
+
+
+def test_state_round_trips_through_json():
+    state = ConversationState(["scienceqa"], ["factual"])
+    assert ConversationState.from_json(state.to_json()) == state
+
+
+def test_in_process_store_rebuilds_on_a_miss():
+    loaded = []
+
+    def loader(conversation_id):
+        loaded.append(conversation_id)
+        return turn("discover", "factual", "scienceqa")
+
+    store = InProcessStateStore(loader=loader)
+    assert store.get("c").scienceqa_history == ["factual"]
+    store.save("c", ConversationState(["scienceqa"], ["factual", "explanatory"]))
+    assert store.get("c").scienceqa_history == ["factual", "explanatory"]
+    store.delete("c")
+    assert store.get("c").scienceqa_history == ["factual"]
+    assert loaded == ["c", "c"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2026, 10, 18, 12, 0, 0)
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    ConversationStateRecord.__table__.create(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def rows(session_factory):
+    with session_factory() as db:
+        return sorted(record.key for record in db.query(ConversationStateRecord))
+
+
+def make_store(session_factory, clock, **kwargs):
+    kwargs.setdefault("ttl_seconds", 3600)
+    kwargs.setdefault("cleanup_seconds", 300)
+    return DatabaseStateStore(
+        session_factory,
+        loader=lambda conversation_id: turn("discover", "factual", "scienceqa"),
+        clock=clock,
+        **kwargs,
+    )
+
+
+def test_database_store_saves_and_deletes(session_factory, clock):
+    store = make_store(session_factory, clock)
+    state = ConversationState(["scienceqa"], ["factual", "explanatory"])
+    store.save("c", state)
+    assert store.get("c") == state
+    # Another worker sees the same state
+    assert make_store(session_factory, clock).get("c") == state
+    store.delete("c")
+    assert store.get("c").scienceqa_history == ["factual"]
+    assert rows(session_factory) == []
+
+
+def test_idle_rows_count_as_missing(session_factory, clock):
+    store = make_store(session_factory, clock)
+    store.save("c", ConversationState(["scienceqa"], ["explanatory"]))
+    clock.now += timedelta(seconds=3600)
+    assert store.get("c").scienceqa_history == ["explanatory"]
+    clock.now += timedelta(seconds=1)
+    # Rebuilt from the messages instead
+    assert store.get("c").scienceqa_history == ["factual"]
+
+
+def test_saving_unchanged_state_renews_the_row(session_factory, clock):
+    store = make_store(session_factory, clock)
+    state = ConversationState(["scienceqa"], ["explanatory"])
+    store.save("c", state)
+    clock.now += timedelta(seconds=3000)
+    store.save("c", state)
+    clock.now += timedelta(seconds=3000)
+    assert store.get("c") == state
+
+
+def test_save_deletes_idle_rows_periodically(session_factory, clock):
+    store = make_store(session_factory, clock)
+    # Each save runs a cleanup if the last one is 300 seconds old
+    store.save("old", ConversationState())
+    clock.now += timedelta(seconds=3400)
+    store.save("recent", ConversationState())
+    clock.now += timedelta(seconds=250)
+    # "old" is idle for longer than the ttl, but no cleanup is due
+    store.save("other", ConversationState())
+    assert rows(session_factory) == ["old", "other", "recent"]
+
+    clock.now += timedelta(seconds=50)
+    store.save("other", ConversationState())
+    assert rows(session_factory) == ["other", "recent"]
+    stats = store.stats()
+    assert (stats["cleanups"], stats["expirations"]) == (3, 1)
+
+
+def test_zero_ttl_keeps_rows(session_factory, clock):
+    store = make_store(session_factory, clock, ttl_seconds=0)
+    state = ConversationState(["discover"], [])
+    store.save("c", state)
+    clock.now += timedelta(days=365)
+    store.save("d", state)
+    assert store.get("c") == state
+    assert rows(session_factory) == ["c", "d"]
+    assert store.stats()["cleanups"] == 0
+
+
+def test_failed_cleanup_does_not_fail_the_save(session_factory, clock, monkeypatch):
+    store = make_store(session_factory, clock)
+
+    def fail():
+        raise RuntimeError("lock timeout")
+
+    monkeypatch.setattr(store, "cleanup", fail)
+    store.save("c", ConversationState(["discover"], []))
+    assert rows(session_factory) == ["c"]
@@ -0,0 +1,131 @@
+import threading
+
+from ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(**kwargs):
+    clock = FakeClock()
+    return TTLCache(clock=clock, **kwargs), clock
+
+
+def test_get_returns_what_was_set():
+    cache, _ = make_cache()
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b", "missing") == "missing"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_entries_expire_after_the_idle_ttl():
+    cache, clock = make_cache(ttl_seconds=10)
+    cache.set("a", 1)
+    clock.now += 10
+    assert cache.get("a") == 1
+    clock.now += 10.5
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_access_renews_the_ttl():
+    cache, clock = make_cache(ttl_seconds=10)
+    cache.set("a", 1)
+    for _ in range(5):
+        clock.now += 8
+        assert cache.get("a") == 1
+
+
+def test_set_and_stats_drop_expired_entries():
+    cache, clock = make_cache(ttl_seconds=10)
+    cache.set("old", 1)
+    clock.now += 5
+    cache.set("newer", 2)
+    clock.now += 6
+    cache.set("newest", 3)
+    assert len(cache) == 2
+    clock.now += 5
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["expirations"] == 2
+
+
+def test_zero_ttl_never_expires():
+    cache, clock = make_cache(ttl_seconds=0)
+    cache.set("a", 1)
+    clock.now += 10**9
+    assert cache.get("a") == 1
+
+
+def test_pop_removes_and_ignores_expired_values():
+    cache, clock = make_cache(ttl_seconds=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    clock.now += 11
+    assert cache.pop("b") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted_at_capacity():
+    cache, clock = make_cache(max_entries=3)
+    for key in "abc":
+        cache.set(key, key)
+        clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == "a"
+    cache.set("d", "d")
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["a", "c", "d"]
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 3
+
+
+def test_overwriting_a_key_does_not_evict():
+    cache, _ = make_cache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 3)
+    assert cache.get("a") == 3
+    assert cache.get("b") == 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_concurrent_get_and_set():
+    cache = TTLCache(max_entries=50, ttl_seconds=3600)
+    errors = []
+    threads_count = 8
+    operations = 2000
+
+    def work(worker):
+        try:
+            for number in range(operations):
+                key = (worker * 7 + number) % 80
+                cache.set(key, (key, number))
+                value = cache.get((key + 1) % 80)
+                if value is not None:
+                    assert value[0] == (key + 1) % 80
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=work, args=(worker,)) for worker in range(threads_count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    stats = cache.stats()
+    assert stats["size"] <= 50
+    assert stats["hits"] + stats["misses"] == threads_count * operations
+    assert stats["evictions"] > 0
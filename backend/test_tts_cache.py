@@ -0,0 +1,160 @@
+import os
+import random
+import threading
+
+import pytest
+
+from tts_cache import TTSCache
+
+
+def clip(key, size=100):
+    return key.encode()[:1] * size
+
+
+def make_key(text):
+    return TTSCache.key("tts-1", "alloy", "mp3", text)
+
+
+def read(cache, key):
+    audio_file = cache.open(key)
+    if audio_file is None:
+        return None
+    with audio_file:
+        return audio_file.read()
+
+
+def clips_on_disk(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".mp3"))
+
+
+def test_key_is_a_stable_strong_etag():
+    key = make_key("Hello!")
+    assert key == make_key("Hello!")
+    assert TTSCache.is_valid_key(key)
+    others = {
+        make_key("Hello"),
+        TTSCache.key("tts-1", "nova", "mp3", "Hello!"),
+        TTSCache.key("tts-1-hd", "alloy", "mp3", "Hello!"),
+        TTSCache.key("tts-1", "alloy", "opus", "Hello!"),
+    }
+    assert len(others) == 4
+    assert key not in others
+
+
+@pytest.mark.parametrize(
+    "key", ["", "../etc/passwd", "A" * 64, make_key("x")[:63], make_key("x") + "0"]
+)
+def test_invalid_keys_are_rejected(key):
+    assert not TTSCache.is_valid_key(key)
+
+
+def test_put_then_open(tmp_path):
+    cache = TTSCache(str(tmp_path))
+    key = make_key("hello")
+    assert read(cache, key) is None
+    cache.put(key, b"mp3 bytes")
+    assert read(cache, key) == b"mp3 bytes"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=300)
+    keys = [make_key(str(number)) for number in range(3)]
+    for key in keys:
+        cache.put(key, clip(key))
+    # Reading the oldest clip makes the second one the least recently used
+    assert read(cache, keys[0]) is not None
+    new_key = make_key("new")
+    cache.put(new_key, clip(new_key))
+    assert read(cache, keys[1]) is None
+    assert all(read(cache, key) is not None for key in [keys[0], keys[2], new_key])
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 300
+    assert len(clips_on_disk(tmp_path)) == 3
+
+
+def test_clip_larger_than_the_cache_is_not_stored(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=10)
+    assert cache.put(make_key("long"), b"x" * 11) is None
+    assert clips_on_disk(tmp_path) == []
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = TTSCache(str(tmp_path / "cache"), max_bytes=0)
+    assert cache.put(make_key("a"), b"a") is None
+    assert cache.open(make_key("a")) is None
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_restart_keeps_clips_in_recency_order(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=300)
+    keys = [make_key(str(number)) for number in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, clip(key))
+        # mtimes written within one clock tick would tie
+        os.utime(cache.path(key), (1000 + age, 1000 + age))
+    restarted = TTSCache(str(tmp_path), max_bytes=200)
+    assert restarted.stats()["bytes"] == 200
+    assert read(restarted, keys[0]) is None
+    assert read(restarted, keys[2]) == clip(keys[2])
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = TTSCache(str(tmp_path))
+
+    def fail(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        cache.put(make_key("a"), b"audio")
+    assert os.listdir(tmp_path) == []
+    assert cache.stats()["entries"] == 0
+
+
+def test_workers_sharing_a_directory_stay_under_the_bound(tmp_path):
+    first = TTSCache(str(tmp_path), max_bytes=500, rescan_seconds=0)
+    second = TTSCache(str(tmp_path), max_bytes=500, rescan_seconds=0)
+    for number in range(10):
+        key = make_key(str(number))
+        (first if number % 2 else second).put(key, clip(key))
+    sizes = [os.path.getsize(tmp_path / name) for name in clips_on_disk(tmp_path)]
+    assert sum(sizes) <= 500
+    # A clip stored by one worker is served by the other
+    key = make_key("9")
+    assert read(second, key) == clip(key)
+
+
+def test_concurrent_open_and_put(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=2000)
+    keys = [make_key(str(number)) for number in range(40)]
+    errors = []
+
+    def work(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(300):
+                key = rng.choice(keys)
+                data = read(cache, key)
+                if data is None:
+                    cache.put(key, clip(key, 100 + keys.index(key)))
+                else:
+                    # A clip is read whole or not at all
+                    assert data == clip(key, 100 + keys.index(key))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    stats = cache.stats()
+    on_disk = clips_on_disk(tmp_path)
+    assert stats["bytes"] <= 2000
+    assert stats["entries"] == len(on_disk)
+    assert stats["bytes"] == sum(os.path.getsize(tmp_path / name) for name in on_disk)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
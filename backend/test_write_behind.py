@@ -0,0 +1,178 @@
+import json
+import threading
+from datetime import datetime
+
+import pytest
+
+from write_behind import WriteBehindWriter
+
+
+class FakeSession:
+    """Keeps the records of a transaction until it is committed"""
+
+    def __init__(self, committed):
+        self.committed = committed
+        self.pending = []
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+def make_writer(store, committed, **kwargs):
+    kwargs.setdefault("retry_seconds", 0.001)
+    return WriteBehindWriter(lambda: FakeSession(committed), store, **kwargs)
+
+
+def add(db, record):
+    db.pending.append(record)
+
+
+def turn(number):
+    return {"turn_id": f"turn-{number}", "conversation_id": "conversation"}
+
+
+def test_batches_are_written_in_order():
+    committed = []
+    writer = make_writer(add, committed)
+    for number in range(10):
+        assert writer.submit(turn(number))
+    writer.close()
+    assert committed == [turn(number) for number in range(10)]
+    stats = writer.stats()
+    assert stats["written"] == 10
+    assert stats["failed"] == 0
+
+
+def test_failed_batch_is_retried():
+    committed = []
+    failures = {"left": 2}
+
+    def flaky(db, record):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise RuntimeError("database restarting")
+        add(db, record)
+
+    writer = make_writer(flaky, committed)
+    writer.submit(turn(0))
+    writer.close()
+    assert committed == [turn(0)]
+    assert writer.stats()["retried"] == 2
+    assert writer.stats()["failed"] == 0
+
+
+def test_bad_record_only_fails_itself(tmp_path, caplog):
+    committed = []
+    dead_letters = tmp_path / "dead_letters.jsonl"
+
+    def store(db, record):
+        if record["turn_id"] == "turn-3":
+            raise ValueError("bad record")
+        add(db, record)
+
+    writer = make_writer(store, committed, retries=1, dead_letter_path=dead_letters)
+    for number in range(5):
+        writer.submit(turn(number))
+    writer.close()
+
+    assert sorted(record["turn_id"] for record in committed) == [
+        "turn-0",
+        "turn-1",
+        "turn-2",
+        "turn-4",
+    ]
+    assert writer.stats()["failed"] == 1
+    assert "turn-3" in caplog.text
+    (line,) = dead_letters.read_text().splitlines()
+    entry = json.loads(line)
+    assert entry["record"] == turn(3)
+    assert entry["error"] == "bad record"
+
+
+def test_dead_letter_file_serialises_datetimes(tmp_path):
+    dead_letters = tmp_path / "dead_letters.jsonl"
+
+    def fail(db, record):
+        raise RuntimeError("down")
+
+    writer = make_writer(fail, [], retries=0, dead_letter_path=dead_letters)
+    writer.submit({"turn_id": "turn-0", "stored_at": datetime(2026, 1, 2, 3, 4, 5)})
+    writer.close()
+    entry = json.loads(dead_letters.read_text())
+    assert entry["record"]["stored_at"] == "2026-01-02T03:04:05"
+
+
+def test_full_queue_falls_back_to_the_caller():
+    committed = []
+    release = threading.Event()
+
+    def slow(db, record):
+        release.wait()
+        add(db, record)
+
+    writer = make_writer(slow, committed, max_queue=1, batch_size=1, block_seconds=0.01)
+    assert writer.submit(turn(0))
+    # The writer holds turn 0; turn 1 fills the queue
+    accepted = [writer.submit(turn(number)) for number in range(1, 4)]
+    assert accepted.count(False) >= 2
+    assert writer.stats()["sync_fallbacks"] == accepted.count(False)
+    release.set()
+    writer.close()
+    assert len(committed) == 1 + accepted.count(True)
+
+
+def test_close_drains_the_queue():
+    committed = []
+    release = threading.Event()
+
+    def slow(db, record):
+        release.wait()
+        add(db, record)
+
+    writer = make_writer(slow, committed, batch_size=2)
+    for number in range(20):
+        assert writer.submit(turn(number))
+    # close() is waiting on the writer while it is still blocked
+    threading.Timer(0.05, release.set).start()
+    writer.close()
+    assert committed == [turn(number) for number in range(20)]
+    assert writer.stats()["queue_depth"] == 0
+
+
+def test_submit_after_close_is_refused():
+    committed = []
+    writer = make_writer(add, committed)
+    writer.close()
+    assert not writer.submit(turn(0))
+    assert committed == []
+
+
+@pytest.mark.parametrize("trial", range(20))
+def test_every_accepted_record_is_written_when_closing_concurrently(trial):
+    committed = []
+    writer = make_writer(add, committed, max_queue=4, block_seconds=0.01)
+    accepted = []
+
+    def produce(producer):
+        for number in range(20):
+            record = {"turn_id": f"{producer}-{number}"}
+            if writer.submit(record):
+                accepted.append(record["turn_id"])
+
+    producers = [threading.Thread(target=produce, args=(p,)) for p in range(4)]
+    for producer in producers:
+        producer.start()
+    writer.close()
+    for producer in producers:
+        producer.join()
+    assert sorted(record["turn_id"] for record in committed) == sorted(accepted)
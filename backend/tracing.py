@@ -0,0 +1,174 @@
+"""End-to-end tracing of a spoken turn across requests.
+
+A spoken turn is several requests (``/api/transcribe``, ``/api/chat``,
+``/api/speech``, or one ``/api/turn``). The server issues a turn id on the
+first of them and the client echoes it in the ``X-Turn-Id`` header on the
+rest. Each request records a ``TurnTrace``: a root span for the request plus
+one span per stage, and each OpenAI request's time to first byte is attached
+to the span it was made in through httpx event hooks.
+
+The active trace and span live in context variables. ``ContextExecutor``
+copies the submitting thread's context into worker threads so that stages
+run on the turn executor are attributed to the right turn.
+"""
+
+import contextvars
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+TURN_ID_HEADER = "X-Turn-Id"
+
+_current_trace = contextvars.ContextVar("curio_trace", default=None)
+_current_span = contextvars.ContextVar("curio_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    started_at: datetime
+    start: float
+    attributes: dict = field(default_factory=dict)
+    duration_ms: float = None
+    ttfb_ms: float = None
+
+
+class TurnTrace:
+    """Spans recorded while serving one request of a turn"""
+
+    def __init__(self, endpoint, turn_id=None):
+        self.endpoint = endpoint
+        self.client_turn_id = bool(turn_id)
+        self.turn_id = turn_id or uuid.uuid4().hex
+        self.conversation_id = None
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = self.start_span(f"request {endpoint}")
+
+    def start_span(self, name, **attributes):
+        span = Span(
+            name=name,
+            started_at=datetime.now(timezone.utc),
+            start=time.perf_counter(),
+            attributes=attributes,
+        )
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self):
+        end_span(self.root)
+        with self._lock:
+            return list(self.spans)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_turn_id():
+    trace = current_trace()
+    return trace.turn_id if trace else None
+
+
+def bind(trace):
+    """Make ``trace`` current until ``bind(None)`` (for request hooks)"""
+    _current_trace.set(trace)
+
+
+@contextmanager
+def activate(trace):
+    """Make ``trace`` the current trace for the duration of the block"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def start_span(name, **attributes):
+    """Start a span on the current trace without making it current"""
+    trace = current_trace()
+    return trace.start_span(name, **attributes) if trace else None
+
+
+def end_span(span):
+    if span is not None and span.duration_ms is None:
+        span.duration_ms = (time.perf_counter() - span.start) * 1000
+
+
+@contextmanager
+def use_span(span):
+    """Attribute OpenAI requests made in the block to ``span``"""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record the block as a span of the current trace (no-op without one)"""
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    try:
+        with use_span(current):
+            yield current
+    finally:
+        end_span(current)
+
+
+def set_conversation(conversation_id):
+    trace = current_trace()
+    if trace:
+        trace.conversation_id = conversation_id
+
+
+def _on_request(request):
+    request.extensions["curio_sent_at"] = time.perf_counter()
+
+
+def _on_response(response):
+    current = _current_span.get()
+    sent_at = response.request.extensions.get("curio_sent_at")
+    if current is None or sent_at is None:
+        return
+    # A retried call keeps the first response to arrive
+    if current.ttfb_ms is None:
+        current.ttfb_ms = (time.perf_counter() - sent_at) * 1000
+        current.attributes["openai_path"] = response.request.url.path
+
+
+def httpx_event_hooks():
+    """Event hooks that record time to first byte on the current span"""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+class ContextExecutor:
+    """Executor wrapper that runs each task in a copy of the submitter's context"""
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def submit(self, fn, *args, **kwargs):
+        context = contextvars.copy_context()
+        return self.executor.submit(context.run, fn, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values`` (``None`` when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
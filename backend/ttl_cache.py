@@ -0,0 +1,96 @@
+"""Bounded in-memory mapping with idle TTL and LRU eviction.
+
+Per-conversation state is only removed explicitly when a conversation
+reaches ``close``; abandoned sessions would otherwise stay in memory for the
+life of the worker. ``TTLCache`` drops entries that have not been touched
+for ``ttl_seconds`` and evicts the least recently used entry once
+``max_entries`` is reached, and counts hits, misses and evictions.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after an idle period"""
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (value, last access time), least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, last_access = entry
+            if self.ttl_seconds > 0 and now - last_access > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        now = self._clock()
+        with self._lock:
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            self._expire(now)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        value, last_access = entry
+        if self.ttl_seconds > 0 and now - last_access > self.ttl_seconds:
+            return default
+        return value
+
+    def _expire(self, now):
+        # Entries are ordered by last access, so expired ones are at the front
+        if self.ttl_seconds <= 0:
+            return
+        while self._entries:
+            _, (_, last_access) = next(iter(self._entries.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._entries.popitem(last=False)
+            self.expirations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            self._expire(self._clock())
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,173 @@
+"""Content-addressed on-disk cache for synthesized speech.
+
+Fixed phrases, retries and replays make the same text get synthesized over
+and over. Each clip is stored under the SHA-256 of
+``(model, voice, format, text)``, so a hit can be served straight from disk
+and the key doubles as a strong ETag. The cache is bounded by total size and
+evicts the least recently used clips first.
+
+Workers may share the directory. A clip's mtime is its last use, so the
+index is rebuilt from the directory when a clip is stored and the last scan
+is more than ``rescan_seconds`` old, and the size bound covers every
+worker's clips. Between scans the directory can exceed the bound by what
+the other workers stored since the last scan.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTSCache:
+    """Size-bounded LRU cache of audio files keyed by content hash"""
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=512 * 1024 * 1024,
+        extension="mp3",
+        rescan_seconds=60.0,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.rescan_seconds = rescan_seconds
+        self._scanned_at = None
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rescans = 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(model, voice, audio_format, text):
+        payload = f"{model}\x1f{voice}\x1f{audio_format}\x1f{text}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_valid_key(key):
+        return len(key) == 64 and all(char in "0123456789abcdef" for char in key)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.{self.extension}")
+
+    def _scan(self):
+        """Rebuild the index from the clips in the directory and evict.
+
+        The directory is listed outside the lock; clips are ordered by
+        mtime, oldest access first, across every worker using it.
+        """
+        suffix = f".{self.extension}"
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another worker while listing
+                    continue
+                found.append((stat.st_mtime, entry.name[: -len(suffix)], stat.st_size))
+        entries = OrderedDict((key, size) for _, key, size in sorted(found))
+        with self._lock:
+            self._entries = entries
+            self._total_bytes = sum(entries.values())
+            self._scanned_at = time.monotonic()
+            self.rescans += 1
+            self._evict()
+
+    def open(self, key):
+        """Return the clip opened for reading on a hit, or ``None`` on a miss.
+
+        The clip is opened under the lock, so it cannot be evicted between
+        the lookup and the read; the open file stays readable even if the
+        clip is evicted afterwards. A clip stored by another worker sharing
+        the directory is a hit; one removed by another worker is a miss.
+        """
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        with self._lock:
+            try:
+                audio_file = open(path, "rb")
+            except FileNotFoundError:
+                self._total_bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+                return None
+            if key not in self._entries:
+                size = os.fstat(audio_file.fileno()).st_size
+                self._entries[key] = size
+                self._total_bytes += size
+            self._entries.move_to_end(key)
+            self.hits += 1
+            try:
+                # Persist recency so the LRU order survives a restart
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return audio_file
+
+    def put(self, key, data):
+        """Store ``data`` under ``key`` and return its path, or ``None`` if not cached"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return None
+        path = self.path(key)
+        if time.monotonic() - self._scanned_at >= self.rescan_seconds:
+            # Pick up the other workers' clips before enforcing the bound
+            self._scan()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            # Renamed under the lock, so that an eviction of the same key
+            # cannot remove the new clip before it is indexed
+            with self._lock:
+                os.replace(tmp_path, path)
+                self._total_bytes += len(data) - self._entries.pop(key, 0)
+                self._entries[key] = len(data)
+                self._evict()
+        except BaseException:
+            # Do not leave a partial file behind (disk full, interrupted)
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "rescans": self.rescans,
+            }
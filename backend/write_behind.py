@@ -0,0 +1,230 @@
+"""Write-behind persistence of finished turns.
+
+In write-behind mode a turn's conversation update and messages are not
+committed before the response is sent. They are queued as a plain record
+and a background writer stores them in batches, one transaction per batch,
+so the child does not wait on database I/O. The recorded audio is written
+to the blob store before the record is queued, so a record holds only the
+blob key and the queue's memory is bounded by ``max_queue`` small records.
+
+The queue is bounded. When it is full, ``submit`` waits up to
+``block_seconds`` for room (backpressure on the request threads) and then
+returns ``False`` so that the caller stores the turn itself; records are
+never dropped for lack of room. ``close`` drains the queue and is registered
+with ``atexit``, so a normal exit writes every queued turn; a crash loses at
+most the queued ones. SIGTERM only counts as a normal exit if the process
+handles it: ``app.py`` exits on it when run directly and uvicorn shuts down
+cleanly on it.
+
+A record that cannot be written even on its own is logged with its turn id
+and appended as a JSON line to ``dead_letter_path``, so it can be inspected
+and stored again by hand.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class WriteBehindWriter:
+    """Bounded queue of records flushed in batches by a background thread.
+
+    ``store(db, record)`` adds one record to a session without committing.
+    A batch that fails is retried up to ``retries`` times, waiting
+    ``retry_seconds`` and then twice as long after each attempt, which rides
+    out a database restart or failover. If it still fails it is written
+    record by record, so one bad record only fails itself; records that fail
+    on their own go to the dead-letter file.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        store,
+        max_queue=1000,
+        batch_size=50,
+        block_seconds=1.0,
+        flush_seconds=None,
+        retries=3,
+        retry_seconds=0.5,
+        dead_letter_path=None,
+    ):
+        self.session_factory = session_factory
+        self.store = store
+        self.batch_size = batch_size
+        self.block_seconds = block_seconds
+        self.retries = retries
+        self.retry_seconds = retry_seconds
+        self.dead_letter_path = dead_letter_path
+        # Optional histogram observed with each batch's flush duration
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.retried = 0
+        self.sync_fallbacks = 0
+        self.max_depth = 0
+        self.last_flush_ms = None
+        self._thread = threading.Thread(
+            target=self._run, name="curio-write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record):
+        """Queue ``record``; ``False`` means the caller must store it itself"""
+        deadline = time.monotonic() + self.block_seconds
+        while True:
+            # Checked and queued under the lock, so that no record can land
+            # behind the stop marker put by close()
+            with self._lock:
+                if self._closed:
+                    return False
+                try:
+                    self._queue.put_nowait(record)
+                except queue.Full:
+                    pass
+                else:
+                    self.queued += 1
+                    self.max_depth = max(self.max_depth, self._queue.qsize())
+                    return True
+            # Wait for room outside the lock, which the writer needs too
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(0.01, remaining))
+        with self._lock:
+            self.sync_fallbacks += 1
+        print("Write-behind queue full, storing the turn synchronously")
+        return False
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        error = self._write(batch)
+        delay = self.retry_seconds
+        for _ in range(self.retries):
+            if error is None:
+                break
+            time.sleep(delay)
+            delay *= 2
+            with self._lock:
+                self.retried += 1
+            error = self._write(batch)
+        if error is not None:
+            # Write one by one so that a bad record does not take the batch
+            for record in batch:
+                record_error = self._write([record])
+                if record_error is not None:
+                    self._dead_letter(record, record_error)
+        elapsed = time.perf_counter() - start
+        if self.flush_seconds is not None:
+            self.flush_seconds.observe(elapsed)
+        with self._lock:
+            self.batches += 1
+            self.last_flush_ms = round(elapsed * 1000, 3)
+
+    def _write(self, records):
+        """Store ``records`` in one transaction; return the error, if any"""
+        db = self.session_factory()
+        try:
+            for record in records:
+                self.store(db, record)
+                # Later records of the batch may update this conversation
+                db.flush()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error writing {len(records)} queued turn(s): {e}")
+            return e
+        finally:
+            db.close()
+        with self._lock:
+            self.written += len(records)
+        return None
+
+    def _dead_letter(self, record, error):
+        with self._lock:
+            self.failed += 1
+        logger.error(
+            "Dropped queued turn %s of conversation %s: %s",
+            record.get("turn_id"),
+            record.get("conversation_id"),
+            error,
+        )
+        if not self.dead_letter_path:
+            return
+        line = json.dumps(
+            {"error": str(error), "record": record}, default=_json_default
+        )
+        try:
+            with open(self.dead_letter_path, "a") as dead_letter_file:
+                dead_letter_file.write(line + "\n")
+        except OSError as e:
+            logger.error(
+                "Could not write turn %s to %s: %s",
+                record.get("turn_id"),
+                self.dead_letter_path,
+                e,
+            )
+
+    def close(self, timeout=30.0):
+        """Stop accepting records and write every queued one"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # No submit can queue a record after this; wait for room if need be
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"Write-behind writer still busy, {self._queue.qsize()} queued")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "max_depth": self.max_depth,
+                "queued": self.queued,
+                "written": self.written,
+                "batches": self.batches,
+                "failed": self.failed,
+                "retried": self.retried,
+                "sync_fallbacks": self.sync_fallbacks,
+                "last_flush_ms": self.last_flush_ms,
+            }